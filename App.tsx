@@ -461,7 +461,18 @@ export const ChatInterface: React.FC = () => {
     setIsLoading(true);
 
     try {
-      const aiResponse = await getAiTeacherResponse(query, messages, interruptionContext || undefined);
+      const reply = await getAiTeacherResponse(query, messages, interruptionContext || undefined);
+      if (reply.status === 'superseded') {
+        console.log('[App] Response superseded by a newer request, ignoring it');
+        return;
+      }
+      if (reply.status === 'queued') {
+        // A "please try again" notice: show it, but keep it out of the notes and the lesson sequence.
+        setMessages(prev => [...prev, { role: Role.ASSISTANT, content: reply.text }]);
+        setFloatingText(reply.text);
+        return;
+      }
+      const aiResponse = reply.text;
       console.log('[App] Received AI response, starting sequence');
       
       const aiMessage: Message = { role: Role.ASSISTANT, content: aiResponse };
@@ -474,7 +485,7 @@ export const ChatInterface: React.FC = () => {
       originalAiResponseRef.current = aiResponse;
       
       // Start the media sequence
-      startSequence(aiResponse);
+      startSequence(aiResponse, reply.manifest);
       
     } catch (error) {
       console.error("Error fetching AI response:", error);
@@ -0,0 +1,263 @@
+"""
+Client-side admission control in front of agent execution.
+
+A classroom burst (40 students pressing "Study" at once) would otherwise send
+40 multi-call agent runs to the provider simultaneously, hit its rate limits
+and fail late with an error string. Every agent run now first acquires a
+ticket from an AdmissionController, which enforces:
+
+  - requests-per-minute and tokens-per-minute token buckets (AIRA_LLM_RPM /
+    AIRA_LLM_TPM), charged with a per-kind estimate of the run's LLM usage
+  - a cap on concurrently running agent executions (AIRA_MAX_CONCURRENT_RUNS)
+  - priority: short answers and interruptions before follow-up turns, and
+    follow-up turns before fresh full lessons
+  - fairness: within a priority, waiting threads (thread_id / sessions) are
+    served round-robin, so one chatty session cannot starve the others
+
+If the estimated wait exceeds AIRA_ADMISSION_MAX_WAIT seconds (or the queue
+is full), the request is rejected immediately with AdmissionRejected
+carrying a queue position and retry-after, instead of failing late.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from cancellation import RunCancelled
+
+ADMISSION_ENABLED = os.environ.get("AIRA_ADMISSION", "1") == "1"
+
+KIND_SHORT = "short"                # routed casual / out-of-syllabus answers
+KIND_INTERRUPTION = "interruption"  # student interrupted a lesson
+KIND_TURN = "turn"                  # other in-syllabus turns (doubts, free-form topics)
+KIND_LESSON = "lesson"              # fresh full lesson for a lesson-index pick
+
+# kind -> (priority, estimated LLM requests, estimated tokens). Lower priority runs first.
+KIND_COSTS = {
+    KIND_SHORT: (0, 1, int(os.environ.get("AIRA_COST_SHORT_TOKENS", "1500"))),
+    KIND_INTERRUPTION: (0, 2, int(os.environ.get("AIRA_COST_INTERRUPTION_TOKENS", "6000"))),
+    KIND_TURN: (1, 3, int(os.environ.get("AIRA_COST_TURN_TOKENS", "8000"))),
+    KIND_LESSON: (2, 4, int(os.environ.get("AIRA_COST_LESSON_TOKENS", "12000"))),
+}
+
+
+def kind_for(route=None, interruption=False) -> str:
+    """Admission kind for a /chat turn given the router decision."""
+    if interruption:
+        return KIND_INTERRUPTION
+    if route in ("casual", "out_syllabus"):
+        return KIND_SHORT
+    return KIND_TURN
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after: float, queue_position: int, reason: str = "busy"):
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.queue_position = queue_position
+        self.reason = reason
+        super().__init__(f"admission rejected ({reason}): position={queue_position} retry_after={self.retry_after}s")
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding at most one minute of budget."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def clamp(self, amount: float) -> float:
+        # A single run larger than the whole bucket would otherwise never be admitted.
+        return min(amount, self.capacity)
+
+    def seconds_until(self, amount: float) -> float:
+        deficit = amount - self.level
+        return max(0.0, deficit / self.rate) if self.rate > 0 else float("inf")
+
+
+class _Ticket:
+    __slots__ = ("thread_id", "kind", "priority", "requests", "tokens", "admitted", "started")
+
+    def __init__(self, thread_id, kind):
+        self.thread_id = thread_id
+        self.kind = kind
+        self.priority, self.requests, self.tokens = KIND_COSTS.get(kind, KIND_COSTS[KIND_TURN])
+        self.admitted = False
+        self.started = None
+
+
+class AdmissionController:
+    def __init__(self, rpm, tpm, max_concurrent, max_wait, max_queue):
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._cond = threading.Condition()
+        # priority -> OrderedDict(thread_id -> deque of waiting tickets); rotation gives round-robin.
+        self._queues = {}
+        self._waiting = 0
+        self._running = 0
+        self._avg_run_seconds = 10.0
+
+    # --- queue helpers (call with self._cond held) ---
+
+    def _enqueue(self, ticket):
+        threads = self._queues.setdefault(ticket.priority, OrderedDict())
+        threads.setdefault(ticket.thread_id, deque()).append(ticket)
+        self._waiting += 1
+
+    def _remove(self, ticket):
+        threads = self._queues.get(ticket.priority, {})
+        queue = threads.get(ticket.thread_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self._waiting -= 1
+            if not queue:
+                del threads[ticket.thread_id]
+
+    def _dispatch_order(self):
+        """Waiting tickets in the order they will be admitted."""
+        for priority in sorted(self._queues):
+            queues = [list(q) for q in self._queues[priority].values()]
+            depth = max((len(q) for q in queues), default=0)
+            for i in range(depth):
+                for q in queues:
+                    if i < len(q):
+                        yield q[i]
+
+    def _dispatch(self):
+        now = time.monotonic()
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        admitted_any = False
+        while self._running < self.max_concurrent:
+            head = next(self._dispatch_order(), None)
+            if head is None:
+                break
+            requests, tokens = self._requests.clamp(head.requests), self._tokens.clamp(head.tokens)
+            if self._requests.level < requests or self._tokens.level < tokens:
+                break  # strict head-of-line: never let a later ticket overtake the head
+            self._requests.level -= requests
+            self._tokens.level -= tokens
+            threads = self._queues[head.priority]
+            threads[head.thread_id].popleft()
+            self._waiting -= 1
+            if threads[head.thread_id]:
+                threads.move_to_end(head.thread_id)
+            else:
+                del threads[head.thread_id]
+            head.admitted = True
+            head.started = now
+            self._running += 1
+            admitted_any = True
+        if admitted_any:
+            self._cond.notify_all()
+
+    def _estimate(self, ticket):
+        """(1-based queue position, estimated seconds until admission) for a waiting ticket."""
+        ahead_requests = ahead_tokens = 0
+        position = 0
+        for position, queued in enumerate(self._dispatch_order(), start=1):
+            ahead_requests += queued.requests
+            ahead_tokens += queued.tokens
+            if queued is ticket:
+                break
+        wait = max(
+            self._requests.seconds_until(ahead_requests),
+            self._tokens.seconds_until(ahead_tokens),
+        )
+        if self._running >= self.max_concurrent:
+            rounds = math.ceil(position / max(1, self.max_concurrent))
+            wait = max(wait, rounds * self._avg_run_seconds)
+        return position, wait
+
+    # --- public API ---
+
+    def acquire(self, thread_id, kind, cancel_event=None):
+        ticket = _Ticket(thread_id or "anonymous", kind)
+        with self._cond:
+            if self._waiting >= self.max_queue:
+                raise AdmissionRejected(self._avg_run_seconds, self._waiting + 1, reason="queue full")
+            self._enqueue(ticket)
+            self._dispatch()
+            if not ticket.admitted:
+                position, wait = self._estimate(ticket)
+                if wait > self.max_wait:
+                    self._remove(ticket)
+                    raise AdmissionRejected(wait, position)
+                print(f"[DEBUG] admission: queued thread={ticket.thread_id} kind={kind} position={position} est_wait={wait:.1f}s")
+            deadline = time.monotonic() + self.max_wait
+            while not ticket.admitted:
+                if cancel_event is not None and cancel_event.is_set():
+                    # Superseded while queued (e.g. the student interrupted): give up the slot.
+                    self._remove(ticket)
+                    self._dispatch()
+                    raise RunCancelled("superseded while waiting for admission")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    position, wait = self._estimate(ticket)
+                    self._remove(ticket)
+                    self._dispatch()  # the removed ticket may have been blocking the head of line
+                    raise AdmissionRejected(wait, position, reason="wait timeout")
+                # Wake periodically so bucket refills are noticed without a release.
+                self._cond.wait(min(remaining, 0.25))
+                self._dispatch()
+        return ticket
+
+    def release(self, ticket):
+        with self._cond:
+            self._running -= 1
+            if ticket.started is not None:
+                elapsed = time.monotonic() - ticket.started
+                self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * elapsed
+            self._dispatch()
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            return {
+                "running": self._running,
+                "waiting": self._waiting,
+                "requests_available": round(self._requests.level, 1),
+                "tokens_available": round(self._tokens.level),
+                "avg_run_seconds": round(self._avg_run_seconds, 2),
+            }
+
+    @contextmanager
+    def admit(self, thread_id, kind, cancel_event=None):
+        """Hold an admission ticket for the duration of one agent run."""
+        ticket = self.acquire(thread_id, kind, cancel_event)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+
+controller = AdmissionController(
+    rpm=float(os.environ.get("AIRA_LLM_RPM", "60")),
+    tpm=float(os.environ.get("AIRA_LLM_TPM", "120000")),
+    max_concurrent=int(os.environ.get("AIRA_MAX_CONCURRENT_RUNS", "8")),
+    max_wait=float(os.environ.get("AIRA_ADMISSION_MAX_WAIT", "20")),
+    max_queue=int(os.environ.get("AIRA_ADMISSION_MAX_QUEUE", "200")),
+)
+
+
+@contextmanager
+def admit(thread_id, kind, cancel_event=None):
+    """Module-level entry point; a no-op when AIRA_ADMISSION=0."""
+    if not ADMISSION_ENABLED:
+        yield None
+        return
+    with controller.admit(thread_id, kind, cancel_event) as ticket:
+        yield ticket
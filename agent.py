@@ -1,8 +1,17 @@
-from langchain_openai import ChatOpenAI   # OpenAI-compatible wrapper for Groq
+from llm_gateway import LLM_BASE_URL, LLM_MODEL, chat_model   # pooled ChatOpenAI for Groq
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.prebuilt import create_react_agent
 from agent_tools import knowledgebase_tool, image_tool, video_tool
+import agent_tools
+from router import ROUTE_CASUAL, ROUTE_OUT_OF_SYLLABUS
+from singleflight import SingleFlight, TTLCache
+from admission import AdmissionRejected, KIND_LESSON, admit, kind_for
+from cancellation import RunCancelled, run_cancellable, runs
+from corpus import current_shard, shard_resource
+from media_manifest import record_tool_outputs
+from utils import normalize_title
 import traceback
+import uuid
 import os
 from pathlib import Path
 try:
@@ -28,14 +37,23 @@ if not GROQ_API_KEY:
 # =======================
 agent = None
 llm = None
+light_llm = None
 if GROQ_API_KEY:
-    llm = ChatOpenAI(
-        model="llama-3.3-70b-versatile",   # choices: "llama3-70b-8192", "mixtral-8x7b-32768", "llama3-8b-8192"
+    # Both models share llm_gateway's pooled clients: deadlines, jittered retries,
+    # failover and hedging to AIRA_LLM_SECONDARY_URL (see llm_gateway.py).
+    llm = chat_model(
+        GROQ_API_KEY,
+        model=LLM_MODEL,   # AIRA_LLM_MODEL; choices: "llama3-70b-8192", "mixtral-8x7b-32768", "llama3-8b-8192"
         temperature=0.7,
-        api_key=GROQ_API_KEY,
-        base_url="https://api.groq.com/openai/v1"
     )
-    print(f"[DEBUG] Initialized Groq LLM: model={llm.model_name}, temperature={llm.temperature}")
+    print(f"[DEBUG] Initialized Groq LLM: model={llm.model_name}, temperature={llm.temperature}, base_url={LLM_BASE_URL}")
+    # Short-answer model for routed casual / out-of-syllabus turns (no tools bound).
+    light_llm = chat_model(
+        GROQ_API_KEY,
+        model=LLM_MODEL,
+        temperature=0.7,
+        max_tokens=int(os.environ.get("AIRA_LIGHT_MAX_TOKENS", "300")),
+    )
 
 agent_system_prompt = """
 You are an engaging, empathetic, and knowledgeable AI science teacher for middle-school students.  
@@ -100,6 +118,23 @@ INSTRUCTIONS:
  - video_tool  
 """
 
+# Prompts for turns the router sends down the light path (one short generation, no tools).
+casual_system_prompt = """
+You are a warm, friendly AI science teacher for middle-school students.
+The student is making casual conversation (a greeting, thanks, or goodbye).
+Reply warmly in one to three short sentences. Do not start a new lesson.
+If a lesson is in progress, gently invite the student to continue it or ask a doubt.
+"""
+
+out_of_syllabus_system_prompt = """
+You are an engaging, empathetic AI science teacher for middle-school students.
+The student's question is outside their science syllabus. Begin with:
+"You're asking something outside your syllabus, but here's a brief overview:"
+Then give a short, simple, student-friendly explanation (a few sentences).
+Finally, gently guide the student back to their syllabus topics.
+Never output tool calls or code-formatted markup.
+"""
+
 # Template for the agent
 template = """
 Answer the following questions as best you can. You have access to the following tools:
@@ -138,13 +173,210 @@ if llm is not None:
         prompt=agent_system_prompt,
         checkpointer=memory_saver
     )
+    # Light agents share the checkpointer so routed turns stay in the thread history.
+    light_agents = {
+        ROUTE_CASUAL: create_react_agent(
+            light_llm, tools=[], prompt=casual_system_prompt, checkpointer=memory_saver
+        ),
+        ROUTE_OUT_OF_SYLLABUS: create_react_agent(
+            light_llm, tools=[], prompt=out_of_syllabus_system_prompt, checkpointer=memory_saver
+        ),
+    }
+else:
+    light_agents = {}
+
+# =======================
+# Warmup / readiness
+# =======================
+def warmup() -> None:
+    """Load embedding models, FAISS indexes and JSON corpora so the first request is fast."""
+    agent_tools.warmup()
+
+
+def preload_assets() -> None:
+    """Map the FAISS indexes and .npy/JSON assets without loading the encoder (gunicorn master)."""
+    agent_tools.preload_assets()
+
+
+def is_ready() -> bool:
+    """True once the retrieval resources used by the agent's tools are in memory."""
+    return agent_tools.is_ready()
 
 # =======================
 # Query function
 # =======================
-def ask_agent(question: str, thread_id="main") -> str:
+def run_agent(question: str, thread_id="main", route=None, handle=None) -> str:
+    """
+    Run one agent turn and return the final message text.
+    Unlike ask_agent, errors propagate to the caller (used by batch jobs).
+    The run executes on the shared agent event loop; cancelling `handle`
+    (a cancellation.RunHandle) aborts in-flight LLM and tool calls.
+    """
+    if agent is None:
+        raise RuntimeError("LLM is disabled because GROQ_API_KEY is not set")
+    runner = light_agents.get(route, agent)
+    print(f"[DEBUG] Calling agent.invoke with question: {question} | thread_id: {thread_id} | route: {route}")
+    response = run_cancellable(
+        lambda: runner.ainvoke(
+            {"messages": [("human", question)]},
+            config={"configurable": {"thread_id": thread_id}}
+        ),
+        handle,
+    )
+    if response and response.get("messages"):
+        record_tool_outputs(response["messages"])
+        output = response["messages"][-1].content
+        print(f"[DEBUG] AI output (final message, first 200 chars): {output[:200]}...")
+        return output
+    print("[DEBUG] agent.invoke: No messages in response, returning empty string.")
+    return ""
+
+
+def record_turn(question: str, answer: str, thread_id="main") -> None:
+    """
+    Append a question/answer pair to a thread's history without calling the LLM,
+    e.g. when /chat serves a pre-generated lesson, so follow-ups have context.
+    """
+    if agent is None:
+        return
+    agent.update_state(
+        {"configurable": {"thread_id": thread_id}},
+        {"messages": [("human", question), ("ai", answer)]},
+        as_node="agent",
+    )
+
+
+def rollback_thread(thread_id: str, checkpoint_config: dict) -> None:
+    """
+    Make `checkpoint_config` (a state config captured before a run) the thread's
+    latest checkpoint again, discarding partial writes of a cancelled or failed
+    run such as an AI tool call without its tool result.
+    """
+    if checkpoint_config.get("configurable", {}).get("checkpoint_id") is None:
+        forget_thread(thread_id)  # the thread had no history before the run
+    else:
+        agent.update_state(checkpoint_config, None, as_node="__copy__")
+    print(f"[DEBUG] Rolled back thread {thread_id} to its pre-run checkpoint")
+
+
+def run_agent_on_thread(question: str, thread_id: str, route=None, handle=None) -> str:
+    """run_agent with rollback to the pre-run checkpoint if the run is cancelled or fails."""
+    before = agent.get_state({"configurable": {"thread_id": thread_id}}).config
+    try:
+        return run_agent(question, thread_id=thread_id, route=route, handle=handle)
+    except BaseException:
+        rollback_thread(thread_id, before)
+        raise
+
+
+def deliver_lesson(title: str, lesson: str, thread_id="main") -> None:
+    """Record an already-generated lesson on a thread, serialized with its agent runs."""
+    with runs.exclusive(thread_id):
+        record_turn(title, lesson, thread_id=thread_id)
+
+
+def forget_thread(thread_id: str) -> None:
+    """Drop a thread's checkpoints (used for throwaway generation threads)."""
+    delete_thread = getattr(memory_saver, "delete_thread", None)
+    if delete_thread is not None:
+        delete_thread(thread_id)
+
+
+# Concurrent picks of the same lesson-index topic share one generation.
+lesson_flight = SingleFlight("lesson")
+
+# With AIRA_PREFETCH_LESSONS=1, generated lessons are kept per shard snapshot so a
+# lesson speculatively generated by prefetch.py is served to the student who picks it.
+PREFETCH_LESSONS = os.environ.get("AIRA_PREFETCH_LESSONS", "0") == "1"
+LESSON_CACHE_TTL = float(os.environ.get("AIRA_LESSON_CACHE_TTL", "3600")) if PREFETCH_LESSONS else 0.0
+
+
+@shard_resource
+def get_lesson_cache(shard):
+    return TTLCache(f"lesson:{shard.id}", LESSON_CACHE_TTL, int(os.environ.get("AIRA_LESSON_CACHE_SIZE", "64")))
+
+
+def generate_lesson(title: str) -> str:
+    """Generate a fresh lesson for a topic in a throwaway thread (errors propagate)."""
+    generation_thread = f"lesson-{uuid.uuid4()}"
+    try:
+        return run_agent(title, thread_id=generation_thread)
+    finally:
+        forget_thread(generation_thread)
+
+
+def ask_lesson(title: str, thread_id="main") -> str:
+    """
+    Answer a lesson-index pick. Identical in-flight picks are coalesced into one
+    generation; every caller gets the result recorded in its own thread history.
+    The shared generation is admitted as its own "lesson:<shard>:<title>" owner, so
+    it is not billed to whichever student asked first. If that admission is
+    rejected, each caller queues on its own thread instead and AdmissionRejected
+    only ever reports the caller's own queue position.
+    """
+    if agent is None:
+        return ask_agent(title, thread_id=thread_id)
+
+    key = (current_shard().id, normalize_title(title))
+
+    def shared_generation():
+        # The shared generation is not tied to one student's cancellation.
+        with admit(f"lesson:{key[0]}:{key[1]}", KIND_LESSON):
+            return generate_lesson(title)
+
+    def own_generation(handle):
+        # Already admitted: coalesce only with other admitted callers, never with a
+        # shared generation whose admission could be rejected again.
+        with admit(thread_id, KIND_LESSON, handle.cancel_event):
+            return lesson_flight.do((*key, "admitted"), lambda: generate_lesson(title))
+
+    # Claim the thread so an interruption supersedes this request, but only hold
+    # the thread lock to record the result: the shared generation runs unlocked.
+    with runs.claim(thread_id) as handle:
+        try:
+            try:
+                lesson = get_lesson_cache().get_or_call(key, lambda: lesson_flight.do(key, shared_generation))
+            except AdmissionRejected:
+                # The shared owner's rejection is nobody's queue position; ask for our own.
+                lesson = get_lesson_cache().get_or_call(key, lambda: own_generation(handle))
+        except (AdmissionRejected, RunCancelled):
+            raise
+        except Exception as e:
+            print(f"[ERROR] shared lesson generation failed for '{title}': {e}")
+            traceback.print_exc()
+            return f"Sorry, an error occurred while processing your request: {e}"
+        with runs.locked(handle):
+            record_turn(title, lesson, thread_id=thread_id)
+    return lesson
+
+
+def prefetch_lesson(title: str) -> bool:
+    """
+    Generate a lesson-index pick into the lesson cache before anyone asks for it.
+    Returns False when lesson prefetch is off or the lesson is already cached.
+    """
+    key = (current_shard().id, normalize_title(title))
+    cache = get_lesson_cache()
+    if agent is None or not PREFETCH_LESSONS or key in cache:
+        return False
+
+    def admitted_generation():
+        with admit("prefetch", KIND_LESSON):
+            return generate_lesson(title)
+
+    cache.get_or_call(key, lambda: lesson_flight.do(key, admitted_generation))
+    return True
+
+
+def ask_agent(question: str, thread_id="main", route=None, kind=None) -> str:
     """
     Send a query to the AI Teacher Agent and get a response.
+    `route` is the router decision (see router.route_query); casual and
+    out-of-syllabus turns run a tool-free agent that makes one short generation.
+    `kind` is the admission class (see admission.py); the run waits for an
+    admission ticket and AdmissionRejected propagates to the caller.
+    Runs on one thread are serialized; a newer request on the same thread
+    cancels this one, which then raises RunCancelled after rolling back.
     If no GROQ_API_KEY is configured, return a friendly fallback message so the server stays up.
     """
     if agent is None:
@@ -152,19 +384,12 @@ def ask_agent(question: str, thread_id="main") -> str:
             "LLM is disabled because GROQ_API_KEY is not set on the server. "
             "Set GROQ_API_KEY and restart the backend to enable AI answers."
         )
-    print(f"[DEBUG] Calling agent.invoke with question: {question} | thread_id: {thread_id}")
     try:
-        response = agent.invoke(
-            {"messages": [("human", question)]},
-            config={"configurable": {"thread_id": thread_id}}
-        )
-        if response and response.get("messages"):
-            output = response["messages"][-1].content
-            print(f"[DEBUG] AI output (final message, first 200 chars): {output[:200]}...")
-            return output
-        else:
-            print("[DEBUG] agent.invoke: No messages in response, returning empty string.")
-            return ""
+        with runs.exclusive(thread_id) as handle:
+            with admit(thread_id, kind or kind_for(route), handle.cancel_event):
+                return run_agent_on_thread(question, thread_id, route=route, handle=handle)
+    except (AdmissionRejected, RunCancelled):
+        raise
     except Exception as e:
         # Log detailed error and surface helpful hint when function calling fails
         error_text = str(e)
@@ -1,70 +1,231 @@
 from langchain.tools import tool
-from utils import search
+from utils import search, lazy_resource, get_model
+from corpus import current_shard, shard_resource
+from singleflight import SingleFlight, TTLCache, normalize_topic
+from cancellation import raise_if_cancelled
+import utils
 import json
 import os
+import re
 from textwrap import dedent
-import yt_dlp
-import faiss
-import torch
-from sentence_transformers import SentenceTransformer
+
+# Local catalog of vetted videos (see build_video_catalog.py). A catalog hit at or
+# above this cosine similarity skips live YouTube search entirely.
+VIDEO_CATALOG_THRESHOLD = float(os.environ.get("AIRA_VIDEO_CATALOG_THRESHOLD", "0.45"))
+VIDEO_CATALOG_EMBEDDINGS_ASSET = "video_catalog.npy"
+# Entries found by build_video_catalog.py's search are served only once a reviewer has
+# marked them "vetted": true; AIRA_VIDEO_CATALOG_UNVETTED=1 serves them before review.
+VIDEO_CATALOG_UNVETTED = os.environ.get("AIRA_VIDEO_CATALOG_UNVETTED", "0") == "1"
+
+# Figure-level retrieval: image_tool ranks the figures of the FIGURE_SUBCHAPTERS
+# best-matching subchapters by description similarity and returns at most
+# FIGURE_TOP_K of them scoring at least FIGURE_THRESHOLD (cosine).
+FIGURE_EMBEDDINGS_ASSET = "figure_embeddings.npy"
+FIGURE_SUBCHAPTERS = int(os.environ.get("AIRA_FIGURE_SUBCHAPTERS", "3"))
+FIGURE_TOP_K = int(os.environ.get("AIRA_FIGURE_TOP_K", "3"))
+FIGURE_THRESHOLD = float(os.environ.get("AIRA_FIGURE_THRESHOLD", "0.35"))
+
+# Recent tool results per shard snapshot (a reload starts empty). Filled by live
+# calls and by prefetch.py warming the next subchapters of a lesson.
+TOOL_CACHE_TTL = float(os.environ.get("AIRA_TOOL_CACHE_TTL", "1800"))
+TOOL_CACHE_SIZE = int(os.environ.get("AIRA_TOOL_CACHE_SIZE", "512"))
 
 # === New Image Retrieval Logic ===
-# Resolve paths relative to the project root to avoid hardcoded absolute paths
-PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-FIGURE_JSON = os.path.join(PROJECT_ROOT, "output.json")
-IMAGE_DIR = os.path.join(PROJECT_ROOT, "images")
-FAISS_INDEX_FILE = os.path.join(PROJECT_ROOT, "subchapter_faiss.index")
-METADATA_FILE = os.path.join(PROJECT_ROOT, "subchapter_metadata.json")
-
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"[DEBUG] agent_tools: Using device={device}")
-try:
-    image_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2").to(device)
-    print("[DEBUG] agent_tools: Loaded sentence-transformers model all-MiniLM-L6-v2")
-except Exception as e:
-    print(f"[WARN] agent_tools: Failed to load sentence-transformers model: {e}")
-    image_model = None
-
-try:
-    with open(FIGURE_JSON, "r", encoding="utf-8") as f:
-        figures_data = json.load(f)
-    print(f"[DEBUG] agent_tools: Loaded figures JSON from {FIGURE_JSON}, count={len(figures_data)}")
-except Exception as e:
-    print(f"[WARN] agent_tools: Could not read {FIGURE_JSON}: {e}")
-    figures_data = []
-
-try:
-    with open(METADATA_FILE, "r", encoding="utf-8") as f:
-        metadata_figures = json.load(f)
-    print(f"[DEBUG] agent_tools: Loaded metadata JSON from {METADATA_FILE}, keys={len(metadata_figures)}")
-except Exception as e:
-    print(f"[WARN] agent_tools: Could not read {METADATA_FILE}: {e}")
-    metadata_figures = {}
-
-try:
-    index_figures = faiss.read_index(FAISS_INDEX_FILE)
-    print(f"[DEBUG] agent_tools: Loaded FAISS index from {FAISS_INDEX_FILE}")
-except Exception as e:
-    print(f"[WARN] agent_tools: Could not read FAISS index {FAISS_INDEX_FILE}: {e}")
-    index_figures = None
-
-
-def get_image_path(figure_ref, image_dir=IMAGE_DIR):
+# Figure files belong to the current textbook shard (see corpus.py).
+# Models, indexes and JSON files are loaded lazily (and at most once per shard)
+# on first use or by `warmup()`, so importing this module does not block server startup.
+
+
+@lazy_resource
+def get_image_model():
+    # Shares the MiniLM instance loaded by utils instead of keeping a second copy.
+    try:
+        model = get_model()
+        print(f"[DEBUG] agent_tools: Using shared MiniLM encoder ({model.name} backend)")
+        return model
+    except Exception as e:
+        print(f"[WARN] agent_tools: Failed to load sentence-transformers model: {e}")
+        return None
+
+
+@shard_resource
+def get_figures_data(shard):
+    figure_json = shard.file("figures")
+    try:
+        with open(figure_json, "r", encoding="utf-8") as f:
+            figures_data = json.load(f)
+        print(f"[DEBUG] agent_tools: Loaded figures JSON from {figure_json}, count={len(figures_data)}")
+        return figures_data
+    except Exception as e:
+        print(f"[WARN] agent_tools: Could not read {figure_json}: {e}")
+        return []
+
+
+@shard_resource
+def get_metadata_figures(shard):
+    metadata_file = shard.file("figure_metadata")
+    try:
+        with open(metadata_file, "r", encoding="utf-8") as f:
+            metadata_figures = json.load(f)
+        print(f"[DEBUG] agent_tools: Loaded metadata JSON from {metadata_file}, keys={len(metadata_figures)}")
+        return metadata_figures
+    except Exception as e:
+        print(f"[WARN] agent_tools: Could not read {metadata_file}: {e}")
+        return {}
+
+
+@shard_resource
+def get_index_figures(shard):
+    faiss_index_file = shard.file("figure_index")
+    try:
+        index_figures = utils.read_faiss_index(faiss_index_file)
+        print(f"[DEBUG] agent_tools: Loaded FAISS index from {faiss_index_file}")
+        return index_figures
+    except Exception as e:
+        print(f"[WARN] agent_tools: Could not read FAISS index {faiss_index_file}: {e}")
+        return None
+
+
+def figure_text(figure):
+    """Text embedded for a figure: its description (which starts with the figure number)."""
+    return figure.get("description") or figure["figure"]
+
+
+@shard_resource
+def get_figure_embeddings(shard):
+    """
+    L2-normalized description embedding per figure, rows in get_figures_data order,
+    or None if the shard has no figures. Precomputed by build_assets.py.
+    """
+    figures = get_figures_data(shard)
+    if not figures:
+        return None
+    embeddings = utils.load_mmap_array(shard.asset(FIGURE_EMBEDDINGS_ASSET))
+    if embeddings is None or len(embeddings) != len(figures):
+        print(f"[WARN] agent_tools: figure embeddings missing or stale; embedding {len(figures)} descriptions in memory")
+        embeddings = get_model().encode(
+            [figure_text(f) for f in figures], convert_to_numpy=True, normalize_embeddings=True
+        ).astype("float32")
+    return embeddings
+
+
+@shard_resource
+def get_figure_rows(shard):
+    """subchapter -> array of its rows in get_figures_data / get_figure_embeddings."""
+    import numpy as np
+    rows = {}
+    for row, figure in enumerate(get_figures_data(shard)):
+        rows.setdefault(figure["subchapter"], []).append(row)
+    return {subchapter: np.array(r, dtype=np.int64) for subchapter, r in rows.items()}
+
+
+def video_catalog_text(entry):
+    """Text embedded for a catalog video: its title plus the subchapters and topics it covers."""
+    return ". ".join([entry["title"]] + entry.get("subchapters", []) + entry.get("topics", []))
+
+
+@shard_resource
+def get_video_catalog(shard):
+    """
+    (entries, normalized embeddings) of the shard's vetted video catalog, or None
+    if it has none. Embeddings come from build_assets.py when they match the catalog.
+    Unreviewed entries are left out unless AIRA_VIDEO_CATALOG_UNVETTED=1.
+    """
+    catalog_file = shard.file("video_catalog")
+    try:
+        with open(catalog_file, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[WARN] agent_tools: Could not read video catalog {catalog_file}: {e}")
+        return None
+    if not entries:
+        return None
+    embeddings = utils.load_mmap_array(shard.asset(VIDEO_CATALOG_EMBEDDINGS_ASSET))
+    if embeddings is None or len(embeddings) != len(entries):
+        print(f"[WARN] agent_tools: video catalog embeddings missing or stale; embedding {len(entries)} videos in memory")
+        embeddings = get_model().encode(
+            [video_catalog_text(e) for e in entries], convert_to_numpy=True, normalize_embeddings=True
+        ).astype("float32")
+    if not VIDEO_CATALOG_UNVETTED:
+        rows = [row for row, entry in enumerate(entries) if entry.get("vetted")]
+        if len(rows) < len(entries):
+            print(f"[DEBUG] agent_tools: {len(entries) - len(rows)} unvetted catalog videos are not served")
+        if not rows:
+            return None
+        entries, embeddings = [entries[row] for row in rows], embeddings[rows]
+    print(f"[DEBUG] agent_tools: Loaded video catalog from {catalog_file}, count={len(entries)}")
+    return entries, embeddings
+
+
+def search_video_catalog(topic, threshold=None):
+    """Best catalog video for a topic as {"title", "url", "id", "channel", "score"}, or None below threshold."""
+    catalog = get_video_catalog()
+    if catalog is None:
+        return None
+    entries, embeddings = catalog
+    query_embedding = get_model().encode([topic], convert_to_numpy=True, normalize_embeddings=True)[0]
+    scores = embeddings @ query_embedding
+    best = int(scores.argmax())
+    score = float(scores[best])
+    threshold = VIDEO_CATALOG_THRESHOLD if threshold is None else threshold
+    print(f"[DEBUG] video catalog: '{topic}' -> '{entries[best]['title']}' score={score:.3f} (threshold {threshold})")
+    if score < threshold:
+        return None
+    return dict(entries[best], score=score)
+
+
+def warmup():
+    """Load the text-search resources in utils plus the figure-search resources used by image_tool."""
+    utils.warmup()
+    get_image_model()
+    get_figures_data()
+    get_metadata_figures()
+    get_index_figures()
+    get_figure_embeddings()
+    get_figure_rows()
+    get_video_catalog()
+
+
+def preload_assets():
+    """Encoder-free part of warmup() (see utils.preload_assets), for a pre-fork master."""
+    utils.preload_assets()
+    figures = get_figures_data()
+    get_metadata_figures()
+    get_index_figures()
+    get_figure_rows()
+    embeddings = utils.load_mmap_array(current_shard().asset(FIGURE_EMBEDDINGS_ASSET))
+    if figures and embeddings is not None and len(embeddings) == len(figures):
+        get_figure_embeddings()
+
+
+def is_ready():
+    # Only inspect already-loaded resources; a readiness probe must never trigger a load.
+    return (
+        utils.is_ready()
+        and get_image_model.is_loaded() and get_image_model() is not None
+        and get_index_figures.is_loaded() and get_index_figures() is not None
+    )
+
+
+def get_image_path(figure_ref, image_dir=None):
     base_name = figure_ref.replace(" ", "_")
     attempts = [
         f"{base_name}.png",
         f"{base_name}.jpg",
         f"figure_{base_name}.png"
     ]
-    for attempt in attempts:
-        test_path = os.path.join(image_dir, attempt)
-        if os.path.exists(test_path):
-            return test_path
+    for folder in [image_dir] if image_dir else utils.get_image_dirs():
+        for attempt in attempts:
+            test_path = os.path.join(folder, attempt)
+            if os.path.exists(test_path):
+                return test_path
     return None
 
 
 def fetch_figures_only(subchapter_name):
-    figures = [fig for fig in figures_data if fig["subchapter"] == subchapter_name]
+    figures = [fig for fig in get_figures_data() if fig["subchapter"] == subchapter_name]
     figure_blocks = []
     for fig in figures:
         fig_path = get_image_path(fig['figure'])
@@ -77,23 +238,72 @@ def fetch_figures_only(subchapter_name):
     return figure_blocks
 
 
-def search_subchapter_by_query(query, top_k=1):
-    if image_model is None or index_figures is None or not metadata_figures:
-        print("[DEBUG] agent_tools: search_subchapter_by_query skipped due to missing resources")
-        return None
-    query_embedding = image_model.encode([query], convert_to_numpy=True).astype('float32')
-    _, indices = index_figures.search(query_embedding.reshape(1, -1), top_k)
-    best_match_index = str(indices[0][0])
-    result = metadata_figures.get(best_match_index, None)
-    print(f"[DEBUG] agent_tools: search_subchapter_by_query -> {result}")
-    return result
+def search_subchapters_by_embedding(query_embedding, top_n=FIGURE_SUBCHAPTERS):
+    """Up to top_n distinct subchapters from the figure index, best match first."""
+    index_figures = get_index_figures()
+    metadata_figures = get_metadata_figures()
+    if index_figures is None or not metadata_figures:
+        return []
+    # The index has one row per figure, so look a few rows deeper to find top_n distinct subchapters.
+    _, indices = index_figures.search(query_embedding.reshape(1, -1), min(int(index_figures.ntotal), top_n * 4))
+    subchapters = []
+    for row in indices[0]:
+        subchapter = metadata_figures.get(str(int(row))) if row >= 0 else None
+        if subchapter and subchapter not in subchapters:
+            subchapters.append(subchapter)
+            if len(subchapters) == top_n:
+                break
+    return subchapters
 
 
-def fetch_images_for_topic(query):
-    subchapter = search_subchapter_by_query(query)
-    if not subchapter:
+def rank_figures(query, top_k=None, threshold=None):
+    """
+    The figures best matching `query` among the top subchapters' figures, as
+    {"name", "path", "desc", "subchapter", "score"}: one matrix-vector product over
+    the candidates' precomputed description embeddings, best first, at most top_k,
+    none below threshold, only figures whose image file exists.
+    """
+    import numpy as np
+    image_model = get_image_model()
+    figures = get_figures_data()
+    embeddings = get_figure_embeddings()
+    if image_model is None or embeddings is None:
+        print("[DEBUG] agent_tools: rank_figures skipped due to missing resources")
+        return []
+    top_k = FIGURE_TOP_K if top_k is None else top_k
+    threshold = FIGURE_THRESHOLD if threshold is None else threshold
+    query_embedding = image_model.encode([query], convert_to_numpy=True, normalize_embeddings=True)[0].astype("float32")
+    subchapters = search_subchapters_by_embedding(query_embedding)
+    figure_rows = get_figure_rows()
+    candidates = [figure_rows[s] for s in subchapters if s in figure_rows]
+    if not candidates:
         return []
-    return fetch_figures_only(subchapter)
+    rows = np.concatenate(candidates)
+    scores = np.asarray(embeddings[rows]) @ query_embedding
+    ranked = []
+    for position in np.argsort(-scores):
+        score = float(scores[position])
+        if score < threshold or len(ranked) == top_k:
+            break
+        figure = figures[int(rows[position])]
+        path = get_image_path(figure["figure"])
+        if path:
+            ranked.append({
+                "name": figure["figure"],
+                "path": path,
+                "desc": figure["description"],
+                "subchapter": figure["subchapter"],
+                "score": score,
+            })
+    print(
+        f"[DEBUG] agent_tools: rank_figures '{query}' subchapters={subchapters} candidates={len(rows)} "
+        f"-> {[(f['name'], round(f['score'], 3)) for f in ranked]}"
+    )
+    return ranked
+
+
+def fetch_images_for_topic(query):
+    return rank_figures(query)
 
 
 def is_topic_in_syllabus(topic: str) -> bool:
@@ -122,38 +332,75 @@ def is_topic_in_syllabus(topic: str) -> bool:
 
 def determine_topic_type(topic: str) -> str:
     """
-    Determine if topic is in syllabus, out of syllabus, or casual chat
+    Determine if topic is in syllabus, out of syllabus, or casual chat.
+    Delegates to the pre-LLM router (casual heuristic + embedding syllabus check).
     """
-    # Simple heuristic for casual chat
-    casual_indicators = ["hello", "hi", "how are you", "good morning", "good afternoon", "thanks", "thank you"]
-    if any(indicator in topic.lower() for indicator in casual_indicators):
-        return "casual"
-    
-    # Check if in syllabus
-    if is_topic_in_syllabus(topic):
-        return "in_syllabus"
-    else:
-        return "out_syllabus"
+    from router import route_query
+    return route_query(topic)["route"]
 
 
 # === Tools ===
+# Concurrent identical tool calls (e.g. a whole class opening the same lesson)
+# are coalesced: one execution per shard and normalized topic, shared by every waiter.
+tool_flight = SingleFlight("tool")
+
+
+@shard_resource
+def get_tool_cache(shard):
+    return TTLCache(f"tool:{shard.id}", TOOL_CACHE_TTL, TOOL_CACHE_SIZE)
+
+
+def cached_tool_call(kind, key, fn):
+    """A recent result for (kind, key) in the current shard, else one coalesced call to fn."""
+    return get_tool_cache().get_or_call((kind, key), lambda: tool_flight.do((kind, current_shard().id, key), fn))
+
+
+def prefetch_topic(topic: str) -> None:
+    """Warm the tool cache with the calls a lesson on `topic` is expected to make."""
+    for variant in dict.fromkeys([topic, re.sub(r"^[\d.\s]+", "", topic).strip()]):
+        if len(variant) < 3:
+            continue
+        knowledgebase_tool.func(variant)
+        image_tool.func(variant)
+        video_tool.func(variant)
+
+
+def knowledgebase_lookup(query: str) -> str:
+    """
+    A query naming a whole subchapter title returns that subchapter (lessons teach all
+    of it); any other query, including a single word from a title such as "acid",
+    returns only the best passages within utils.PASSAGE_BUDGET_CHARS,
+    which keeps doubt and follow-up observations short in the thread history.
+    """
+    results = search(query, mode="exact", top_k=1)
+    if results:
+        return results[0]['content']
+    if utils.PASSAGE_BUDGET_CHARS <= 0:
+        results = search(query, mode="semantic", top_k=1)
+        return results[0]['content'] if results else "Sorry, I couldn't find information for that topic."
+    passages = search(query, mode="passage")
+    if not passages:
+        return "Sorry, I couldn't find information for that topic."
+    return "\n\n".join(f"[{p['title_key']}]\n{p['content']}" for p in passages)
+
 
 @tool
 def knowledgebase_tool(query: str) -> str:
     """Retrieves explanations from the science textbook knowledge base."""
     print(f"[DEBUG] knowledgebase_tool called with query: {query}")
-    results = search(query, mode="hybrid", top_k=1)
-    if results:
-        output = results[0]['content']
-    else:
-        output = "Sorry, I couldn't find information for that topic."
-    return output
+    raise_if_cancelled()
+    return cached_tool_call("knowledgebase", normalize_topic(query), lambda: knowledgebase_lookup(query))
 
 
 @tool
 def image_tool(topic: str) -> str:
     """Fetches relevant figures and descriptive details for a science topic."""
     print(f"[DEBUG] image_tool called with topic: {topic}")
+    raise_if_cancelled()
+    return cached_tool_call("image", normalize_topic(topic), lambda: image_lookup(topic))
+
+
+def image_lookup(topic: str) -> str:
     results = fetch_images_for_topic(topic)
     if isinstance(results, str):
         output = results
@@ -165,10 +412,11 @@ def image_tool(topic: str) -> str:
     print(f"[DEBUG] image_tool output:\n{output}\n")
     return output
 
-def fetch_educational_videos(topic, num_videos=3):
+def fetch_educational_videos(topic, num_videos=3, allow_fallback=True):
     """
     Fetch educational science videos for older students.
     Focuses on clear scientific explanations rather than just animations.
+    With allow_fallback=False, the relaxed last-resort search is skipped.
     """
     print(f"[DEBUG] fetch_educational_videos searching for: {topic}")
     
@@ -211,6 +459,7 @@ def fetch_educational_videos(topic, num_videos=3):
     for search_query in search_strategies:
         try:
             print(f"[DEBUG] Trying search: {search_query}")
+            import yt_dlp
             
             ydl_opts = {
                 "quiet": True,
@@ -241,7 +490,8 @@ def fetch_educational_videos(topic, num_videos=3):
                                 "title": video["title"],
                                 "url": url,
                                 "id": video_id,
-                                "channel": video.get('uploader', 'Unknown')
+                                "channel": video.get('uploader', 'Unknown'),
+                                "duration": video.get('duration')
                             }
                             
         except Exception as e:
@@ -249,6 +499,8 @@ def fetch_educational_videos(topic, num_videos=3):
             continue
     
     # Final attempt with relaxed criteria
+    if not allow_fallback:
+        return None
     return try_educational_fallback(cleaned_topic, seen_video_ids)
 
 
@@ -349,6 +601,7 @@ def try_educational_fallback(topic, seen_video_ids):
     print(f"[DEBUG] Trying educational fallback for: {topic}")
     
     try:
+        import yt_dlp
         ydl_opts = {
             "quiet": True,
             "extract_flat": True,
@@ -381,7 +634,8 @@ def try_educational_fallback(topic, seen_video_ids):
                             "title": video["title"],
                             "url": url,
                             "id": video_id,
-                            "channel": video.get('uploader', 'Unknown')
+                            "channel": video.get('uploader', 'Unknown'),
+                            "duration": video.get('duration')
                         }
                         
     except Exception as e:
@@ -407,6 +661,22 @@ def video_tool(topic: str) -> str:
         print(f"[DEBUG] video_tool output:\n{output}\n")
         return output
     
+    raise_if_cancelled()
+    return cached_tool_call("video", clean_video_topic(topic), lambda: video_lookup(topic))
+
+
+def video_lookup(topic: str) -> str:
+    """Best educational video for a topic (local catalog, then live search, then category fallbacks)."""
+    try:
+        result = search_video_catalog(clean_video_topic(topic) or topic)
+    except Exception as e:
+        print(f"[WARN] video catalog search failed, using live search: {e}")
+        result = None
+    if result:
+        output = f"{result['title']} (YouTube: {result['url']})"
+        print(f"[DEBUG] video_tool output (catalog):\n{output}\n")
+        return output
+
     result = fetch_educational_videos(topic)
     
     if result:
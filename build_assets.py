@@ -0,0 +1,162 @@
+"""
+Build the precomputed, mmap-able retrieval assets used by utils.py.
+
+    python build_assets.py [--shard <id> ...]
+
+Writes into each corpus shard's assets directory (./assets for the textbook in
+the project root, overridable with AIRA_ASSETS_DIR; see corpus.py):
+  kb_rows.json        {"chapter", "title"} per textbook FAISS row
+  kb_text.bin         UTF-8 knowledge-base contents, concatenated in row order
+  kb_offsets.npy      int64 byte offsets into kb_text.bin (len = rows + 1)
+  kb_embeddings.npy   float32 L2-normalized content embeddings, one per row
+  kb_passages.json    overlapping passage spans {"row", "start", "end"} per row
+  kb_passages.index   FAISS inner-product index over normalized passage embeddings
+  shard_centroids.npy subchapter centroids used to route queries between shards
+  figure_embeddings.npy float32 L2-normalized embedding of each figure description
+                      in output.json, ranked by image_tool
+  video_catalog.npy   embeddings of the shard's video_catalog.json (if it has one)
+
+Run it whenever knowledgebase.json, output.json or textbook_faiss.index
+changes. Each file is written to a temporary name and atomically renamed, so
+running workers never see a half-written asset.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+import corpus
+import router
+import utils
+
+
+def _atomic_write(path, write):
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_npy(path, array):
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+    _atomic_write(path, write)
+
+
+def save_json(path, data):
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+    _atomic_write(path, write)
+
+
+def save_bytes(path, data):
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+    _atomic_write(path, write)
+
+
+def encode_normalized(texts, batch_size=32):
+    model = utils.get_model()
+    embeddings = model.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=True,
+    )
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+
+def build_kb_assets(shard, batch_size=32):
+    rows = utils.get_metadata(shard)
+    texts = list(utils.get_kb_texts(shard))
+
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(chunk) for chunk in encoded])
+
+    # Encode first so a model failure does not leave a partially updated asset set.
+    embeddings = encode_normalized(texts, batch_size)
+    save_json(shard.asset(utils.KB_ROWS_ASSET), rows)
+    save_bytes(shard.asset(utils.KB_TEXT_ASSET), b"".join(encoded))
+    save_npy(shard.asset(utils.KB_OFFSETS_ASSET), offsets)
+    save_npy(shard.asset(utils.KB_EMBEDDINGS_ASSET), embeddings)
+    print(f"[DEBUG] build_assets: wrote {len(rows)} knowledge-base rows ({offsets[-1]} bytes) to {shard.assets_dir}")
+
+
+def save_faiss_index(path, index):
+    import faiss
+    _atomic_write(path, lambda tmp_path: faiss.write_index(index, tmp_path))
+
+
+def build_passage_assets(shard, batch_size=32):
+    import faiss
+    passages = list(utils.iter_passages(shard))
+    embeddings = encode_normalized([utils.passage_text(p, shard) for p in passages], batch_size)
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(embeddings)
+    save_faiss_index(shard.asset(utils.KB_PASSAGES_INDEX_ASSET), index)
+    save_json(shard.asset(utils.KB_PASSAGES_ASSET), {
+        "max_chars": utils.PASSAGE_CHARS,
+        "overlap_chars": utils.PASSAGE_OVERLAP_CHARS,
+        "rows": len(utils.get_metadata(shard)),
+        "passages": passages,
+    })
+    print(f"[DEBUG] build_assets: wrote {len(passages)} passages to {shard.assets_dir}")
+
+
+def build_centroid_assets(shard):
+    centroids = router.compute_subchapter_centroids(shard)
+    save_npy(shard.asset(corpus.SHARD_CENTROIDS_ASSET), np.ascontiguousarray(centroids, dtype=np.float32))
+    print(f"[DEBUG] build_assets: wrote {len(centroids)} shard centroids to {shard.assets_dir}")
+
+
+def build_figure_assets(shard, batch_size=32):
+    import agent_tools
+    path = shard.file("figures")
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        figures = json.load(f)
+    if not figures:
+        return
+    embeddings = encode_normalized([agent_tools.figure_text(fig) for fig in figures], batch_size)
+    save_npy(shard.asset(agent_tools.FIGURE_EMBEDDINGS_ASSET), embeddings)
+    print(f"[DEBUG] build_assets: wrote {len(figures)} figure embeddings to {shard.assets_dir}")
+
+
+def build_video_assets(shard, batch_size=32):
+    import agent_tools
+    path = shard.file("video_catalog")
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    if not entries:
+        return
+    embeddings = encode_normalized([agent_tools.video_catalog_text(e) for e in entries], batch_size)
+    save_npy(shard.asset(agent_tools.VIDEO_CATALOG_EMBEDDINGS_ASSET), embeddings)
+    print(f"[DEBUG] build_assets: wrote {len(entries)} video catalog embeddings to {shard.assets_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--shard", action="append", help="shard id to build (repeatable; default: all shards)")
+    args = parser.parse_args()
+
+    shards = [corpus.registry.get(shard_id) for shard_id in args.shard] if args.shard else corpus.registry.shards()
+    for shard in shards:
+        os.makedirs(shard.assets_dir, exist_ok=True)
+        build_kb_assets(shard, args.batch_size)
+        build_passage_assets(shard, args.batch_size)
+        build_centroid_assets(shard)
+        build_figure_assets(shard, args.batch_size)
+        build_video_assets(shard, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
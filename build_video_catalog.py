@@ -0,0 +1,135 @@
+"""
+Build the local catalog of vetted educational videos used by video_tool.
+
+    python build_video_catalog.py [--shard <id>] [--workers 4] [--refresh] [--limit N]
+    python build_video_catalog.py [--shard <id>] --vet <video id> [<video id> ...]
+
+For every knowledge-base subchapter of a corpus shard, runs the same live
+YouTube search video_tool used to run per lesson (yt-dlp plus the
+is_suitable_educational_video heuristics, without the relaxed last-resort
+fallback) and records the chosen video with its title, channel, duration and
+the subchapters it covers in the shard's video_catalog.json.
+
+Search results are candidates, written with "vetted": false; video_tool only
+serves an entry once a reviewer has watched it and marked it "vetted": true
+(by editing the file or with --vet). Existing entries are kept, and --refresh
+drops only unvetted ones; a re-run only searches subchapters that have no
+video yet unless --refresh is given. Finally the catalog embeddings are
+written to the shard's assets (video_catalog.npy), which build_assets.py also
+refreshes.
+"""
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import agent_tools
+import build_assets
+import corpus
+import utils
+
+
+def subchapter_topic(title):
+    return re.sub(r"^[\d.\s]+", "", title).strip()
+
+
+def read_catalog(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_catalog(path, entries):
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+    build_assets._atomic_write(path, write)
+
+
+def find_video(title):
+    topic = subchapter_topic(title)
+    if len(topic) < 3:
+        return title, None
+    try:
+        return title, agent_tools.fetch_educational_videos(topic, allow_fallback=False)
+    except Exception as e:  # noqa: BLE001 - one failed search must not stop the build
+        print(f"[WARN] build_video_catalog: search failed for '{title}': {e}")
+        return title, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shard", default=None, help="corpus shard id (default shard if omitted)")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent live searches")
+    parser.add_argument("--refresh", action="store_true", help="search again for subchapters already covered")
+    parser.add_argument("--limit", type=int, default=None, help="only search the first N pending subchapters")
+    parser.add_argument("--vet", nargs="+", metavar="VIDEO_ID", help="mark reviewed videos as vetted and exit")
+    args = parser.parse_args()
+
+    shard = corpus.registry.get(args.shard)
+    path = shard.file("video_catalog")
+    entries = read_catalog(path)
+    if args.vet:
+        vet(path, entries, args.vet)
+        return
+    if args.refresh:
+        entries = [e for e in entries if e.get("vetted")]
+    covered = {title for e in entries for title in e.get("subchapters", [])}
+    texts = utils.get_kb_texts(shard)
+    pending = [
+        item["title"] for row, item in enumerate(utils.get_metadata(shard))
+        if texts[row] and item["title"] not in covered
+    ]
+    pending = list(dict.fromkeys(pending))[:args.limit]
+    print(f"[DEBUG] build_video_catalog: shard={shard.id} catalog={len(entries)} pending={len(pending)}")
+
+    by_id = {e["id"]: e for e in entries}
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = [pool.submit(find_video, title) for title in pending]
+        for done, future in enumerate(as_completed(futures), start=1):
+            title, video = future.result()
+            if not video:
+                print(f"[DEBUG] build_video_catalog: [{done}/{len(pending)}] no video: {title}")
+                continue
+            entry = by_id.get(video["id"])
+            if entry is None:
+                entry = by_id[video["id"]] = {
+                    "id": video["id"],
+                    "title": video["title"],
+                    "url": video["url"],
+                    "channel": video.get("channel"),
+                    "duration": video.get("duration"),
+                    "subchapters": [],
+                    "topics": [],
+                    "source": "search",
+                    "vetted": False,
+                    "added_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                }
+                entries.append(entry)
+            entry["subchapters"].append(title)
+            print(f"[DEBUG] build_video_catalog: [{done}/{len(pending)}] {title} -> {video['title']}")
+
+    write_catalog(path, entries)
+    unvetted = sum(1 for e in entries if not e.get("vetted"))
+    print(f"[DEBUG] build_video_catalog: wrote {len(entries)} videos to {path} ({unvetted} awaiting review, see --vet)")
+    os.makedirs(shard.assets_dir, exist_ok=True)
+    build_assets.build_video_assets(shard)
+
+
+def vet(path, entries, video_ids):
+    by_id = {e["id"]: e for e in entries}
+    unknown = [video_id for video_id in video_ids if video_id not in by_id]
+    if unknown:
+        raise SystemExit(f"Not in {path}: {', '.join(unknown)}")
+    for video_id in video_ids:
+        by_id[video_id]["vetted"] = True
+        by_id[video_id]["vetted_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    write_catalog(path, entries)
+    print(f"[DEBUG] build_video_catalog: vetted {len(video_ids)} videos in {path}")
+
+
+if __name__ == "__main__":
+    main()
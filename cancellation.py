@@ -0,0 +1,175 @@
+"""
+Per-thread serialization and cancellation of agent runs.
+
+When a student interrupts, the lesson still generating on the same thread_id
+should stop consuming LLM capacity and must not race the interruption's
+checkpoint writes. `runs.exclusive(thread_id)` supersedes (cancels) whatever
+run is active or queued on that thread and then holds the thread until the
+body finishes, so runs on one thread never overlap.
+
+Agent calls execute as asyncio tasks on one shared background event loop
+(`run_cancellable`), so cancelling a run aborts its in-flight LLM HTTP request
+instead of waiting for it to finish. Tools can call `raise_if_cancelled()`
+between slow steps; the cancel event travels with the run's context into the
+executor threads that run synchronous tools.
+"""
+import asyncio
+import contextvars
+import threading
+from contextlib import contextmanager
+
+_cancel_event = contextvars.ContextVar("aira_cancel_event", default=None)
+
+
+class RunCancelled(Exception):
+    """The run was superseded by a newer request on the same thread."""
+
+
+def raise_if_cancelled() -> None:
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise RunCancelled("superseded by a newer request on the same thread")
+
+
+class RunHandle:
+    def __init__(self, thread_id, slot):
+        self.thread_id = thread_id
+        self.slot = slot
+        self.cancel_event = threading.Event()
+        self._task = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancel_event.set()
+            task = self._task
+        if task is not None:
+            task.cancel()
+
+    def attach(self, task) -> None:
+        with self._lock:
+            self._task = task
+            cancelled = self.cancel_event.is_set()
+        if cancelled:
+            task.cancel()
+
+
+class _Slot:
+    __slots__ = ("lock", "current", "users")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = None
+        self.users = 0
+
+
+class ThreadRunRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    @contextmanager
+    def claim(self, thread_id):
+        """
+        Register a new request on thread_id and cancel the one it supersedes.
+        Does not serialize by itself; pair with locked() around state changes.
+        """
+        with self._lock:
+            slot = self._slots.setdefault(thread_id, _Slot())
+            slot.users += 1
+            handle = RunHandle(thread_id, slot)
+            previous, slot.current = slot.current, handle
+        if previous is not None:
+            print(f"[DEBUG] cancellation: superseding in-flight run on thread {thread_id}")
+            previous.cancel()
+        try:
+            yield handle
+        finally:
+            with self._lock:
+                if slot.current is handle:
+                    slot.current = None
+                slot.users -= 1
+                if slot.users == 0:
+                    self._slots.pop(thread_id, None)
+
+    @contextmanager
+    def locked(self, handle):
+        """Hold the thread exclusively; raises RunCancelled if superseded meanwhile."""
+        with handle.slot.lock:
+            if handle.cancelled:
+                raise RunCancelled("superseded while waiting for the thread")
+            yield handle
+
+    @contextmanager
+    def exclusive(self, thread_id):
+        """Cancel any earlier run on thread_id, then run the body alone on that thread."""
+        with self.claim(thread_id) as handle, self.locked(handle):
+            yield handle
+
+
+runs = ThreadRunRegistry()
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="aira-agent-loop", daemon=True).start()
+        return _loop
+
+
+class _LoopTask:
+    """A coroutine running on the shared loop, cancellable and awaitable from any thread."""
+
+    def __init__(self, loop, coro):
+        self._loop = loop
+        self._task = None
+        self.done = threading.Event()
+        # Run in a copy of the caller's context so request-scoped context variables
+        # (e.g. the corpus shard) reach the agent and its tool threads.
+        loop.call_soon_threadsafe(self._start, coro, contextvars.copy_context())
+
+    def _start(self, coro, context):
+        self._task = self._loop.create_task(coro, context=context)
+        self._task.add_done_callback(lambda _task: self.done.set())
+
+    def cancel(self):
+        # call_soon_threadsafe is FIFO, so _start has always run before _cancel.
+        self._loop.call_soon_threadsafe(self._cancel)
+
+    def _cancel(self):
+        self._task.cancel()
+
+    def result(self):
+        self.done.wait()
+        return self._task.result()
+
+
+def run_cancellable(coro_factory, handle=None):
+    """
+    Run `await coro_factory()` on the shared agent event loop and block for the result.
+    If `handle` is cancelled meanwhile, the task is cancelled and RunCancelled is raised
+    only after it has fully unwound, so callers can safely roll back its checkpoint writes.
+    """
+    async def runner():
+        token = _cancel_event.set(handle.cancel_event if handle is not None else None)
+        try:
+            return await coro_factory()
+        finally:
+            _cancel_event.reset(token)
+
+    task = _LoopTask(_get_loop(), runner())
+    if handle is not None:
+        handle.attach(task)
+    try:
+        return task.result()
+    except asyncio.CancelledError:
+        raise RunCancelled("run cancelled by a newer request on the same thread") from None
@@ -0,0 +1,147 @@
+"""
+Compare an encoder backend against the reference (torch) backend.
+
+    python check_encoder.py [--candidate onnx] [--reference torch] [--shard <id>]
+                            [--k 5] [--min-cosine 0.98] [--min-recall 0.9]
+
+Queries are the shard's subchapter titles, question-style probes built from
+them and the opening sentence of each knowledge-base passage. Reports:
+  - agreement: cosine between the two backends' normalized query embeddings
+  - recall@k: overlap of the top-k rows each backend retrieves from the
+    shard's existing FAISS text index (built by the reference backend), and
+    hit@k of each backend for the subchapter a title query names
+  - latency: single-query encode p50/p95 and batch throughput per backend,
+    plus load time and the resident memory each backend added
+Exits with status 1 when mean recall@k or the 5th-percentile cosine falls below
+the given tolerances, so it can gate switching AIRA_ENCODER in a deployment.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+import corpus
+import encoders
+import utils
+
+
+def _rss_mb():
+    # Current resident set (not the ru_maxrss peak, which never drops, so the
+    # second backend loaded would only show growth beyond the first one's peak).
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+
+
+def build_queries(shard, limit):
+    metadata = utils.get_metadata(shard)
+    titled = [(item["title"].strip(), row) for row, item in enumerate(metadata) if item["title"].strip()]
+    queries = [title for title, _ in titled]
+    queries += ["explain " + re.sub(r"^[\d.\s]+", "", title).strip().lower() for title, _ in titled]
+    for passage in utils.iter_passages(shard):
+        sentence = re.split(r"(?<=[.!?])\s", utils.passage_text(passage, shard).strip(), maxsplit=1)[0]
+        if len(sentence) > 20:
+            queries.append(sentence[:300])
+    return list(dict.fromkeys(queries))[:limit], titled
+
+
+def load(backend):
+    before = _rss_mb()
+    started = time.perf_counter()
+    encoder = encoders.BACKENDS[backend]()  # no fallback: measure exactly this backend
+    return encoder, time.perf_counter() - started, _rss_mb() - before
+
+
+def latency(encoder, queries, runs):
+    encoder.encode(queries[:1], normalize_embeddings=True)  # warm up
+    times = []
+    for query in (queries * (runs // max(1, len(queries)) + 1))[:runs]:
+        started = time.perf_counter()
+        encoder.encode([query], normalize_embeddings=True)
+        times.append((time.perf_counter() - started) * 1000)
+    started = time.perf_counter()
+    encoder.encode(queries, batch_size=32, normalize_embeddings=True)
+    batch_seconds = time.perf_counter() - started
+    return {
+        "single_p50_ms": round(float(np.percentile(times, 50)), 2),
+        "single_p95_ms": round(float(np.percentile(times, 95)), 2),
+        "batch_queries_per_s": round(len(queries) / batch_seconds, 1),
+    }
+
+
+def compare(reference, candidate, queries, titled, index, k):
+    ref = np.ascontiguousarray(reference.encode(queries, normalize_embeddings=True), dtype=np.float32)
+    cand = np.ascontiguousarray(candidate.encode(queries, normalize_embeddings=True), dtype=np.float32)
+    cosines = (ref * cand).sum(axis=1)
+    _, ref_rows = index.search(ref, k)
+    _, cand_rows = index.search(cand, k)
+    recall = [len(set(r) & set(c)) / k for r, c in zip(ref_rows.tolist(), cand_rows.tolist())]
+    top1 = float(np.mean(ref_rows[:, 0] == cand_rows[:, 0]))
+
+    expected = dict(titled)
+    title_rows = [i for i, q in enumerate(queries) if q in expected]
+    hits = {
+        name: float(np.mean([expected[queries[i]] in rows[i] for i in title_rows])) if title_rows else None
+        for name, rows in (("reference", ref_rows), ("candidate", cand_rows))
+    }
+    return {
+        "queries": len(queries),
+        "cosine_mean": round(float(cosines.mean()), 4),
+        "cosine_p5": round(float(np.percentile(cosines, 5)), 4),
+        "cosine_min": round(float(cosines.min()), 4),
+        f"recall@{k}": round(float(np.mean(recall)), 4),
+        "top1_agreement": round(top1, 4),
+        f"title_hit@{k}": {name: None if v is None else round(v, 4) for name, v in hits.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidate", default="onnx", choices=sorted(encoders.BACKENDS))
+    parser.add_argument("--reference", default="torch", choices=sorted(encoders.BACKENDS))
+    parser.add_argument("--shard", default=None, help="corpus shard id (default shard if omitted)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=500, help="maximum number of queries")
+    parser.add_argument("--runs", type=int, default=200, help="single-query latency samples per backend")
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="tolerance for the 5th-percentile cosine")
+    parser.add_argument("--min-recall", type=float, default=0.9, help="tolerance for mean recall@k")
+    args = parser.parse_args()
+
+    shard = corpus.registry.get(args.shard)
+    queries, titled = build_queries(shard, args.queries)
+    index = utils.get_faiss_index(shard)
+
+    # Candidate first, so its resident memory is measured before torch is imported.
+    candidate, candidate_load, candidate_rss = load(args.candidate)
+    reference, reference_load, reference_rss = load(args.reference)
+    report = {
+        "reference": reference.description,
+        "candidate": candidate.description,
+        "agreement": compare(reference, candidate, queries, titled, index, args.k),
+        "latency": {
+            "reference": {"load_s": round(reference_load, 2), "rss_added_mb": round(reference_rss, 1),
+                          **latency(reference, queries, args.runs)},
+            "candidate": {"load_s": round(candidate_load, 2), "rss_added_mb": round(candidate_rss, 1),
+                          **latency(candidate, queries, args.runs)},
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+    agreement = report["agreement"]
+    failures = []
+    if agreement["cosine_p5"] < args.min_cosine:
+        failures.append(f"cosine p5 {agreement['cosine_p5']} < {args.min_cosine}")
+    if agreement[f"recall@{args.k}"] < args.min_recall:
+        failures.append(f"recall@{args.k} {agreement[f'recall@{args.k}']} < {args.min_recall}")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print(f"OK: {args.candidate} is within tolerance of {args.reference}")
+
+
+if __name__ == "__main__":
+    main()
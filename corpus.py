@@ -0,0 +1,516 @@
+"""
+Sharded multi-textbook corpus.
+
+Every textbook is a shard with its own knowledge base, FAISS indexes, figures
+and lesson index. Shards are declared in corpus.json (AIRA_CORPUS):
+
+    {
+      "default": "science-10",
+      "shards": [
+        {"id": "science-10", "title": "Science Class 10", "grade": "10", "subject": "science", "root": "."},
+        {"id": "biology-11", "title": "Biology Class 11", "grade": "11", "subject": "biology",
+         "root": "textbooks/biology-11"}
+      ]
+    }
+
+A shard root holds the same files as the project root (knowledgebase.json,
+textbook_faiss.index, output.json, subchapter_faiss.index,
+subchapter_metadata.json, frontend_lessons.json, optional images/ and
+video_catalog.json, and the assets/ written by `build_assets.py --shard <id>`).
+Individual files can be overridden with a "files" mapping. Without corpus.json
+the project root is served as the single "default" shard, exactly as before.
+
+Retrieval code reads "the current shard" (`current_shard()`), chosen per
+request with `use_shard()`; the choice travels with the request's context into
+tool threads. Per-shard resources are declared with `shard_resource` and load
+lazily on first use. When loaded shards exceed AIRA_CORPUS_MEMORY_MB, the least
+recently used idle shards are unloaded. The shared embedding model is not part
+of any shard.
+
+Hot reload: a shard's loaded resources form a versioned Snapshot. A request
+pins the shard's current snapshot for its whole lifetime, so it never mixes
+old and new data. `registry.reload()` (POST /admin/reload, or the file watcher
+enabled by AIRA_RELOAD_WATCH_SECONDS) rebuilds every resource the old snapshot
+had loaded into a new one in the background, swaps it in atomically, and the
+old snapshot is released once the last request pinning it finishes.
+"""
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+CORPUS_JSON = os.environ.get("AIRA_CORPUS", os.path.join(PROJECT_ROOT, "corpus.json"))
+MEMORY_BUDGET_MB = float(os.environ.get("AIRA_CORPUS_MEMORY_MB", "0"))  # 0 = never evict
+SESSION_CACHE_SIZE = int(os.environ.get("AIRA_CORPUS_SESSIONS", "10000"))
+DEFAULT_SHARD_ID = "default"
+
+# File names inside a shard root, overridable per shard with "files" in corpus.json.
+SHARD_FILES = {
+    "knowledgebase": "knowledgebase.json",
+    "metadata": "metadata.json",
+    "text_index": "textbook_faiss.index",
+    "figures": "output.json",
+    "figure_index": "subchapter_faiss.index",
+    "figure_metadata": "subchapter_metadata.json",
+    "lesson_index": "frontend_lessons.json",
+    "video_catalog": "video_catalog.json",
+}
+
+# Small per-shard matrix of subchapter centroids used for shard routing (build_assets.py).
+SHARD_CENTROIDS_ASSET = "shard_centroids.npy"
+
+
+def _estimate_bytes(value, depth=0):
+    """Rough resident size of a loaded resource. Memory-mapped data counts as zero."""
+    import numpy as np
+    if isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return 0 if isinstance(value.base, np.memmap) else value.nbytes
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if hasattr(value, "ntotal") and hasattr(value, "d"):  # FAISS index
+        return int(value.ntotal) * int(value.d) * 4
+    if depth > 3:
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sum(_estimate_bytes(k, depth + 1) + _estimate_bytes(v, depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(_estimate_bytes(v, depth + 1) for v in value)
+    return getattr(value, "resident_bytes", lambda: sys.getsizeof(value))()
+
+
+# name -> loader for every shard_resource, so a reload can rebuild what was loaded.
+_LOADERS = {}
+# Callables returning extra files whose change should reload a shard (e.g. the lesson store).
+_WATCH_PROVIDERS = []
+
+
+def watch_paths(provider):
+    """Register `provider(shard) -> [paths]` as extra inputs of a shard's snapshot version."""
+    _WATCH_PROVIDERS.append(provider)
+    return provider
+
+
+class Snapshot:
+    """One version of a shard's loaded resources, reference-counted by the requests using it."""
+
+    def __init__(self, shard, version=None):
+        self.shard = shard
+        self._version = version
+        self.created_at = time.time()
+        self.refs = 0
+        self.retired = False
+        self._lock = threading.RLock()
+        self._refs_lock = threading.Lock()
+        self._resources = {}
+
+    def __repr__(self):
+        return f"Snapshot({self.shard.id!r}, {self.version!r})"
+
+    @property
+    def version(self):
+        # Computed on first use so that watch_paths() providers registered at import time count.
+        if self._version is None:
+            self._version = self.shard.fingerprint()
+        return self._version
+
+    def resource(self, name, loader):
+        resources = self._resources  # release swaps in a new dict, so read one reference
+        if name in resources:
+            return resources[name]
+        with self._lock:
+            if name not in self._resources:
+                self._resources[name] = loader()
+                loaded = True
+            else:
+                loaded = False
+            value = self._resources[name]
+        if loaded and self.shard._on_load is not None:
+            self.shard._on_load(self.shard)  # outside the lock: eviction takes other shards' locks
+        return value
+
+    def loaded_names(self):
+        return list(self._resources)
+
+    def is_loaded(self, name=None):
+        return bool(self._resources) if name is None else name in self._resources
+
+    def memory_bytes(self):
+        return sum(_estimate_bytes(value) for value in list(self._resources.values()))
+
+    def acquire(self):
+        with self._refs_lock:
+            self.refs += 1
+        return self
+
+    def release(self):
+        with self._refs_lock:
+            self.refs -= 1
+            drop = self.retired and self.refs == 0
+        if drop:
+            self._drop()
+
+    def retire(self):
+        """Called when a newer snapshot replaces this one; frees it once no request uses it."""
+        with self._refs_lock:
+            self.retired = True
+            drop = self.refs == 0
+        if drop:
+            self._drop()
+
+    def _drop(self):
+        if self._resources:
+            print(f"[DEBUG] corpus: released snapshot {self.version} of shard {self.shard.id}")
+        with self._lock:
+            self._resources = {}
+
+
+class Shard:
+    """One textbook: file locations plus its current snapshot of loaded resources."""
+
+    def __init__(self, shard_id, root=".", title=None, grade=None, subject=None, files=None, assets_dir=None):
+        self.id = shard_id
+        self.root = os.path.abspath(os.path.join(PROJECT_ROOT, root))
+        self.title = title or shard_id
+        self.grade = None if grade is None else str(grade)
+        self.subject = subject
+        self.files = dict(SHARD_FILES, **(files or {}))
+        if assets_dir is None and self.root == PROJECT_ROOT:
+            assets_dir = os.environ.get("AIRA_ASSETS_DIR")
+        self.assets_dir = os.path.abspath(assets_dir or os.path.join(self.root, "assets"))
+        self.images_dir = os.path.join(self.root, "images")
+        self.last_used = 0.0
+        self._lock = threading.Lock()
+        self._on_load = None
+        self.snapshot = Snapshot(self)
+
+    def __repr__(self):
+        return f"Shard({self.id!r})"
+
+    def file(self, name):
+        return os.path.join(self.root, self.files[name])
+
+    def asset(self, name):
+        return os.path.join(self.assets_dir, name)
+
+    def fingerprint(self):
+        """Version id from the size and mtime of every input file of the shard."""
+        paths = [self.file(name) for name in self.files]
+        if os.path.isdir(self.assets_dir):
+            paths += [
+                os.path.join(self.assets_dir, name) for name in os.listdir(self.assets_dir)
+                if not name.endswith(".tmp")
+            ]
+        for provider in _WATCH_PROVIDERS:
+            paths += provider(self)
+        digest = hashlib.sha256()
+        for path in sorted(paths):
+            try:
+                stat = os.stat(path)
+                digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+            except OSError:
+                digest.update(f"{path}:missing\n".encode("utf-8"))
+        return digest.hexdigest()[:12]
+
+    def acquire(self):
+        """Pin the current snapshot (see Snapshot.release)."""
+        with self._lock:
+            return self.snapshot.acquire()
+
+    def swap(self, snapshot):
+        with self._lock:
+            old, self.snapshot = self.snapshot, snapshot
+        old.retire()
+        return old
+
+    def is_loaded(self, name=None):
+        return self.snapshot.is_loaded(name)
+
+    def memory_bytes(self):
+        return self.snapshot.memory_bytes()
+
+    @property
+    def active(self):
+        return self.snapshot.refs
+
+    def unload(self):
+        self.swap(Snapshot(self, self.snapshot.version))
+
+
+def shard_resource(loader):
+    """
+    Like utils.lazy_resource, but cached per shard: `loader(shard)` runs once per
+    shard. The getter uses the current shard unless one is passed explicitly.
+    """
+    name = f"{loader.__module__}.{loader.__name__}"
+    _LOADERS[name] = loader
+
+    @functools.wraps(loader)
+    def getter(shard=None):
+        snapshot = _snapshot_for(shard)
+        return snapshot.resource(name, lambda: loader(snapshot.shard))
+
+    getter.is_loaded = lambda shard=None: _snapshot_for(shard).is_loaded(name)
+    return getter
+
+
+def _snapshot_for(shard=None):
+    """The snapshot pinned by the current request if it belongs to `shard`, else the shard's current one."""
+    pinned = _current.get()
+    if pinned is not None and (shard is None or pinned.shard is shard):
+        return pinned
+    return (shard or registry.default()).snapshot
+
+
+class ShardRegistry:
+    def __init__(self, config_path=CORPUS_JSON, memory_budget_mb=MEMORY_BUDGET_MB):
+        self.config_path = config_path
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._shards = OrderedDict()
+        self._sessions = OrderedDict()  # thread_id -> shard id, so follow-ups stay on one book
+        self._centroids = {}
+        self._reload_lock = threading.Lock()
+        self.reload_state = {"status": "idle", "started_at": None, "finished_at": None, "results": {}}
+        config = self._read_config()
+        for entry in config.get("shards", []):
+            shard = Shard(
+                entry["id"], entry.get("root", "."), entry.get("title"), entry.get("grade"),
+                entry.get("subject"), entry.get("files"), entry.get("assets_dir"),
+            )
+            shard._on_load = self._loaded
+            self._shards[shard.id] = shard
+        if not self._shards:
+            shard = Shard(DEFAULT_SHARD_ID)
+            shard._on_load = self._loaded
+            self._shards[shard.id] = shard
+        self.default_id = config.get("default") or next(iter(self._shards))
+        if self.default_id not in self._shards:
+            raise ValueError(f"{config_path}: default shard '{self.default_id}' is not declared")
+        print(f"[DEBUG] corpus: shards={list(self._shards)} default={self.default_id}")
+
+    def _read_config(self):
+        if not os.path.exists(self.config_path):
+            return {}
+        with open(self.config_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    # --- lookup ---
+
+    def shards(self):
+        return list(self._shards.values())
+
+    def default(self):
+        return self._shards[self.default_id]
+
+    def get(self, shard_id=None):
+        if shard_id is None:
+            return self.default()
+        if isinstance(shard_id, Shard):
+            return shard_id
+        try:
+            return self._shards[shard_id]
+        except KeyError:
+            raise ValueError(f"Unknown textbook shard '{shard_id}'") from None
+
+    def describe(self):
+        return [
+            {
+                "id": shard.id,
+                "title": shard.title,
+                "grade": shard.grade,
+                "subject": shard.subject,
+                "default": shard.id == self.default_id,
+                "version": shard.snapshot.version,
+                "loaded": shard.is_loaded(),
+                "memory_mb": round(shard.memory_bytes() / (1024 * 1024), 1),
+            }
+            for shard in self._shards.values()
+        ]
+
+    # --- eviction ---
+
+    def _loaded(self, shard):
+        shard.last_used = time.monotonic()
+        if self.memory_budget > 0:
+            self.evict(keep=shard)
+
+    def evict(self, keep=None):
+        """Unload least recently used idle shards until loaded shards fit the memory budget."""
+        with self._lock:
+            loaded = [s for s in self._shards.values() if s.is_loaded()]
+            total = sum(s.memory_bytes() for s in loaded)
+            for shard in sorted(loaded, key=lambda s: s.last_used):
+                if total <= self.memory_budget:
+                    break
+                if shard is keep or shard.active > 0:
+                    continue
+                freed = shard.memory_bytes()
+                shard.unload()
+                total -= freed
+                print(f"[DEBUG] corpus: evicted shard {shard.id} ({freed / (1024 * 1024):.1f} MB)")
+
+    @contextmanager
+    def use(self, shard):
+        shard = self.get(shard)
+        snapshot = shard.acquire()
+        shard.last_used = time.monotonic()
+        token = _current.set(snapshot)
+        try:
+            yield shard
+        finally:
+            _current.reset(token)
+            snapshot.release()
+            shard.last_used = time.monotonic()
+
+    # --- hot reload ---
+
+    def reload_shard(self, shard, force=False):
+        """
+        Rebuild a shard's loaded resources into a new snapshot and swap it in.
+        Returns "unchanged", "reloaded <old> -> <new>" or raises (the old snapshot stays).
+        """
+        old = shard.snapshot
+        version = shard.fingerprint()
+        if version == old.version and not force:
+            return "unchanged"
+        snapshot = Snapshot(shard, version)
+        token = _current.set(snapshot)  # loaders (and the loaders they call) fill the new snapshot
+        try:
+            for name in old.loaded_names():
+                snapshot.resource(name, functools.partial(_LOADERS[name], shard))
+        finally:
+            _current.reset(token)
+        shard.swap(snapshot)
+        self._centroids.pop(shard.id, None)
+        print(f"[DEBUG] corpus: shard {shard.id} reloaded {old.version} -> {version} ({len(snapshot.loaded_names())} resources)")
+        return f"reloaded {old.version} -> {version}"
+
+    def reload(self, shard_ids=None, force=False):
+        """Reload the given shards (all by default) one after another; never raises."""
+        with self._reload_lock:
+            self.reload_state.update(status="reloading", started_at=time.time(), finished_at=None, results={})
+            failed = False
+            for shard in [self.get(i) for i in shard_ids] if shard_ids else self.shards():
+                try:
+                    result = self.reload_shard(shard, force=force)
+                except Exception as e:  # noqa: BLE001 - keep serving the old snapshot
+                    failed = True
+                    result = f"failed: {e}"
+                    print(f"[ERROR] corpus: reload of shard {shard.id} failed, keeping {shard.snapshot.version}: {e}")
+                self.reload_state["results"][shard.id] = result
+            self.reload_state.update(status="failed" if failed else "done", finished_at=time.time())
+            return dict(self.reload_state["results"])
+
+    def reload_async(self, shard_ids=None, force=False):
+        """Start a background reload; returns False if one is already running."""
+        if self._reload_lock.locked():
+            return False
+        for shard_id in shard_ids or []:
+            self.get(shard_id)  # reject unknown ids before starting
+        threading.Thread(
+            target=self.reload, args=(shard_ids, force), name="aira-corpus-reload", daemon=True
+        ).start()
+        return True
+
+    def start_watcher(self, interval):
+        """
+        Poll every shard's fingerprint and reload shards whose inputs changed.
+        A change must be stable for two polls so half-copied files are not loaded.
+        """
+        def watch():
+            pending = {}
+            while True:
+                time.sleep(interval)
+                changed = []
+                for shard in self.shards():
+                    version = shard.fingerprint()
+                    if version == shard.snapshot.version:
+                        pending.pop(shard.id, None)
+                    elif pending.get(shard.id) == version:
+                        changed.append(shard.id)
+                    else:
+                        pending[shard.id] = version
+                if changed:
+                    print(f"[DEBUG] corpus: watcher detected changes in {changed}")
+                    self.reload(changed)
+                    for shard_id in changed:
+                        pending.pop(shard_id, None)
+
+        threading.Thread(target=watch, name="aira-corpus-watcher", daemon=True).start()
+        print(f"[DEBUG] corpus: watching shard files every {interval}s")
+
+    # --- routing ---
+
+    def centroids(self, shard):
+        """Subchapter centroid matrix of a shard (kept resident; a few hundred KB per book)."""
+        if shard.id not in self._centroids:
+            import numpy as np
+            path = shard.asset(SHARD_CENTROIDS_ASSET)
+            if os.path.exists(path):
+                matrix = np.load(path)
+            else:
+                import router
+                print(f"[WARN] corpus: {path} not found; loading shard {shard.id} to compute its centroids")
+                matrix = np.array(router.get_subchapter_centroids(shard))
+            self._centroids[shard.id] = matrix
+        return self._centroids[shard.id]
+
+    def remember(self, thread_id, shard):
+        if not thread_id:
+            return
+        with self._lock:
+            self._sessions[thread_id] = shard.id
+            self._sessions.move_to_end(thread_id)
+            while len(self._sessions) > SESSION_CACHE_SIZE:
+                self._sessions.popitem(last=False)
+
+    def route(self, query="", thread_id=None, shard_id=None, grade=None, subject=None):
+        """
+        Pick the shard for a turn: an explicit shard id, else the shard this
+        session already uses, else the best centroid match among the shards of
+        the requested grade/subject (all shards if none match).
+        """
+        if shard_id:
+            shard = self.get(shard_id)
+            self.remember(thread_id, shard)
+            return shard
+        session_shard = self._sessions.get(thread_id) if thread_id else None
+        if session_shard is not None:
+            return self._shards[session_shard]
+        candidates = [
+            s for s in self._shards.values()
+            if (grade is None or s.grade == str(grade)) and (subject is None or s.subject == subject)
+        ] or list(self._shards.values())
+        if len(candidates) == 1 or not (query or "").strip():
+            shard = candidates[0] if len(candidates) == 1 else self.default()
+        else:
+            import utils
+            query_embedding = utils.get_model().encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
+            scores = {s.id: float((self.centroids(s) @ query_embedding).max()) for s in candidates}
+            shard = self._shards[max(scores, key=scores.get)]
+            print(f"[DEBUG] corpus: routed to shard {shard.id} scores={ {k: round(v, 3) for k, v in scores.items()} }")
+        self.remember(thread_id, shard)
+        return shard
+
+
+_current = contextvars.ContextVar("aira_shard_snapshot", default=None)
+registry = ShardRegistry()
+
+
+def current_shard() -> Shard:
+    pinned = _current.get()
+    return pinned.shard if pinned is not None else registry.default()
+
+
+def use_shard(shard=None):
+    """Context manager making `shard` (a Shard or shard id; default shard if None) current."""
+    return registry.use(shard)
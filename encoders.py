@@ -0,0 +1,122 @@
+"""
+Pluggable sentence encoders behind utils.get_model().
+
+  torch  SentenceTransformer(all-MiniLM-L6-v2) in PyTorch (default)
+  onnx   the same MiniLM exported to ONNX and int8-quantized
+         (export_onnx_encoder.py), run by onnxruntime on CPU with the
+         `tokenizers` tokenizer; no torch import on the request path
+
+Select with AIRA_ENCODER. Both expose the subset of SentenceTransformer.encode
+the code base uses (convert_to_numpy, normalize_embeddings, batch_size). The
+ONNX backend reproduces MiniLM's attention-masked mean pooling and its final
+Normalize module (all-MiniLM-L6-v2 returns unit vectors even without
+normalize_embeddings), so its vectors are compatible with FAISS indexes built
+by the torch backend.
+`python check_encoder.py` measures recall and latency of one against the other.
+"""
+import os
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Hugging Face id or a local directory (offline deployments).
+EMBEDDING_MODEL_NAME = os.environ.get("AIRA_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+ENCODER_BACKEND = os.environ.get("AIRA_ENCODER", "torch")
+ONNX_MODEL_DIR = os.environ.get("AIRA_ONNX_MODEL_DIR", os.path.join(PROJECT_ROOT, "models", "minilm-onnx"))
+ONNX_MODEL_FILE = os.environ.get("AIRA_ONNX_MODEL_FILE", "model_int8.onnx")
+ONNX_THREADS = int(os.environ.get("AIRA_ONNX_THREADS", "0"))  # 0 = onnxruntime default
+MAX_SEQ_LENGTH = 256  # all-MiniLM-L6-v2's sentence-transformers max_seq_length
+EMBEDDING_DIM = 384
+
+
+def _normalize(embeddings):
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+class TorchEncoder:
+    name = "torch"
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = SentenceTransformer(model_name)
+        self.model.to(device)
+        self.description = f"{model_name} (torch, {device})"
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        kwargs.pop("convert_to_tensor", None)
+        return self.model.encode(
+            sentences, batch_size=batch_size, convert_to_numpy=True,
+            normalize_embeddings=normalize_embeddings, **kwargs,
+        )
+
+
+class OnnxEncoder:
+    name = "onnx"
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, model_file=ONNX_MODEL_FILE, threads=ONNX_THREADS):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id("[PAD]") or 0, pad_token="[PAD]")
+        options = onnxruntime.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_path = os.path.join(model_dir, model_file)
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.description = f"{model_path} (onnxruntime {onnxruntime.__version__}, CPU)"
+
+    def _embed(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        token_embeddings = self.session.run(None, feeds)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        # Sort by length so each batch pads to similar lengths, then restore the order.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [self._embed([texts[i] for i in order[start:start + batch_size]]) for start in range(0, len(texts), batch_size)]
+        embeddings = np.empty((len(texts), batches[0].shape[1]), dtype=np.float32)
+        embeddings[order] = np.concatenate(batches)
+        embeddings = _normalize(embeddings)
+        return embeddings[0] if single else embeddings
+
+
+BACKENDS = {"torch": TorchEncoder, "onnx": OnnxEncoder}
+
+
+def load_encoder(backend=None):
+    """
+    The configured encoder. A missing ONNX runtime or exported model falls back to
+    torch with a warning, so a misconfigured worker still serves requests.
+    """
+    backend = backend or ENCODER_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"AIRA_ENCODER must be one of {sorted(BACKENDS)}, got '{backend}'")
+    started = time.perf_counter()
+    try:
+        encoder = BACKENDS[backend]()
+    except Exception as e:  # noqa: BLE001 - onnxruntime/tokenizers raise plain Exception subclasses
+        if backend == "torch":
+            raise
+        print(f"[WARN] encoders: {backend} backend unavailable ({e}); falling back to torch")
+        return load_encoder("torch")
+    print(f"[DEBUG] encoders: loaded {encoder.description} in {time.perf_counter() - started:.2f}s")
+    return encoder
@@ -0,0 +1,94 @@
+"""
+Export MiniLM to ONNX and quantize it to int8 for the onnx encoder backend.
+
+    python export_onnx_encoder.py [--model sentence-transformers/all-MiniLM-L6-v2]
+                                  [--out models/minilm-onnx] [--no-quantize]
+
+Needs torch, transformers, onnx and onnxruntime at export time only. Writes
+into --out:
+  model.onnx        the fp32 transformer (token embeddings; pooling is done in encoders.py)
+  model_int8.onnx   dynamically quantized int8 weights (default AIRA_ONNX_MODEL_FILE)
+  tokenizer.json    the fast tokenizer, loaded with `tokenizers` at serve time
+  export.json       what was exported, for check_encoder.py and humans
+
+Then run `python check_encoder.py` to compare it with the torch backend, and
+serve with AIRA_ENCODER=onnx.
+"""
+import argparse
+import json
+import os
+import time
+
+import encoders
+
+
+def export(model_name, out_dir, opset, quantize):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.backend_tokenizer.save(os.path.join(out_dir, "tokenizer.json"))
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+
+    sample = tokenizer(["An example sentence to trace the graph."], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    class TokenEmbeddings(torch.nn.Module):
+        # Keyword arguments: positional order of forward() differs across transformers versions.
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs))).last_hidden_state
+
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(model),
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            dynamo=False,
+        )
+    print(f"[DEBUG] export_onnx_encoder: wrote {fp32_path} ({os.path.getsize(fp32_path) / 1e6:.1f} MB)")
+
+    files = {"fp32": "model.onnx"}
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        int8_path = os.path.join(out_dir, "model_int8.onnx")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        files["int8"] = "model_int8.onnx"
+        print(f"[DEBUG] export_onnx_encoder: wrote {int8_path} ({os.path.getsize(int8_path) / 1e6:.1f} MB)")
+
+    with open(os.path.join(out_dir, "export.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "model": model_name,
+            "opset": opset,
+            "inputs": input_names,
+            "max_seq_length": encoders.MAX_SEQ_LENGTH,
+            "pooling": "mean",
+            "files": files,
+            "exported_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=encoders.EMBEDDING_MODEL_NAME, help="Hugging Face model id or local path")
+    parser.add_argument("--out", default=encoders.ONNX_MODEL_DIR, help="output directory")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--no-quantize", action="store_true", help="only write the fp32 model")
+    args = parser.parse_args()
+    export(args.model, args.out, args.opset, quantize=not args.no_quantize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Multi-worker deployment:
+
+    python build_assets.py            # once, and whenever the KB/indexes change
+    gunicorn -c gunicorn.conf.py server:app
+
+Runs uvicorn workers under gunicorn with AIRA_MMAP=1 and the app preloaded, so
+the memory-mapped FAISS indexes and knowledge-base assets are mapped once in the
+master before forking. Workers share those pages through the page cache instead
+of each holding a private copy. The encoder is not loaded in the master: torch
+and OpenMP thread pools do not survive fork(), so each worker loads it in its
+own startup warmup.
+"""
+import os
+
+os.environ.setdefault("AIRA_MMAP", "1")
+
+bind = os.environ.get("AIRA_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Workers inherit the mapped assets; readiness waits only for their encoder warmup.
+timeout = int(os.environ.get("AIRA_WORKER_TIMEOUT", "120"))
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before workers fork.
+    import agent
+    server.log.info("Mapping retrieval assets before forking workers")
+    agent.preload_assets()
@@ -1,6 +1,6 @@
 import { useState, useEffect, useCallback, useRef } from 'react';
 import { MediaInfo } from '../types';
-import { backendBaseUrl } from '../services/apiService';
+import { backendBaseUrl, MediaManifest } from '../services/apiService';
 
 export interface MediaSegment {
   type: 'text' | 'image' | 'video';
@@ -81,10 +81,16 @@ export const useMediaSequencer = () => {
   }, []);
 
   // Parse AI response into sequential segments
-  const parseResponse = useCallback((text: string): MediaSegment[] => {
+  const parseResponse = useCallback((text: string, manifest?: MediaManifest): MediaSegment[] => {
     console.log('[MediaSequencer] Parsing response:', text.substring(0, 200));
     
     const result: MediaSegment[] = [];
+
+    // Figure URLs from the manifest carry the textbook (/images/<shard>/<file>)
+    const imageUrls = new Map<string, string>();
+    manifest?.media
+      .filter((item) => item.type === 'image')
+      .forEach((item) => imageUrls.set(extractFilename(item.url), `${backendBaseUrl}${item.url}`));
     
     // Improved regex patterns
     const imageRegex = /\(see:\s*([^)]+\.(?:png|jpg|jpeg))\)/gi;
@@ -148,6 +154,7 @@ export const useMediaSequencer = () => {
         result.push({
           type: 'image',
           content: filename,
+          url: imageUrls.get(filename),
           duration: 20000, // 20 seconds for image with explanation
           explanation: explanation
         });
@@ -176,9 +183,9 @@ export const useMediaSequencer = () => {
   }, [extractFilename, generateImageExplanation]);
 
   // Start sequence with new AI response
-  const startSequence = useCallback((fullText: string) => {
+  const startSequence = useCallback((fullText: string, manifest?: MediaManifest) => {
     console.log('[MediaSequencer] Starting sequence with text length:', fullText.length);
-    const parsedSegments = parseResponse(fullText);
+    const parsedSegments = parseResponse(fullText, manifest);
     setSegments(parsedSegments);
     setCurrentIndex(0);
     setIsPlaying(true);
@@ -229,7 +236,7 @@ export const useMediaSequencer = () => {
 
     if (currentSegment.type === 'image') {
       // Build proper image URL
-      const imageUrl = `${backendBaseUrl}/images/${currentSegment.content}`;
+      const imageUrl = currentSegment.url || `${backendBaseUrl}/images/${currentSegment.content}`;
       console.log('[MediaSequencer] Setting image media:', imageUrl);
       
       setCurrentMedia({
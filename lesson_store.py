@@ -0,0 +1,213 @@
+"""
+Versioned store of pre-generated lessons for the subchapters in frontend_lessons.json.
+
+Layout (under AIRA_LESSON_STORE_DIR, default ./lesson_store, for the textbook
+in the project root; other corpus shards use <store>/shards/<shard id>/):
+  <version>/lessons.jsonl   one JSON record per attempt: title, chapter, status,
+                            response, attempts, error, generated_at. The last
+                            record for a title wins, which makes the file both
+                            the batch job's checkpoint and the served store.
+  <version>/manifest.json   how the version was produced (model, prompt hash, counts)
+  CURRENT                   name of the version /chat serves
+
+The version id hashes everything a lesson depends on (system prompt, model,
+knowledge base, lesson index), so a prompt or KB change starts a fresh store
+instead of silently serving stale lessons. See pregenerate_lessons.py.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from corpus import current_shard, shard_resource, watch_paths
+from utils import PROJECT_ROOT, normalize_title
+
+LESSON_STORE_DIR = os.environ.get("AIRA_LESSON_STORE_DIR", os.path.join(PROJECT_ROOT, "lesson_store"))
+LESSON_STORE_ENABLED = os.environ.get("AIRA_LESSON_STORE", "1") == "1"
+LESSON_COMPLETE_MARKER = "[LESSON COMPLETE]"
+
+
+def store_dir(shard=None):
+    shard = shard or current_shard()
+    if shard.root == PROJECT_ROOT:
+        return LESSON_STORE_DIR
+    return os.path.join(LESSON_STORE_DIR, "shards", shard.id)
+
+
+@watch_paths
+def _published_version_file(shard):
+    # Publishing a new lesson version hot-reloads the shard's lesson store (see corpus.py).
+    return [os.path.join(store_dir(shard), "CURRENT")]
+
+
+def iter_lesson_index(path=None):
+    """
+    Yield every selectable lesson in index order as {"chapter_number", "chapter_title", "title"}.
+    Only leaves are selectable in LessonIndex.tsx, and their title is sent verbatim as the /chat query.
+    Reads the current shard's lesson index unless a path is given.
+    """
+    with open(path or current_shard().file("lesson_index"), "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    def walk(nodes):
+        for node in nodes:
+            children = node.get("children") or []
+            if children:
+                yield from walk(children)
+            else:
+                yield node["title"]
+
+    for chapter in data.get("chapters", []):
+        for title in walk(chapter.get("subchapters", [])):
+            yield {
+                "chapter_number": chapter.get("chapter_number"),
+                "chapter_title": chapter.get("chapter_title"),
+                "title": title,
+            }
+
+
+@shard_resource
+def get_lesson_index(shard):
+    return list(iter_lesson_index(shard.file("lesson_index")))
+
+
+@shard_resource
+def get_lesson_titles(shard):
+    return {normalize_title(item["title"]) for item in get_lesson_index(shard)}
+
+
+def is_lesson_title(query: str) -> bool:
+    """True if the query is exactly a lesson-index pick (the frontend sends the title verbatim)."""
+    return normalize_title(query) in get_lesson_titles()
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compute_version(system_prompt: str, model_name: str, shard=None) -> str:
+    shard = shard or current_shard()
+    digest = hashlib.sha256()
+    digest.update(system_prompt.encode("utf-8"))
+    digest.update(model_name.encode("utf-8"))
+    digest.update(_file_digest(shard.file("knowledgebase")).encode("ascii"))
+    digest.update(_file_digest(shard.file("lesson_index")).encode("ascii"))
+    return f"v-{digest.hexdigest()[:12]}"
+
+
+def version_dir(version: str, shard=None) -> str:
+    return os.path.join(store_dir(shard), version)
+
+
+def lessons_path(version: str, shard=None) -> str:
+    return os.path.join(version_dir(version, shard), "lessons.jsonl")
+
+
+def read_records(version: str, shard=None) -> dict:
+    """Latest record per normalized title for a version (empty if it does not exist)."""
+    records = {}
+    path = lessons_path(version, shard)
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn final line from an interrupted run; the title will be redone.
+                continue
+            records[normalize_title(record["title"])] = record
+    return records
+
+
+class CheckpointWriter:
+    """Thread-safe, append-only JSONL writer that fsyncs each record."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._f = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._f.write(line + "\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            self._f.close()
+
+
+def publish(version: str, shard=None) -> None:
+    """Point CURRENT at `version` (atomic rename)."""
+    os.makedirs(store_dir(shard), exist_ok=True)
+    current_file = os.path.join(store_dir(shard), "CURRENT")
+    tmp_path = current_file + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, current_file)
+
+
+def current_version(shard=None):
+    try:
+        with open(os.path.join(store_dir(shard), "CURRENT"), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+class LessonStore:
+    """Read-only view of one published version, keyed by normalized lesson title."""
+
+    def __init__(self, version=None, shard=None):
+        self.version = version
+        self._lessons = {}
+        if version:
+            self._lessons = {
+                key: record for key, record in read_records(version, shard).items()
+                if record.get("status") == "ok" and record.get("response")
+            }
+        print(f"[DEBUG] lesson_store: shard={(shard or current_shard()).id} version={version} lessons={len(self._lessons)}")
+
+    def __len__(self):
+        return len(self._lessons)
+
+    def lookup(self, query: str):
+        """Return the stored lesson record for an exact lesson-index title, else None."""
+        return self._lessons.get(normalize_title(query))
+
+
+@shard_resource
+def get_lesson_store(shard):
+    return LessonStore(current_version(shard) if LESSON_STORE_ENABLED else None, shard)
+
+
+def lookup_lesson(query: str):
+    """Pre-generated lesson text for a lesson-index pick, or None."""
+    if not LESSON_STORE_ENABLED:
+        return None
+    record = get_lesson_store().lookup(query)
+    return record["response"] if record else None
+
+
+def make_record(item: dict, status: str, response=None, error=None, attempts=1) -> dict:
+    return {
+        "title": item["title"],
+        "chapter_number": item.get("chapter_number"),
+        "chapter_title": item.get("chapter_title"),
+        "status": status,
+        "response": response,
+        "error": error,
+        "attempts": attempts,
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
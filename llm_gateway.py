@@ -0,0 +1,459 @@
+"""
+Pooled, deadline-bounded HTTP layer under the chat models.
+
+ChatOpenAI otherwise opens its own default httpx clients with the SDK's
+10-minute timeout and fixed retry policy, so one slow or failed provider call
+stalls a lesson for seconds or surfaces as "Sorry, an error occurred".
+`chat_model(...)` builds ChatOpenAI instances that share one keep-alive
+connection pool (a sync and an async httpx client) whose transport adds:
+
+  - deadlines: every chat completion finishes, retries included, within
+    AIRA_LLM_DEADLINE seconds; each attempt gets at most AIRA_LLM_TIMEOUT
+  - retries: connection errors, timeouts, 429 and 5xx are retried up to
+    AIRA_LLM_RETRIES times with full-jitter exponential backoff (honouring a
+    short Retry-After); the SDK's own retries are turned off
+  - failover: with AIRA_LLM_SECONDARY_URL set (any OpenAI-compatible server,
+    optionally AIRA_LLM_SECONDARY_KEY / AIRA_LLM_SECONDARY_MODEL), retries
+    alternate between the endpoints, and after AIRA_LLM_FAILOVER_AFTER
+    consecutive primary failures new calls start on the secondary for
+    AIRA_LLM_FAILOVER_COOLDOWN seconds
+  - hedging: a non-streaming call still unanswered after the
+    AIRA_LLM_HEDGE_PERCENTILE latency of recent calls of its kind is also sent
+    to the other endpoint; the first answer wins and the other is cancelled.
+    Hedges are capped at AIRA_LLM_HEDGE_BUDGET of all calls (async path only:
+    agent runs execute on the shared event loop, see cancellation.py)
+
+`python llm_standin.py` serves a local OpenAI-compatible stand-in with
+configurable latency and errors; `python llm_gateway.py --requests 200`
+drives the gateway against it and reports latency percentiles.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+
+GATEWAY_ENABLED = os.environ.get("AIRA_LLM_GATEWAY", "1") == "1"
+LLM_BASE_URL = os.environ.get("AIRA_LLM_BASE_URL", "https://api.groq.com/openai/v1")
+LLM_MODEL = os.environ.get("AIRA_LLM_MODEL", "llama-3.3-70b-versatile")
+SECONDARY_URL = os.environ.get("AIRA_LLM_SECONDARY_URL", "")
+SECONDARY_KEY = os.environ.get("AIRA_LLM_SECONDARY_KEY", "")
+SECONDARY_MODEL = os.environ.get("AIRA_LLM_SECONDARY_MODEL", "")
+
+LLM_DEADLINE = float(os.environ.get("AIRA_LLM_DEADLINE", "60"))
+LLM_TIMEOUT = float(os.environ.get("AIRA_LLM_TIMEOUT", "30"))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("AIRA_LLM_CONNECT_TIMEOUT", "5"))
+LLM_RETRIES = int(os.environ.get("AIRA_LLM_RETRIES", "3"))
+BACKOFF_BASE = float(os.environ.get("AIRA_LLM_BACKOFF", "0.5"))
+BACKOFF_MAX = float(os.environ.get("AIRA_LLM_BACKOFF_MAX", "8"))
+MAX_CONNECTIONS = int(os.environ.get("AIRA_LLM_MAX_CONNECTIONS", "64"))
+MAX_KEEPALIVE = int(os.environ.get("AIRA_LLM_KEEPALIVE", "32"))
+KEEPALIVE_EXPIRY = 90.0
+
+HEDGE_ENABLED = os.environ.get("AIRA_LLM_HEDGE", "1") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("AIRA_LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_INITIAL_DELAY = float(os.environ.get("AIRA_LLM_HEDGE_INITIAL_DELAY", "8"))
+HEDGE_MIN_DELAY = float(os.environ.get("AIRA_LLM_HEDGE_MIN_DELAY", "0.5"))
+HEDGE_BUDGET = float(os.environ.get("AIRA_LLM_HEDGE_BUDGET", "0.1"))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 256
+FAILOVER_AFTER = int(os.environ.get("AIRA_LLM_FAILOVER_AFTER", "3"))
+FAILOVER_COOLDOWN = float(os.environ.get("AIRA_LLM_FAILOVER_COOLDOWN", "30"))
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class Endpoint:
+    def __init__(self, name, base_url, api_key=None, model=None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+
+
+class Attempt:
+    """Outcome of one request to one endpoint: a response (body read) or a transport error."""
+
+    def __init__(self, endpoint, response=None, error=None):
+        self.endpoint = endpoint
+        self.response = response
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.response is not None and self.response.status_code < 400
+
+    @property
+    def retryable(self) -> bool:
+        return self.error is not None or self.response.status_code in RETRY_STATUSES
+
+    def retry_after(self):
+        value = self.response.headers.get("retry-after") if self.response is not None else None
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    def unwrap(self) -> httpx.Response:
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+class Gateway:
+    """Endpoints, retry/hedge policy and latency statistics shared by both transports."""
+
+    def __init__(self, primary, secondary=None):
+        self.primary = primary
+        self.secondary = secondary
+        self._lock = threading.Lock()
+        self._latencies = {}  # request class -> recent primary latencies (seconds)
+        self._recent = deque(maxlen=LATENCY_WINDOW)  # end-to-end seconds of recent calls
+        self._primary_failures = 0
+        self._primary_down_until = 0.0
+        self.stats = {"requests": 0, "attempts": 0, "retries": 0, "failovers": 0,
+                      "hedges": 0, "hedge_wins": 0, "errors": 0}
+
+    # ---- request handling -------------------------------------------------
+    @staticmethod
+    def parse_body(request: httpx.Request):
+        try:
+            body = json.loads(request.content or b"null")
+        except (ValueError, UnicodeDecodeError):
+            return None
+        return body if isinstance(body, dict) else None
+
+    @staticmethod
+    def latency_class(request: httpx.Request, body) -> tuple:
+        # Short routed answers (max_tokens) and full agent steps have very different latencies.
+        body = body or {}
+        return (request.url.path, body.get("model"), body.get("max_tokens"))
+
+    def routable(self, request: httpx.Request) -> bool:
+        return self.secondary is not None and str(request.url).startswith(self.primary.base_url)
+
+    def build(self, request: httpx.Request, body, endpoint: Endpoint, deadline: float) -> httpx.Request:
+        """`request` aimed at `endpoint`, with its timeouts capped by the call deadline."""
+        remaining = max(0.05, deadline - time.monotonic())
+        timeout = {
+            "connect": min(LLM_CONNECT_TIMEOUT, remaining),
+            "read": min(LLM_TIMEOUT, remaining),
+            "write": min(LLM_TIMEOUT, remaining),
+            "pool": min(LLM_CONNECT_TIMEOUT, remaining),
+        }
+        extensions = {**request.extensions, "timeout": timeout}
+        if endpoint is self.primary:
+            return httpx.Request(request.method, request.url, headers=request.headers,
+                                 content=request.content, extensions=extensions)
+        url = endpoint.base_url + str(request.url)[len(self.primary.base_url):]
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in ("host", "content-length", "authorization")}
+        if endpoint.api_key:
+            headers["authorization"] = f"Bearer {endpoint.api_key}"
+        content = request.content
+        if endpoint.model and body is not None and "model" in body:
+            content = json.dumps({**body, "model": endpoint.model}).encode("utf-8")
+        return httpx.Request(request.method, url, headers=headers, content=content, extensions=extensions)
+
+    def order(self, request: httpx.Request, failed=None) -> list:
+        """Endpoints for one attempt, first choice first; a retry starts on the endpoint that did not just fail."""
+        if not self.routable(request):
+            return [self.primary]
+        if failed is not None:
+            primary_first = failed is self.secondary  # retries alternate endpoints
+        else:
+            with self._lock:
+                primary_first = time.monotonic() >= self._primary_down_until
+        return [self.primary, self.secondary] if primary_first else [self.secondary, self.primary]
+
+    def backoff(self, attempt: int, retry_after=None) -> float:
+        pause = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+        return max(pause, retry_after) if retry_after is not None else pause
+
+    # ---- hedging ----------------------------------------------------------
+    def hedge_delay(self, cls):
+        """Seconds to wait before hedging a call of class `cls`."""
+        with self._lock:
+            samples = sorted(self._latencies.get(cls, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_INITIAL_DELAY
+        index = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE / 100.0))
+        return max(HEDGE_MIN_DELAY, samples[index])
+
+    def take_hedge(self) -> bool:
+        """Spend one hedge if hedges stay within HEDGE_BUDGET of calls (plus one to start)."""
+        with self._lock:
+            if self.stats["hedges"] + 1 > HEDGE_BUDGET * self.stats["requests"] + 1:
+                return False
+            self.stats["hedges"] += 1
+            return True
+
+    # ---- bookkeeping ------------------------------------------------------
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+
+    def observe(self, attempt: Attempt, cls, seconds: float, censored: bool = False) -> None:
+        """Record an attempt's latency and the primary's health."""
+        with self._lock:
+            if attempt.endpoint is self.primary and (attempt.ok or censored):
+                # A primary attempt cancelled by a winning hedge took at least `seconds`.
+                self._latencies.setdefault(cls, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+            if censored:
+                return
+            if attempt.endpoint is not self.primary or self.secondary is None:
+                return
+            if attempt.ok:
+                self._primary_failures = 0
+            elif attempt.retryable:
+                self._primary_failures += 1
+                if self._primary_failures >= FAILOVER_AFTER:
+                    self._primary_failures = 0
+                    self._primary_down_until = time.monotonic() + FAILOVER_COOLDOWN
+                    self.stats["failovers"] += 1
+                    print(f"[WARN] llm_gateway: primary failing, preferring {self.secondary.base_url} for {FAILOVER_COOLDOWN:.0f}s")
+
+    def complete(self, started: float) -> None:
+        with self._lock:
+            self._recent.append(time.monotonic() - started)
+
+    def describe(self) -> dict:
+        with self._lock:
+            samples = sorted(self._recent)
+            body = {"primary": self.primary.base_url, "secondary": self.secondary.base_url if self.secondary else None,
+                    **self.stats}
+        for p in (50, 95, 99):
+            body[f"p{p}_ms"] = round(samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000) if samples else None
+        return body
+
+
+class GatewayTransport(httpx.BaseTransport):
+    """Sync transport: deadline, jittered retries and failover (no hedging)."""
+
+    def __init__(self, gateway: Gateway, inner: httpx.BaseTransport):
+        self.gateway = gateway
+        self.inner = inner
+
+    def _attempt(self, request, body, endpoint, deadline, cls) -> Attempt:
+        self.gateway.count("attempts")
+        started = time.monotonic()
+        try:
+            response = self.inner.handle_request(self.gateway.build(request, body, endpoint, deadline))
+            try:
+                response.read()
+            except BaseException:
+                response.close()
+                raise
+            attempt = Attempt(endpoint, response=response)
+        except httpx.TransportError as e:
+            attempt = Attempt(endpoint, error=e)
+        self.gateway.observe(attempt, cls, time.monotonic() - started)
+        return attempt
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        gateway = self.gateway
+        gateway.count("requests")
+        started = time.monotonic()
+        deadline = started + LLM_DEADLINE
+        body = gateway.parse_body(request)
+        cls = gateway.latency_class(request, body)
+        attempt_no, failed = 0, None
+        while True:
+            attempt = self._attempt(request, body, gateway.order(request, failed)[0], deadline, cls)
+            if attempt.ok or not attempt.retryable:
+                gateway.complete(started)
+                return attempt.unwrap()
+            pause = gateway.backoff(attempt_no, attempt.retry_after())
+            if attempt_no >= LLM_RETRIES or time.monotonic() + pause >= deadline:
+                gateway.count("errors")
+                gateway.complete(started)
+                return attempt.unwrap()
+            if attempt.response is not None:
+                attempt.response.close()
+            gateway.count("retries")
+            time.sleep(pause)
+            attempt_no, failed = attempt_no + 1, attempt.endpoint
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+async def _discard(attempts) -> None:
+    for attempt in attempts:
+        if attempt.response is not None:
+            await attempt.response.aclose()
+
+
+class AsyncGatewayTransport(httpx.AsyncBaseTransport):
+    """Async transport: deadline, jittered retries, failover and hedged requests."""
+
+    def __init__(self, gateway: Gateway, inner: httpx.AsyncBaseTransport):
+        self.gateway = gateway
+        self.inner = inner
+
+    async def _attempt(self, request, body, endpoint, deadline, cls, race=None) -> Attempt:
+        """One request to `endpoint`; `race` is the _race state, whose "decided" flag marks hedge losers."""
+        self.gateway.count("attempts")
+        started = time.monotonic()
+        try:
+            response = await self.inner.handle_async_request(self.gateway.build(request, body, endpoint, deadline))
+            try:
+                await response.aread()
+            except BaseException:
+                await response.aclose()
+                raise
+            attempt = Attempt(endpoint, response=response)
+        except httpx.TransportError as e:
+            attempt = Attempt(endpoint, error=e)
+        except asyncio.CancelledError:
+            # Only a hedge loser's elapsed time says anything about the endpoint's latency; runs
+            # cancelled by interruptions or admission timeouts would drag the percentile down.
+            if race is not None and race["decided"]:
+                self.gateway.observe(Attempt(endpoint), cls, time.monotonic() - started, censored=True)
+            raise
+        self.gateway.observe(attempt, cls, time.monotonic() - started)
+        return attempt
+
+    async def _race(self, request, body, endpoints, deadline, cls, hedge) -> Attempt:
+        """Send to endpoints[0]; hedge to endpoints[1] if it is slower than the hedge delay."""
+        gateway = self.gateway
+        race = {"decided": False}  # set once another attempt won, just before the losers are cancelled
+        tasks = [asyncio.ensure_future(self._attempt(request, body, endpoints[0], deadline, cls, race))]
+        try:
+            if hedge and len(endpoints) > 1:
+                delay = min(gateway.hedge_delay(cls), max(0.0, deadline - time.monotonic()))
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and gateway.take_hedge():
+                    print(f"[DEBUG] llm_gateway: hedging to {endpoints[1].base_url} after {delay:.2f}s")
+                    tasks.append(asyncio.ensure_future(self._attempt(request, body, endpoints[1], deadline, cls, race)))
+            failed = []
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    attempt = task.result()
+                    if attempt.ok:
+                        race["decided"] = True
+                        if task is not tasks[0]:
+                            gateway.count("hedge_wins")
+                        await _discard(failed)
+                        return attempt
+                    failed.append(attempt)
+            # Everything failed: report the first-choice endpoint's outcome.
+            failed.sort(key=lambda a: a.endpoint is not endpoints[0])
+            await _discard(failed[1:])
+            return failed[0]
+        finally:
+            losers = [task for task in tasks if not task.done()]
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        gateway = self.gateway
+        gateway.count("requests")
+        started = time.monotonic()
+        deadline = started + LLM_DEADLINE
+        body = gateway.parse_body(request)
+        cls = gateway.latency_class(request, body)
+        hedge = HEDGE_ENABLED and body is not None and not body.get("stream")
+        attempt_no, failed = 0, None
+        while True:
+            attempt = await self._race(request, body, gateway.order(request, failed), deadline, cls, hedge)
+            if attempt.ok or not attempt.retryable:
+                gateway.complete(started)
+                return attempt.unwrap()
+            pause = gateway.backoff(attempt_no, attempt.retry_after())
+            if attempt_no >= LLM_RETRIES or time.monotonic() + pause >= deadline:
+                gateway.count("errors")
+                gateway.complete(started)
+                return attempt.unwrap()
+            await _discard([attempt])
+            gateway.count("retries")
+            print(f"[DEBUG] llm_gateway: retry {attempt_no + 1} in {pause:.2f}s after "
+                  f"{attempt.error or attempt.response.status_code} from {attempt.endpoint.name}")
+            await asyncio.sleep(pause)
+            attempt_no, failed = attempt_no + 1, attempt.endpoint
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+gateway = Gateway(
+    Endpoint("primary", LLM_BASE_URL, model=None),
+    Endpoint("secondary", SECONDARY_URL, SECONDARY_KEY or None, SECONDARY_MODEL or None) if SECONDARY_URL else None,
+)
+
+_LIMITS = httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE,
+                       keepalive_expiry=KEEPALIVE_EXPIRY)
+# One pool per process, shared by every chat model (the async one serves the agent event loop).
+http_client = httpx.Client(transport=GatewayTransport(gateway, httpx.HTTPTransport(limits=_LIMITS)),
+                           timeout=LLM_DEADLINE)
+http_async_client = httpx.AsyncClient(transport=AsyncGatewayTransport(gateway, httpx.AsyncHTTPTransport(limits=_LIMITS)),
+                                      timeout=LLM_DEADLINE)
+
+
+def chat_model(api_key: str, **kwargs):
+    """ChatOpenAI against AIRA_LLM_BASE_URL on the shared gateway clients (AIRA_LLM_GATEWAY=0: SDK defaults)."""
+    from langchain_openai import ChatOpenAI
+
+    kwargs.setdefault("model", LLM_MODEL)
+    if not GATEWAY_ENABLED:
+        return ChatOpenAI(api_key=api_key, base_url=LLM_BASE_URL, **kwargs)
+    return ChatOpenAI(
+        api_key=api_key,
+        base_url=LLM_BASE_URL,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        max_retries=0,  # retries, failover and hedging happen in the gateway transport
+        timeout=LLM_DEADLINE,
+        **kwargs,
+    )
+
+
+def describe() -> dict:
+    return gateway.describe()
+
+
+def _bench(requests, concurrency, max_tokens):
+    """Fire chat completions through the gateway and report end-to-end latency."""
+    async def one(semaphore, latencies, failures):
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                response = await http_async_client.post(f"{LLM_BASE_URL.rstrip('/')}/chat/completions", json={
+                    "model": LLM_MODEL, "max_tokens": max_tokens,
+                    "messages": [{"role": "user", "content": "Explain photosynthesis."}],
+                }, headers={"authorization": f"Bearer {os.environ.get('GROQ_API_KEY', 'standin')}"})
+                response.raise_for_status()
+                latencies.append(time.monotonic() - started)
+            except httpx.HTTPError as e:
+                failures.append(str(e))
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, failures = [], []
+        await asyncio.gather(*(one(semaphore, latencies, failures) for _ in range(requests)))
+        return sorted(latencies), failures
+
+    latencies, failures = asyncio.run(run())
+    report = {"requests": requests, "failed": len(failures), **describe()}
+    for p in (50, 95, 99):
+        report[f"end_to_end_p{p}_ms"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000) if latencies else None
+    report["end_to_end_max_ms"] = round(latencies[-1] * 1000) if latencies else None
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Drive chat completions through the gateway (e.g. against llm_standin.py).")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=300)
+    args = parser.parse_args()
+    _bench(args.requests, args.concurrency, args.max_tokens)
@@ -0,0 +1,94 @@
+"""
+Local OpenAI-compatible stand-in for the LLM provider.
+
+    python llm_standin.py [--port 9001] [--name primary] [--latency 0.4]
+                          [--slow-rate 0.05] [--slow-latency 10]
+                          [--error-rate 0.02] [--error-status 503]
+
+Serves POST /v1/chat/completions with a canned teacher reply after a
+log-normal delay around --latency; --slow-rate of the calls take
+--slow-latency seconds instead (the provider's tail), and --error-rate of them
+fail with --error-status (429 responses carry Retry-After: 1). GET /stats
+reports what it served. Run two of them to exercise llm_gateway.py's
+retries, failover and hedging without spending provider quota:
+
+    python llm_standin.py --port 9001 --slow-rate 0.05 &
+    python llm_standin.py --port 9002 --name secondary &
+    GROQ_API_KEY=standin AIRA_LLM_BASE_URL=http://127.0.0.1:9001/v1 \\
+    AIRA_LLM_SECONDARY_URL=http://127.0.0.1:9002/v1 python llm_gateway.py
+
+The reply never contains tool calls, so an agent run against the stand-in
+finishes after one model call.
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_app(name="primary", latency=0.4, slow_rate=0.0, slow_latency=10.0, error_rate=0.0, error_status=503):
+    app = FastAPI(title=f"LLM stand-in ({name})")
+    stats = {"requests": 0, "slow": 0, "errors": 0}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            headers = {"Retry-After": "1"} if error_status == 429 else {}
+            return JSONResponse(status_code=error_status, headers=headers,
+                                content={"error": {"message": f"stand-in {name} injected error", "type": "server_error"}})
+        delay = random.lognormvariate(0, 0.25) * latency
+        if random.random() < slow_rate:
+            stats["slow"] += 1
+            delay = slow_latency
+        await asyncio.sleep(delay)
+        question = next((m.get("content") for m in reversed(body.get("messages", [])) if m.get("role") == "user"), "")
+        if not isinstance(question, str):
+            question = ""
+        text = f"({name} stand-in) Here is a short explanation of: {question[:200]}"
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "standin"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(text.split()), "total_tokens": len(text.split())},
+        }
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": "standin", "object": "model", "owned_by": name}]}
+
+    @app.get("/stats")
+    def get_stats():
+        return {"name": name, **stats}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--name", default="primary")
+    parser.add_argument("--latency", type=float, default=0.4, help="median seconds per call")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of calls taking --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls failing with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    app = create_app(args.name, args.latency, args.slow_rate, args.slow_latency, args.error_rate, args.error_status)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
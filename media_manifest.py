@@ -0,0 +1,216 @@
+"""
+Structured media manifest for /chat responses.
+
+The teacher's answer references media inline: figures as `(see: <path>)` and
+videos as `(YouTube: <url>)`. Instead of leaving the client to regex those out
+and request each figure only when the sequencer reaches it, /chat also returns
+a manifest: the answer split into ordered segments (narration text and media
+references) and the media items with resolved public URLs (/images/<shard>/<file>),
+byte sizes and pixel dimensions, titles and descriptions. Media details come
+from the turn's tool outputs (image_tool / video_tool), falling back to the
+shard's figure data and video catalog for stored or shared lessons. The same
+figures are advertised as `Link: rel=preload` headers so they can be fetched in
+parallel while the first segment is narrated.
+"""
+import contextvars
+import functools
+import os
+import re
+import struct
+from contextlib import contextmanager
+
+import agent_tools
+from corpus import current_shard
+from utils import get_image_dirs
+
+MAX_PRELOAD_LINKS = int(os.environ.get("AIRA_MAX_PRELOAD_LINKS", "12"))
+
+_IMAGE_MARKER = r"\(see:\s*(?P<image>[^()]+?\.(?:png|jpe?g))\s*\)"
+_VIDEO_MARKER = (
+    r"\(YouTube:\s*(?P<video>https?://(?:www\.)?(?:youtube\.com/watch\?v=|youtu\.be/)"
+    r"(?P<video_id>[\w-]{11})[^)\s]*)\s*\)"
+)
+_MEDIA_MARKER = re.compile(f"{_IMAGE_MARKER}|{_VIDEO_MARKER}", re.I)
+_IMAGE_TOOL_LINE = re.compile(r"^(?P<name>.+?) — (?P<desc>.*) " + _IMAGE_MARKER + r"$", re.I)
+_VIDEO_TOOL_LINE = re.compile(r"^(?P<title>.+?) " + _VIDEO_MARKER + r"$", re.I)
+_CONTENT_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+
+# Tool outputs of the agent runs within the current request (see collect_tool_outputs).
+_tool_outputs = contextvars.ContextVar("aira_tool_outputs", default=None)
+
+
+@contextmanager
+def collect_tool_outputs():
+    """Collect the tool outputs of every agent run made inside the block."""
+    outputs = []
+    token = _tool_outputs.set(outputs)
+    try:
+        yield outputs
+    finally:
+        _tool_outputs.reset(token)
+
+
+def record_tool_outputs(messages) -> None:
+    """Record the tool messages of one agent turn (those after its last human message)."""
+    outputs = _tool_outputs.get()
+    if outputs is None:
+        return
+    turn = []
+    for message in reversed(messages):
+        if getattr(message, "type", None) == "human":
+            break
+        if getattr(message, "type", None) == "tool" and isinstance(message.content, str):
+            turn.append(message.content)
+    outputs.extend(reversed(turn))
+
+
+def _image_key(ref: str) -> str:
+    """'/abs/images/Figure_1.2.png', 'Figure 1.2' -> 'figure_1.2'"""
+    base = re.sub(r"\.(?:png|jpe?g)$", "", os.path.basename(ref.strip()), flags=re.I)
+    return re.sub(r"^figure_(?=figure_)", "", base.replace(" ", "_").lower())
+
+
+def _tool_media(tool_outputs):
+    figures, videos = {}, {}
+    for output in tool_outputs:
+        for line in output.splitlines():
+            line = line.strip()
+            match = _IMAGE_TOOL_LINE.match(line)
+            if match:
+                figures[_image_key(match["image"])] = {"name": match["name"].strip(), "description": match["desc"].strip()}
+                continue
+            match = _VIDEO_TOOL_LINE.match(line)
+            if match:
+                videos[match["video_id"]] = {"title": match["title"].strip()}
+    return figures, videos
+
+
+def _shard_figures():
+    return {_image_key(fig["figure"]): fig for fig in agent_tools.get_figures_data()}
+
+
+def _catalog_videos():
+    catalog = agent_tools.get_video_catalog()
+    return {entry["id"]: entry for entry in catalog[0]} if catalog else {}
+
+
+def _resolve_image(ref: str):
+    """Local file for an image reference; only basenames are trusted, never client paths."""
+    name = os.path.basename(ref.strip())
+    for image_dir in get_image_dirs():
+        path = os.path.join(image_dir, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _image_url(path: str) -> str:
+    """Public URL of a resolved figure: the shard's own mount, else the shared /images folder."""
+    shard = current_shard()
+    name = os.path.basename(path)
+    if os.path.dirname(path) == shard.images_dir:
+        return f"/images/{shard.id}/{name}"
+    return f"/images/{name}"
+
+
+@functools.lru_cache(maxsize=1024)
+def _image_info(path: str, mtime: float) -> dict:
+    info = {"bytes": os.path.getsize(path), "content_type": _CONTENT_TYPES.get(os.path.splitext(path)[1].lower())}
+    try:
+        info.update(_image_dimensions(path))
+    except (OSError, struct.error, ValueError):
+        pass
+    return info
+
+
+def _image_dimensions(path: str) -> dict:
+    """Width/height from the PNG IHDR chunk or the first JPEG SOF marker."""
+    with open(path, "rb") as f:
+        head = f.read(26)
+        if head[:8] == b"\x89PNG\r\n\x1a\n":
+            width, height = struct.unpack(">II", head[16:24])
+            return {"width": width, "height": height}
+        if head[:2] != b"\xff\xd8":
+            return {}
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return {}
+            length = struct.unpack(">H", f.read(2))[0]
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">xHH", f.read(5))
+                return {"width": width, "height": height}
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def build_manifest(text: str, tool_outputs=None) -> dict:
+    """
+    {"segments": [...], "media": [...]} for one answer. Segments keep the answer's
+    order: {"type": "text", "text"} or {"type": "image"|"video", "media": <index>}.
+    Figures that do not resolve to a served file are dropped from the manifest.
+    """
+    tool_figures, tool_videos = _tool_media(tool_outputs or [])
+    shard_figures = catalog_videos = None
+    segments, media, seen = [], [], {}
+
+    def add_text(chunk):
+        chunk = re.sub(r"[ \t]+\n", "\n", chunk).strip()
+        if chunk:
+            segments.append({"type": "text", "text": chunk})
+
+    position = 0
+    for match in _MEDIA_MARKER.finditer(text or ""):
+        add_text(text[position:match.start()])
+        position = match.end()
+        if match["image"]:
+            path = _resolve_image(match["image"])
+            if path is None:
+                continue
+            key = ("image", os.path.basename(path))
+            if key not in seen:
+                figure = tool_figures.get(_image_key(path))
+                if figure is None:
+                    shard_figures = _shard_figures() if shard_figures is None else shard_figures
+                    fig = shard_figures.get(_image_key(path))
+                    figure = {"name": fig["figure"], "description": fig["description"]} if fig else {}
+                seen[key] = len(media)
+                media.append({
+                    "type": "image",
+                    "url": _image_url(path),
+                    **figure,
+                    **_image_info(path, os.path.getmtime(path)),
+                })
+        else:
+            key = ("video", match["video_id"])
+            if key not in seen:
+                catalog_videos = _catalog_videos() if catalog_videos is None else catalog_videos
+                entry = catalog_videos.get(match["video_id"]) or {}
+                video = tool_videos.get(match["video_id"]) or ({"title": entry["title"]} if entry else {})
+                duration = entry.get("duration")
+                seen[key] = len(media)
+                media.append({
+                    "type": "video",
+                    "video_id": match["video_id"],
+                    "url": f"https://www.youtube.com/watch?v={match['video_id']}",
+                    "embed_url": f"https://www.youtube.com/embed/{match['video_id']}",
+                    **video,
+                    **({"duration": duration} if duration else {}),
+                })
+        segments.append({"type": key[0], "media": seen[key]})
+    add_text(text[position:] if text else "")
+
+    for order, item in enumerate(media):
+        item["order"] = order
+    return {"shard": current_shard().id, "segments": segments, "media": media}
+
+
+def preload_links(manifest: dict) -> str:
+    """`Link` header value preloading the manifest's figures (and preconnecting to YouTube)."""
+    links = [
+        f"<{item['url']}>; rel=preload; as=image" + (f"; type=\"{item['content_type']}\"" if item.get("content_type") else "")
+        for item in manifest["media"] if item["type"] == "image"
+    ][:MAX_PRELOAD_LINKS]
+    if any(item["type"] == "video" for item in manifest["media"]):
+        links.append("<https://www.youtube.com>; rel=preconnect")
+    return ", ".join(links)
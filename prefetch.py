@@ -0,0 +1,166 @@
+"""
+Speculative prefetch of the next subchapters in the lesson index.
+
+Lessons follow the ordered chapter/subchapter tree of the lesson index, so once
+a student finishes "1.2.1 Combination Reaction" the next pick is very likely
+"1.2.2 Decomposition Reaction". After a lesson is delivered, `schedule(title)`
+queues the next AIRA_PREFETCH_AHEAD subchapters of the same shard; a single
+low-priority background worker then warms the tool caches (knowledge base,
+figures, video) for them and, with AIRA_PREFETCH_LESSONS=1, generates the
+lesson itself into the lesson cache unless the lesson store already has it.
+
+Prefetching never competes with live requests: jobs run only while admission
+shows no queued runs and fewer than AIRA_PREFETCH_MAX_LOAD of the concurrent
+run slots in use (lesson generation only when no run is active at all), are
+limited to AIRA_PREFETCH_PER_MINUTE jobs per minute, and are dropped when they
+could not start within AIRA_PREFETCH_MAX_DELAY seconds.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import admission
+import corpus
+from admission import TokenBucket
+from utils import normalize_title
+
+PREFETCH_ENABLED = os.environ.get("AIRA_PREFETCH", "1") == "1"
+PREFETCH_AHEAD = int(os.environ.get("AIRA_PREFETCH_AHEAD", "2"))
+PREFETCH_PER_MINUTE = float(os.environ.get("AIRA_PREFETCH_PER_MINUTE", "20"))
+PREFETCH_MAX_LOAD = float(os.environ.get("AIRA_PREFETCH_MAX_LOAD", "0.5"))
+PREFETCH_MAX_DELAY = float(os.environ.get("AIRA_PREFETCH_MAX_DELAY", "120"))
+PREFETCH_MAX_QUEUE = 32
+PREFETCH_NICE = 10  # lower OS scheduling priority of the worker thread (Linux)
+PREFETCH_REPEAT_AFTER = 600  # seconds before the same subchapter is warmed again
+
+
+def next_titles(title: str, count: int = PREFETCH_AHEAD, shard=None) -> list:
+    """The `count` lesson-index picks following `title` in index order."""
+    from lesson_store import get_lesson_index
+
+    titles = [item["title"] for item in get_lesson_index(shard or corpus.current_shard())]
+    wanted = normalize_title(title)
+    for position, candidate in enumerate(titles):
+        if normalize_title(candidate) == wanted:
+            return titles[position + 1:position + 1 + count]
+    return []
+
+
+class Prefetcher:
+    def __init__(self, per_minute, max_load, max_delay, max_queue):
+        self.max_load = max_load
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self._budget = TokenBucket(per_minute)
+        self._cond = threading.Condition()
+        self._queue = OrderedDict()  # (shard id, normalized title) -> (title, queued_at)
+        self._done = OrderedDict()   # key -> when it was last warmed, so repeated schedules are free
+        self._thread = None
+        self.stats = {"scheduled": 0, "completed": 0, "dropped": 0, "failed": 0}
+
+    def schedule(self, title: str, shard=None) -> list:
+        """Queue the subchapters after `title`; returns the titles newly queued."""
+        shard = shard or corpus.current_shard()
+        queued = []
+        with self._cond:
+            now = time.monotonic()
+            for upcoming in next_titles(title, shard=shard):
+                key = (shard.id, normalize_title(upcoming))
+                if key in self._queue or now - self._done.get(key, -PREFETCH_REPEAT_AFTER) < PREFETCH_REPEAT_AFTER:
+                    continue
+                if len(self._queue) >= self.max_queue:
+                    self._queue.popitem(last=False)  # the oldest guess is the least likely to be useful
+                    self.stats["dropped"] += 1
+                self._queue[key] = (upcoming, now)
+                queued.append(upcoming)
+            self.stats["scheduled"] += len(queued)
+            if queued:
+                self._ensure_worker()
+                self._cond.notify()
+        if queued:
+            print(f"[DEBUG] prefetch: after '{title}' queued {queued} (shard {shard.id})")
+        return queued
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="aira-prefetch", daemon=True)
+            self._thread.start()
+
+    def _idle(self, for_generation=False) -> bool:
+        if not admission.ADMISSION_ENABLED:
+            return True
+        stats = admission.controller.stats()
+        if stats["waiting"] > 0:
+            return False
+        if for_generation:
+            return stats["running"] == 0
+        return stats["running"] < admission.controller.max_concurrent * self.max_load
+
+    def _next_job(self):
+        """Block until a job may run under the load and rate budget; expired jobs are dropped."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                for key, (title, queued_at) in list(self._queue.items()):
+                    if now - queued_at > self.max_delay:
+                        del self._queue[key]
+                        self.stats["dropped"] += 1
+                        print(f"[DEBUG] prefetch: dropped stale '{title}'")
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                self._budget.refill(now)
+                if self._budget.level >= 1 and self._idle():
+                    self._budget.level -= 1
+                    key, (title, _) = self._queue.popitem(last=False)
+                    return key, title
+                self._cond.wait(1.0)
+
+    def _run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PREFETCH_NICE)
+        except (AttributeError, OSError):
+            pass  # not supported here; the load gate still applies
+        while True:
+            key, title = self._next_job()
+            started = time.monotonic()
+            try:
+                self.warm(key[0], title)
+                self.stats["completed"] += 1
+                print(f"[DEBUG] prefetch: warmed '{title}' in {time.monotonic() - started:.2f}s")
+            except Exception as e:  # noqa: BLE001 - a failed guess must not stop the worker
+                self.stats["failed"] += 1
+                print(f"[WARN] prefetch: failed for '{title}': {e}")
+            with self._cond:
+                self._done[key] = time.monotonic()
+                self._done.move_to_end(key)
+                while len(self._done) > 256:
+                    self._done.popitem(last=False)
+
+    def warm(self, shard_id, title):
+        import agent
+        import agent_tools
+        import lesson_store
+
+        with corpus.use_shard(shard_id):
+            agent_tools.prefetch_topic(title)
+            if agent.PREFETCH_LESSONS and lesson_store.lookup_lesson(title) is None and self._idle(for_generation=True):
+                agent.prefetch_lesson(title)
+
+    def describe(self) -> dict:
+        with self._cond:
+            return {**self.stats, "queued": len(self._queue)}
+
+
+prefetcher = Prefetcher(PREFETCH_PER_MINUTE, PREFETCH_MAX_LOAD, PREFETCH_MAX_DELAY, PREFETCH_MAX_QUEUE)
+
+
+def schedule(title: str) -> None:
+    """Module-level entry point after a lesson is delivered; a no-op when AIRA_PREFETCH=0."""
+    if not PREFETCH_ENABLED:
+        return
+    try:
+        prefetcher.schedule(title)
+    except Exception as e:  # noqa: BLE001 - prefetch is best effort
+        print(f"[WARN] prefetch: could not schedule after '{title}': {e}")
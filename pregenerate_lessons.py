@@ -0,0 +1,145 @@
+"""
+Offline batch pre-generation of every lesson in frontend_lessons.json.
+
+    python pregenerate_lessons.py --workers 2 --retries 3 [--shard <id>] [--tts]
+
+Walks the lesson index, generates each subchapter's lesson through the same
+agent pipeline /chat uses (full ReAct agent with tools), and appends each
+result to lesson_store/<version>/lessons.jsonl. The JSONL doubles as the
+checkpoint: re-running the command resumes, skipping lessons already stored
+and retrying ones that failed. When every lesson succeeds (or with
+--publish-partial) the version is published and /chat serves index picks
+straight from the store. With --tts the sentence audio of every stored
+lesson is also synthesized into the /tts cache, so lesson playback never
+waits on synthesis.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import corpus
+import lesson_store
+from utils import normalize_title
+
+
+def generate_lesson(item, retries, previous_attempts=0, shard=None):
+    """Generate one lesson with jittered exponential backoff; returns a store record."""
+    import agent
+    last_error = None
+    for attempt in range(1, retries + 1):
+        try:
+            with corpus.use_shard(shard):
+                text = agent.generate_lesson(item["title"])
+            if lesson_store.LESSON_COMPLETE_MARKER not in text:
+                raise ValueError(f"response has no {lesson_store.LESSON_COMPLETE_MARKER} marker")
+            return lesson_store.make_record(item, "ok", response=text, attempts=previous_attempts + attempt)
+        except Exception as e:  # noqa: BLE001 - recorded in the checkpoint and retried
+            last_error = str(e)
+            print(f"[WARN] pregenerate: '{item['title']}' attempt {attempt}/{retries} failed: {last_error}")
+            if attempt < retries:
+                time.sleep(min(60.0, 2 ** attempt) + random.uniform(0, 1))
+    return lesson_store.make_record(item, "failed", error=last_error, attempts=previous_attempts + retries)
+
+
+def warm_tts(records, voice=None):
+    import tts  # only needed (and only loads an engine) with --tts
+
+    if not tts.is_available():
+        print("[WARN] pregenerate: --tts given but no offline TTS engine is installed; skipping")
+        return
+    lessons = [r for r in records.values() if r.get("status") == "ok" and r.get("response")]
+    for done, record in enumerate(lessons, start=1):
+        try:
+            sentences = tts.warm_cache(record["response"], voice)
+            print(f"[DEBUG] pregenerate: tts [{done}/{len(lessons)}] {sentences} sentences: {record['title']}")
+        except Exception as e:  # noqa: BLE001 - one lesson's audio must not stop the batch
+            print(f"[WARN] pregenerate: tts failed for '{record['title']}': {e}")
+
+
+def write_manifest(version, model_name, system_prompt, records, shard=None):
+    statuses = [r.get("status") for r in records.values()]
+    manifest = {
+        "version": version,
+        "shard": (shard or corpus.current_shard()).id,
+        "model": model_name,
+        "prompt_sha256": hashlib.sha256(system_prompt.encode("utf-8")).hexdigest(),
+        "lessons_ok": statuses.count("ok"),
+        "lessons_failed": statuses.count("failed"),
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    path = os.path.join(lesson_store.version_dir(version, shard), "manifest.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2, help="concurrent generations (bounded pool)")
+    parser.add_argument("--retries", type=int, default=3, help="attempts per lesson in this run")
+    parser.add_argument("--limit", type=int, default=None, help="only process the first N pending lessons")
+    parser.add_argument("--version", default=None, help="store version (default: content hash)")
+    parser.add_argument("--publish-partial", action="store_true", help="publish even if some lessons failed")
+    parser.add_argument("--no-publish", action="store_true", help="never update CURRENT")
+    parser.add_argument("--shard", default=None, help="corpus shard (textbook) id; default shard if omitted")
+    parser.add_argument("--tts", action="store_true", help="also warm the /tts sentence audio cache for stored lessons")
+    parser.add_argument("--tts-voice", default=None, help="voice to synthesize with --tts (default AIRA_TTS_VOICE)")
+    args = parser.parse_args()
+
+    import agent
+    if agent.agent is None:
+        raise SystemExit("GROQ_API_KEY is not set; cannot generate lessons.")
+    shard = corpus.registry.get(args.shard)
+    model_name = agent.llm.model_name
+    version = args.version or lesson_store.compute_version(agent.agent_system_prompt, model_name, shard)
+
+    items = lesson_store.get_lesson_index(shard)
+    records = lesson_store.read_records(version, shard)
+    pending, seen = [], set()
+    for item in items:
+        key = normalize_title(item["title"])
+        if key not in seen and records.get(key, {}).get("status") != "ok":
+            pending.append(item)
+        seen.add(key)
+    if args.limit is not None:
+        pending = pending[:args.limit]
+    print(f"[DEBUG] pregenerate: shard={shard.id} version={version} total={len(items)} pending={len(pending)} workers={args.workers}")
+
+    writer = lesson_store.CheckpointWriter(lesson_store.lessons_path(version, shard))
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            futures = {
+                pool.submit(
+                    generate_lesson, item, args.retries,
+                    records.get(normalize_title(item["title"]), {}).get("attempts", 0), shard,
+                ): item
+                for item in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                writer.write(record)
+                records[normalize_title(record["title"])] = record
+                print(f"[DEBUG] pregenerate: [{done}/{len(pending)}] {record['status']}: {record['title']}")
+    finally:
+        writer.close()
+
+    manifest = write_manifest(version, model_name, agent.agent_system_prompt, records, shard)
+    missing = [i["title"] for i in items if records.get(normalize_title(i["title"]), {}).get("status") != "ok"]
+    print(f"[DEBUG] pregenerate: {manifest['lessons_ok']} ok, {len(missing)} not yet generated")
+    if args.tts:
+        warm_tts(records, args.tts_voice)
+    if args.no_publish:
+        return
+    if not missing or args.publish_partial:
+        lesson_store.publish(version, shard)
+        print(f"[DEBUG] pregenerate: published {version}")
+    else:
+        print("[DEBUG] pregenerate: not publishing; re-run to retry, or pass --publish-partial")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Replay a recorded request log (request_log.py) against a running server.
+
+    python replay.py [logs/requests-*.jsonl ...] [--url http://localhost:8000]
+                     [--speed 1.0] [--max-gap 30] [--limit N] [--overlap-turns]
+                     [--audio sample.webm] [--out replay_results.jsonl]
+
+Without log arguments, every worker's log in logs/ is read (see
+request_log.py). Requests are sent open-loop at their recorded offsets divided
+by --speed (--speed 4 replays an hour of classroom traffic in 15 minutes);
+--max-gap caps idle gaps between consecutive requests, so overnight silence is
+skipped. By default turns of one recorded session still go out in order, each
+after the previous turn's answer. That cannot reproduce a newer turn
+superseding (cancelling) one still in flight on the same thread; with
+--overlap-turns every turn goes out at its recorded offset regardless, so
+interruptions race the runs they interrupted as in the original traffic.
+Sessions get fresh thread ids per replay so they start from an empty history,
+and /chat requests pin the shard that served the original. Recorded /transcribe calls carry no audio; they are
+replayed with --audio if given and skipped otherwise.
+
+Prints latency percentiles per endpoint and route next to the recorded ones,
+plus throughput and outcome counts; --out keeps one result line per request.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+DEFAULT_LOGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "requests-*.jsonl")
+
+
+def load_records(paths, limit=None):
+    """Records of the given logs (rotated files included, oldest first), ordered by timestamp."""
+    records = []
+    for path in paths:
+        rotated = [p for p in glob.glob(glob.escape(path) + ".*") if p.rsplit(".", 1)[1].isdigit()]
+        rotated.sort(key=lambda p: int(p.rsplit(".", 1)[1]), reverse=True)
+        for name in rotated + [path]:
+            if not os.path.exists(name):
+                continue
+            with open(name, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        print(f"[WARN] replay: skipping malformed line in {name}")
+    records = [r for r in records if r.get("endpoint") in ("/chat", "/transcribe") and "ts" in r]
+    records.sort(key=lambda r: r["ts"])
+    return records[:limit] if limit else records
+
+
+def schedule(records, speed, max_gap):
+    """Send offsets in seconds from the start of the replay."""
+    offsets, offset, previous = [], 0.0, None
+    for record in records:
+        if previous is not None:
+            gap = record["ts"] - previous
+            offset += min(gap, max_gap) if max_gap else gap
+        previous = record["ts"]
+        offsets.append(offset / speed)
+    return offsets
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p / 100))], 1) if values else None
+
+
+class Replayer:
+    def __init__(self, url, audio=None, timeout=300.0, overlap_turns=False):
+        self.url = url.rstrip("/")
+        self.audio = audio
+        self.timeout = timeout
+        self.overlap_turns = overlap_turns
+        self.run_id = uuid.uuid4().hex[:8]
+        self.results = []
+        self._sessions = defaultdict(asyncio.Lock)  # recorded thread -> turn order
+
+    async def send(self, client, record):
+        if record["endpoint"] == "/chat":
+            payload = {
+                "query": record.get("query") or "",
+                "thread_id": f"replay-{self.run_id}-{record.get('thread_id') or uuid.uuid4().hex}",
+                "interruption_context": record.get("interruption_context") or "",
+            }
+            if record.get("shard"):
+                payload["shard"] = record["shard"]
+            response = await client.post(f"{self.url}/chat", json=payload)
+            body = response.json() if response.status_code == 200 else {}
+            outcome = ("superseded" if body.get("superseded") else "queued" if body.get("queued")
+                       else "ok" if response.status_code == 200 else "error")
+        else:
+            with open(self.audio, "rb") as f:
+                response = await client.post(f"{self.url}/transcribe", files={"file": (os.path.basename(self.audio), f.read())})
+            body = response.json() if response.status_code == 200 else {}
+            outcome = "error" if response.status_code != 200 or body.get("error") else "ok"
+        return response.status_code, outcome, len(response.content)
+
+    async def replay_one(self, client, record, offset, started):
+        delay = started + offset - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        session = record.get("thread_id") or id(record)
+        async with self._sessions[session if not self.overlap_turns else id(record)]:
+            sent = time.monotonic()
+            try:
+                status, outcome, size = await self.send(client, record)
+            except (httpx.HTTPError, ValueError) as e:
+                status, outcome, size = None, f"failed: {type(e).__name__}", 0
+            self.results.append({
+                "endpoint": record["endpoint"],
+                "route": record.get("route"),
+                "query": (record.get("query") or "")[:80],
+                "scheduled_s": round(offset, 3),
+                "lag_s": round(sent - started - offset, 3),  # waiting on the session's previous turn
+                "latency_ms": round((time.monotonic() - sent) * 1000, 1),
+                "recorded_ms": record.get("total_ms"),
+                "status": status,
+                "outcome": outcome,
+                "response_bytes": size,
+                "recorded_response_bytes": record.get("response_bytes"),
+            })
+
+    async def run(self, records, offsets):
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=64)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            started = time.monotonic()
+            await asyncio.gather(*(self.replay_one(client, r, o, started) for r, o in zip(records, offsets)))
+            return time.monotonic() - started
+
+
+def summarize(results, wall_seconds):
+    groups = defaultdict(list)
+    for result in results:
+        groups[(result["endpoint"], result["route"] or "-")].append(result)
+    summary = {"requests": len(results), "wall_s": round(wall_seconds, 1),
+               "throughput_rps": round(len(results) / wall_seconds, 2) if wall_seconds > 0 else None,
+               "outcomes": {}, "groups": {}}
+    for result in results:
+        summary["outcomes"][result["outcome"]] = summary["outcomes"].get(result["outcome"], 0) + 1
+    for (endpoint, route), items in sorted(groups.items()):
+        latencies = [r["latency_ms"] for r in items if r["status"] == 200]
+        recorded = [r["recorded_ms"] for r in items if r["recorded_ms"] is not None]
+        summary["groups"][f"{endpoint} {route}"] = {
+            "count": len(items),
+            **{f"p{p}_ms": _percentile(latencies, p) for p in (50, 95, 99)},
+            **{f"recorded_p{p}_ms": _percentile(recorded, p) for p in (50, 95, 99)},
+            "max_lag_s": max(r["lag_s"] for r in items),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="*", help="request logs (rotated .1 ... files are included; default: logs/requests-*.jsonl)")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="pacing multiplier (2 = twice as fast)")
+    parser.add_argument("--max-gap", type=float, default=None, help="cap idle gaps between requests at this many seconds")
+    parser.add_argument("--limit", type=int, default=None, help="replay only the first N requests")
+    parser.add_argument("--audio", default=None, help="audio file to send for recorded /transcribe calls")
+    parser.add_argument("--overlap-turns", action="store_true",
+                        help="send each turn at its recorded offset even while the session's previous turn is running")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--out", default=None, help="write one JSON line per replayed request")
+    args = parser.parse_args()
+
+    records = load_records(args.logs or sorted(glob.glob(DEFAULT_LOGS)), args.limit)
+    if not args.audio:
+        skipped = sum(1 for r in records if r["endpoint"] == "/transcribe")
+        records = [r for r in records if r["endpoint"] == "/chat"]
+        if skipped:
+            print(f"[DEBUG] replay: skipping {skipped} /transcribe records (no --audio)")
+    if not records:
+        print("[WARN] replay: no requests to replay")
+        return
+    offsets = schedule(records, args.speed, args.max_gap)
+    print(f"[DEBUG] replay: {len(records)} requests over {offsets[-1]:.1f}s at speed {args.speed} against {args.url}")
+
+    replayer = Replayer(args.url, args.audio, args.timeout, args.overlap_turns)
+    wall_seconds = asyncio.run(replayer.run(records, offsets))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for result in sorted(replayer.results, key=lambda r: r["scheduled_s"]):
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    print(json.dumps(summarize(replayer.results, wall_seconds), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Write-behind log of /chat and /transcribe requests, for replay.py.
+
+Each request appends one compact JSON line to AIRA_REQUEST_LOG_PATH (default
+logs/requests-{pid}.jsonl): timestamp, endpoint, query, thread, interruption
+context, shard, routing decision, per-stage timings in milliseconds, outcome
+and response size. Handlers fill the current record through
+`request("/chat")`, `annotate(...)` and `stage("name")`; the record travels
+in a context variable, so stages timed inside agent runs land on it too.
+
+Logging never blocks a request on disk I/O: finished records go into an
+in-memory buffer (at most AIRA_REQUEST_LOG_BUFFER records; beyond that they
+are dropped and counted) and a daemon thread writes them in batches every
+AIRA_REQUEST_LOG_FLUSH seconds or AIRA_REQUEST_LOG_BATCH records. The file
+is rotated to .1 ... .N (AIRA_REQUEST_LOG_BACKUPS) once it would exceed
+AIRA_REQUEST_LOG_MAX_MB. `{pid}` in the path is replaced with the writing
+process id: every worker (gunicorn pre-fork or uvicorn --workers) appends to
+and rotates its own file, since concurrent appends and renames of one shared
+file interleave batches and lose records. Set AIRA_REQUEST_LOG=0 to disable.
+"""
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+REQUEST_LOG_ENABLED = os.environ.get("AIRA_REQUEST_LOG", "1") == "1"
+REQUEST_LOG_PATH = os.environ.get("AIRA_REQUEST_LOG_PATH", os.path.join(PROJECT_ROOT, "logs", "requests-{pid}.jsonl"))
+REQUEST_LOG_MAX_BYTES = int(float(os.environ.get("AIRA_REQUEST_LOG_MAX_MB", "50")) * 1024 * 1024)
+REQUEST_LOG_BACKUPS = int(os.environ.get("AIRA_REQUEST_LOG_BACKUPS", "5"))
+REQUEST_LOG_FLUSH = float(os.environ.get("AIRA_REQUEST_LOG_FLUSH", "2"))
+REQUEST_LOG_BATCH = int(os.environ.get("AIRA_REQUEST_LOG_BATCH", "256"))
+REQUEST_LOG_BUFFER = int(os.environ.get("AIRA_REQUEST_LOG_BUFFER", "10000"))
+MAX_TEXT_CHARS = 4000  # longer queries / interruption contexts are truncated
+
+_current = contextvars.ContextVar("aira_request_record", default=None)
+
+
+class BufferedWriter:
+    """Appends JSON lines from a background thread in batches, with size-based rotation."""
+
+    def __init__(self, path, max_bytes, backups, flush_interval, batch_size, max_pending):
+        self.path_template = path
+        self.path = None  # resolved when the file is first opened (after a pre-fork worker starts)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._file = None
+        self._size = 0
+        self._thread = None
+        self._closing = False
+        self.stats = {"written": 0, "dropped": 0, "batches": 0, "rotations": 0, "errors": 0}
+
+    def submit(self, record: dict) -> bool:
+        """Queue one record; never waits for I/O. Returns False when the buffer is full."""
+        with self._cond:
+            if self._closing or len(self._pending) >= self.max_pending:
+                self.stats["dropped"] += 1
+                return False
+            self._pending.append(record)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="aira-request-log", daemon=True)
+                self._thread.start()
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._cond.notify()  # start a flush window, or cut it short when the batch is full
+        return True
+
+    def _take_batch(self) -> list:
+        with self._cond:
+            while not self._pending and not self._closing:
+                self._cond.wait()
+            # Give the batch up to flush_interval to fill up.
+            self._cond.wait_for(lambda: len(self._pending) >= self.batch_size or self._closing, timeout=self.flush_interval)
+            batch = list(self._pending)
+            self._pending.clear()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                try:
+                    self._write(batch)
+                except (OSError, TypeError, ValueError) as e:
+                    self.stats["errors"] += 1
+                    print(f"[WARN] request_log: could not write {len(batch)} records to {self.path}: {e}")
+            if self._closing and not self._pending:
+                return
+
+    def _open(self):
+        self.path = self.path_template.replace("{pid}", str(os.getpid()))
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._size = os.fstat(self._file.fileno()).st_size
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                older = f"{self.path}.{index}"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.stats["rotations"] += 1
+
+    def _write(self, batch):
+        data = "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in batch).encode("utf-8")
+        if self._file is None:
+            self._open()
+        if self._size > 0 and self._size + len(data) > self.max_bytes:
+            self._rotate()
+            self._open()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        self.stats["written"] += len(batch)
+        self.stats["batches"] += 1
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Flush what is buffered and stop the writer thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def describe(self) -> dict:
+        with self._cond:
+            return {"path": self.path or self.path_template, "pending": len(self._pending), **self.stats}
+
+
+writer = BufferedWriter(REQUEST_LOG_PATH, REQUEST_LOG_MAX_BYTES, REQUEST_LOG_BACKUPS,
+                        REQUEST_LOG_FLUSH, REQUEST_LOG_BATCH, REQUEST_LOG_BUFFER)
+atexit.register(writer.close)
+
+
+def _clip(value):
+    if isinstance(value, str) and len(value) > MAX_TEXT_CHARS:
+        return value[:MAX_TEXT_CHARS]
+    return value
+
+
+@contextmanager
+def request(endpoint: str):
+    """Collect one request's record inside the block and queue it for writing afterwards."""
+    started = time.perf_counter()
+    record = {"ts": round(time.time(), 3), "endpoint": endpoint, "pid": os.getpid(), "stages": {}}
+    token = _current.set(record)
+    try:
+        yield record
+    except BaseException as exc:
+        record.setdefault("outcome", "exception")
+        record["error"] = f"{type(exc).__name__}: {exc}"[:500]
+        if getattr(exc, "status_code", None) is not None:
+            record["status"] = exc.status_code
+        raise
+    finally:
+        _current.reset(token)
+        record["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if REQUEST_LOG_ENABLED:
+            writer.submit(record)
+
+
+def annotate(**fields) -> None:
+    """Add fields to the current request's record (no-op outside `request`)."""
+    record = _current.get()
+    if record is not None:
+        record.update({key: _clip(value) for key, value in fields.items()})
+
+
+@contextmanager
+def stage(name: str):
+    """Time the block as stage `name` of the current request (repeated stages add up)."""
+    record = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if record is not None:
+            stages = record["stages"]
+            stages[name] = round(stages.get(name, 0.0) + (time.perf_counter() - started) * 1000, 1)
+
+
+def response_size(response) -> dict:
+    """Size fields for a handler result (a dict or a rendered Response)."""
+    body = getattr(response, "body", None)
+    if body is None:
+        try:
+            body = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        except (TypeError, ValueError):
+            return {}
+    return {"response_bytes": len(body)}
+
+
+def describe() -> dict:
+    return writer.describe()
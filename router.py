@@ -0,0 +1,214 @@
+"""
+Fast local pre-LLM router.
+
+Classifies each student turn before it reaches the agent so that casual and
+out-of-syllabus messages can skip tool binding and cost one short generation:
+
+  - "casual"        greetings / thanks with no real question attached
+  - "out_syllabus"  not close to any textbook subchapter
+  - "in_syllabus"   everything else (full ReAct agent with tools)
+
+The syllabus check combines two embedding signals:
+  - syllabus_score:  max cosine similarity to the subchapter centroids
+                     (mean of each subchapter's title and content embeddings)
+  - retrieval_score: cosine similarity of the top textbook FAISS hit, i.e. how
+                     confident knowledgebase_tool would be
+
+The default thresholds are conservative (they favour the full agent). Run
+`python router.py --calibrate` against the deployed corpus and set the printed
+AIRA_ROUTER_SYLLABUS_THRESHOLD / AIRA_ROUTER_RETRIEVAL_THRESHOLD values.
+"""
+import os
+import re
+import sys
+
+import corpus
+import utils
+from corpus import shard_resource
+from utils import normalize_title
+
+ROUTE_CASUAL = "casual"
+ROUTE_OUT_OF_SYLLABUS = "out_syllabus"
+ROUTE_IN_SYLLABUS = "in_syllabus"
+
+ROUTER_ENABLED = os.environ.get("AIRA_ROUTER", "1") == "1"
+SYLLABUS_THRESHOLD = float(os.environ.get("AIRA_ROUTER_SYLLABUS_THRESHOLD", "0.40"))
+RETRIEVAL_THRESHOLD = float(os.environ.get("AIRA_ROUTER_RETRIEVAL_THRESHOLD", "0.35"))
+
+CASUAL_INDICATORS = [
+    "hello", "hi", "hey", "how are you", "good morning", "good afternoon", "good evening",
+    "thanks", "thank you", "ok", "okay", "bye", "goodbye", "see you", "nice", "cool", "great",
+]
+_CASUAL_RE = re.compile(r"\b(" + "|".join(re.escape(c) for c in CASUAL_INDICATORS) + r")\b")
+_FILLER_WORDS = {
+    "a", "an", "the", "so", "much", "very", "you", "teacher", "miss", "sir", "maam", "ma", "am",
+    "i", "im", "is", "it", "that", "this", "was", "for", "all", "and", "again", "too",
+    "doing", "today", "there", "everyone", "yes", "no", "got", "understood", "clear", "now",
+}
+
+# Probe queries that should land outside the syllabus; used only for calibration.
+OUT_OF_SYLLABUS_PROBES = [
+    "who won the football world cup",
+    "write a poem about my cat",
+    "what is the capital of france",
+    "how do i bake a chocolate cake",
+    "tell me a joke about computers",
+    "who is the prime minister of india",
+    "how do i solve quadratic equations",
+    "what is the plot of harry potter",
+    "recommend a good video game",
+    "how do stock markets work",
+    "translate hello into spanish",
+    "what is the history of the roman empire",
+]
+
+
+def is_casual(query: str) -> bool:
+    """A casual turn contains a greeting/thanks and nothing else but filler words."""
+    text = re.sub(r"[^\w\s]", " ", query.lower())
+    if not _CASUAL_RE.search(text):
+        return False
+    remainder = _CASUAL_RE.sub(" ", text).split()
+    content_words = [w for w in remainder if w not in _FILLER_WORDS]
+    # Any other word ("why", "explain", a science term) makes it a real question.
+    return not content_words
+
+
+def _normalize_rows(matrix):
+    import numpy as np
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def _encode(texts):
+    import numpy as np
+    embeddings = utils.get_model().encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def compute_subchapter_centroids(shard=None):
+    """One L2-normalized centroid per textbook row: mean of its title and content embeddings."""
+    import numpy as np
+    metadata = utils.get_metadata(shard)
+    content = utils.get_kb_embeddings(shard)
+    if content is None:
+        index = utils.get_faiss_index(shard)
+        content = index.reconstruct_n(0, index.ntotal)
+    content = _normalize_rows(np.asarray(content, dtype=np.float32))
+    titles = _encode([item["title"].strip() for item in metadata])
+    return _normalize_rows(content + titles)
+
+
+@shard_resource
+def get_subchapter_centroids(shard):
+    """The current shard's centroids; precomputed by build_assets.py when available."""
+    import numpy as np
+    path = shard.asset(corpus.SHARD_CENTROIDS_ASSET)
+    if os.path.exists(path):
+        centroids = np.load(path)
+        if len(centroids) == len(utils.get_metadata(shard)):
+            return centroids
+        print(f"[WARN] router: {path} does not match the shard's rows; recomputing")
+    return compute_subchapter_centroids(shard)
+
+
+def _exact_title_match(norm_query):
+    for item in utils.get_metadata():
+        if len(norm_query) >= 4 and norm_query in normalize_title(item["title"]):
+            return item["title"]
+    return None
+
+
+def score_query(query: str) -> dict:
+    """Embedding-based syllabus scores for a query (see module docstring)."""
+    query_embedding = _encode([query])
+    syllabus_score = float((get_subchapter_centroids() @ query_embedding[0]).max())
+    # Textbook index vectors are L2-normalized, so squared L2 distance d maps to cos = 1 - d / 2.
+    distances, indices = utils.get_faiss_index().search(query_embedding, 1)
+    retrieval_score = float(1.0 - distances[0][0] / 2.0) if indices[0][0] >= 0 else 0.0
+    return {"syllabus_score": syllabus_score, "retrieval_score": retrieval_score}
+
+
+def route_query(query: str, interruption_context: str = "") -> dict:
+    """
+    Decide how a student turn should be handled.
+    Returns {"route", "reason", "syllabus_score", "retrieval_score", "matched_title"}.
+    Falls back to the full agent ("in_syllabus") whenever the router cannot decide.
+    """
+    decision = {
+        "route": ROUTE_IN_SYLLABUS,
+        "reason": "default",
+        "syllabus_score": None,
+        "retrieval_score": None,
+        "matched_title": None,
+    }
+    if not ROUTER_ENABLED:
+        decision["reason"] = "router disabled"
+        return decision
+    # Interruptions must resume the paused lesson, which needs the full agent.
+    if interruption_context:
+        decision["reason"] = "interruption"
+        return decision
+    if is_casual(query):
+        decision.update(route=ROUTE_CASUAL, reason="casual heuristic")
+        return decision
+
+    matched_title = _exact_title_match(normalize_title(query))
+    if matched_title:
+        decision.update(reason="exact title match", matched_title=matched_title)
+        return decision
+
+    try:
+        decision.update(score_query(query))
+    except Exception as e:  # noqa: BLE001 - never block a turn on the router
+        print(f"[WARN] router: scoring failed, using full agent: {e}")
+        decision["reason"] = "scoring failed"
+        return decision
+
+    if decision["syllabus_score"] >= SYLLABUS_THRESHOLD or decision["retrieval_score"] >= RETRIEVAL_THRESHOLD:
+        decision["reason"] = "similar to syllabus"
+    else:
+        decision.update(route=ROUTE_OUT_OF_SYLLABUS, reason="below syllabus thresholds")
+    return decision
+
+
+def _best_threshold(positives, negatives):
+    """Threshold maximizing balanced accuracy between positive and negative scores."""
+    candidates = sorted(set(positives) | set(negatives))
+    best, best_acc = SYLLABUS_THRESHOLD, -1.0
+    for t in candidates:
+        tpr = sum(p >= t for p in positives) / len(positives)
+        tnr = sum(n < t for n in negatives) / len(negatives)
+        acc = (tpr + tnr) / 2
+        if acc > best_acc:
+            best, best_acc = t, acc
+    return best, best_acc
+
+
+def calibrate_thresholds() -> dict:
+    """
+    Score question-style probes built from every subchapter title (positives)
+    against OUT_OF_SYLLABUS_PROBES (negatives) and pick the thresholds that
+    best separate them.
+    """
+    titles = [re.sub(r"^[\d.\s]+", "", item["title"]).strip() for item in utils.get_metadata()]
+    positive_queries = [f"explain {t.lower()}" for t in titles if len(t) > 3]
+    pos = [score_query(q) for q in positive_queries]
+    neg = [score_query(q) for q in OUT_OF_SYLLABUS_PROBES]
+    result = {}
+    for key in ("syllabus_score", "retrieval_score"):
+        threshold, accuracy = _best_threshold([p[key] for p in pos], [n[key] for n in neg])
+        result[key] = {"threshold": round(threshold, 3), "balanced_accuracy": round(accuracy, 3)}
+    return result
+
+
+if __name__ == "__main__":
+    if "--calibrate" in sys.argv:
+        calibration = calibrate_thresholds()
+        print(calibration)
+        print(f"export AIRA_ROUTER_SYLLABUS_THRESHOLD={calibration['syllabus_score']['threshold']}")
+        print(f"export AIRA_ROUTER_RETRIEVAL_THRESHOLD={calibration['retrieval_score']['threshold']}")
+    else:
+        for text in sys.argv[1:] or ["thank you!", "explain photosynthesis", "who won the world cup"]:
+            print(text, "->", route_query(text))
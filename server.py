@@ -1,9 +1,26 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import Body, UploadFile, File, HTTPException
+from fastapi import Body, UploadFile, File, HTTPException, Header
+from fastapi.responses import JSONResponse, StreamingResponse
+from admission import AdmissionRejected, kind_for
+from cancellation import RunCancelled
+import admission
 from pydantic import BaseModel
 from typing import Optional
+from contextlib import asynccontextmanager
 from agent import ask_agent #
+from router import route_query
+from lesson_store import lookup_lesson, is_lesson_title, get_lesson_index
+import agent
+import corpus
+import llm_gateway
+import media_manifest
+import prefetch
+import request_log
+import tts
+import threading
+import time
+import hmac
 import uuid
 import os
 from fastapi.staticfiles import StaticFiles
@@ -33,10 +50,44 @@ except Exception:
     sr = None  # type: ignore
     AudioSegment = None  # type: ignore
 
+# Background warmup: models and indexes load after the port is bound so that
+# liveness checks pass immediately and /readyz flips once the worker is warm.
+WARMUP_ON_STARTUP = os.environ.get("AIRA_WARMUP", "1") == "1"
+# Hot reload of knowledge base / indexes: poll shard files every N seconds (0 = off),
+# and allow POST /admin/reload when AIRA_ADMIN_TOKEN is set.
+RELOAD_WATCH_SECONDS = float(os.environ.get("AIRA_RELOAD_WATCH_SECONDS", "0"))
+ADMIN_TOKEN = os.environ.get("AIRA_ADMIN_TOKEN")
+warmup_state = {"status": "pending", "error": None, "seconds": None}
+
+
+def _run_warmup():
+    warmup_state["status"] = "warming"
+    started = time.perf_counter()
+    try:
+        agent.warmup()
+        warmup_state["status"] = "ready"
+    except Exception as exc:  # noqa: BLE001 - reported through /readyz
+        warmup_state["status"] = "failed"
+        warmup_state["error"] = str(exc)
+        print(f"[ERROR] Warmup failed: {exc}")
+    warmup_state["seconds"] = round(time.perf_counter() - started, 2)
+    print(f"[DEBUG] Warmup finished status={warmup_state['status']} in {warmup_state['seconds']}s")
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=_run_warmup, name="aira-warmup", daemon=True).start()
+    if RELOAD_WATCH_SECONDS > 0:
+        corpus.registry.start_watcher(RELOAD_WATCH_SECONDS)
+    yield
+
+
 app = FastAPI(
     title="AI Science Teacher",
     version="1.0",
-    description="A FastAPI server for the AI Science Teacher LangChain agent."
+    description="A FastAPI server for the AI Science Teacher LangChain agent.",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -45,10 +96,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Link", "Retry-After", "X-TTS-Sentences", "X-TTS-Cached"],
 )
 
-# Serve images statically from the project's images folder
+# Serve each shard's figures under /images/<shard id>/: every textbook has its own
+# Figure_1.1.png, so one shared mount would serve the first book's file for all of them.
+# Mounted before /images, which keeps serving the project's images folder by basename.
 IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+for corpus_shard in corpus.registry.shards():
+    if os.path.isdir(corpus_shard.images_dir):
+        print(f"[DEBUG] Serving images of shard {corpus_shard.id} under /images/{corpus_shard.id} -> {corpus_shard.images_dir}")
+        app.mount(f"/images/{corpus_shard.id}", StaticFiles(directory=corpus_shard.images_dir), name=f"images-{corpus_shard.id}")
 if os.path.isdir(IMAGES_DIR):
     print(f"[DEBUG] Static images directory mounted at /images -> {IMAGES_DIR}")
     app.mount("/images", StaticFiles(directory=IMAGES_DIR), name="images")
@@ -59,10 +117,153 @@ else:
 def home():
     return {"message": "AI Science Teacher Backend is running!"}
 
+
+# The probes are async so they run on the event loop, not on the threadpool where
+# sync /chat handlers can block (thread lock, admission, single-flight waits) during
+# a burst. They only read in-memory state and must stay free of blocking calls.
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: embedding models and FAISS indexes are loaded. Returns 503 until then."""
+    ready = agent.is_ready()
+    body = {
+        "status": "ready" if ready else warmup_state["status"],
+        "warmup_seconds": warmup_state["seconds"],
+    }
+    if warmup_state["error"]:
+        body["error"] = warmup_state["error"]
+    if admission.ADMISSION_ENABLED:
+        body["admission"] = admission.controller.stats()
+    if prefetch.PREFETCH_ENABLED:
+        body["prefetch"] = prefetch.prefetcher.describe()
+    if llm_gateway.GATEWAY_ENABLED:
+        body["llm"] = llm_gateway.describe()
+    if request_log.REQUEST_LOG_ENABLED:
+        body["request_log"] = request_log.describe()
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+@app.get("/shards")
+def list_shards():
+    """Textbooks served by this deployment (see corpus.py)."""
+    return {"default": corpus.registry.default_id, "shards": corpus.registry.describe()}
+
+
+@app.get("/shards/{shard_id}/lessons")
+def shard_lessons(shard_id: str):
+    """Selectable lessons of one textbook, in index order."""
+    try:
+        shard = corpus.registry.get(shard_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    return {"shard": shard.id, "lessons": get_lesson_index(shard)}
+
+
+def _check_admin_token(token: Optional[str]) -> None:
+    if not ADMIN_TOKEN or not hmac.compare_digest(token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin endpoints require AIRA_ADMIN_TOKEN and a matching X-Admin-Token header")
+
+
+@app.post("/admin/reload")
+def admin_reload(
+    shard: Optional[str] = None,
+    force: bool = False,
+    x_admin_token: Optional[str] = Header(default=None),
+):
+    """
+    Rebuild the knowledge-base and index snapshots (one shard, or all) in the background
+    and swap them in without dropping in-flight requests. Poll GET /admin/reload for the result.
+    """
+    _check_admin_token(x_admin_token)
+    try:
+        started = corpus.registry.reload_async([shard] if shard else None, force=force)
+    except ValueError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    return JSONResponse(
+        status_code=202 if started else 409,
+        content={"started": started, **corpus.registry.reload_state},
+    )
+
+
+@app.get("/admin/reload")
+def admin_reload_status(x_admin_token: Optional[str] = Header(default=None)):
+    _check_admin_token(x_admin_token)
+    return {**corpus.registry.reload_state, "shards": corpus.registry.describe()}
+
+
 class ChatRequest(BaseModel):
     query: str
     thread_id: Optional[str] = None
     interruption_context: Optional[str] = ""
+    # Optional textbook selection; otherwise the session's textbook or the best shard match.
+    shard: Optional[str] = None
+    grade: Optional[str] = None
+
+
+def answer_chat(effective_query: str, effective_thread_id: str, effective_interruption: str) -> dict:
+    """Answer one /chat turn against the current corpus shard."""
+    if effective_interruption:
+        full_query = (
+            f"Before we paused, we were discussing: '{effective_interruption}'. "
+            f"A student asked: '{effective_query}'. "
+            f"Please answer the question clearly and then smoothly continue the lesson from there."
+        )
+    else:
+        full_query = effective_query
+
+    # Lesson-index picks are served from the pre-generated lesson store when available.
+    if not effective_interruption:
+        with request_log.stage("lesson_store"):
+            stored_lesson = lookup_lesson(effective_query)
+        if stored_lesson:
+            print(f"[DEBUG] Serving pre-generated lesson for: {effective_query}")
+            request_log.annotate(route="lesson_store")
+            with request_log.stage("deliver"):
+                agent.deliver_lesson(effective_query, stored_lesson, thread_id=effective_thread_id)
+            prefetch.schedule(effective_query)
+            return {"response": stored_lesson}
+        # Not pre-generated yet: identical concurrent picks share one generation.
+        if is_lesson_title(effective_query):
+            request_log.annotate(route="lesson")
+            with request_log.stage("agent"):
+                lesson = agent.ask_lesson(effective_query, thread_id=effective_thread_id)
+            # The student will most likely pick the next subchapter: warm its caches meanwhile.
+            prefetch.schedule(effective_query)
+            return {"response": lesson}
+
+    with request_log.stage("router"):
+        decision = route_query(effective_query, effective_interruption)
+    print(f"[DEBUG] Router decision: {decision}")
+    request_log.annotate(route=decision["route"], route_reason=decision["reason"],
+                         syllabus_score=decision["syllabus_score"], retrieval_score=decision["retrieval_score"])
+    with request_log.stage("agent"):
+        response = ask_agent(
+            full_query,
+            thread_id=effective_thread_id,
+            route=decision["route"],
+            kind=kind_for(decision["route"], bool(effective_interruption)),
+        ) #
+    return {"response": response}
+
+
+def with_media_manifest(result: dict, tool_outputs: list):
+    """Attach the answer's media manifest and advertise its figures as preload Link headers."""
+    try:
+        with request_log.stage("manifest"):
+            manifest = media_manifest.build_manifest(result.get("response", ""), tool_outputs)
+    except Exception as exc:  # noqa: BLE001 - the answer itself must still be delivered
+        print(f"[WARN] media manifest failed: {exc}")
+        return result
+    result = {**result, "manifest": manifest}
+    request_log.annotate(media=len(manifest["media"]))
+    links = media_manifest.preload_links(manifest)
+    if not links:
+        return result
+    return JSONResponse(content=result, headers={"Link": links})
 
 
 @app.post("/chat")
@@ -72,12 +273,22 @@ def chat(
     query: Optional[str] = None,
     thread_id: Optional[str] = None,
     interruption_context: Optional[str] = "",
+    shard: Optional[str] = None,
+    grade: Optional[str] = None,
 ):
     """
     Handles user queries and routes them to the AI Teacher Agent.
     Accepts either a JSON body or query parameters for backward compatibility.
     Always returns a 200 with a friendly message so the frontend doesn't show a generic error.
+    Each call is recorded in the request log (see request_log.py) for replay.py.
     """
+    with request_log.request("/chat"):
+        result = _chat(body, query, thread_id, interruption_context, shard, grade)
+        request_log.annotate(**request_log.response_size(result))
+        return result
+
+
+def _chat(body, query, thread_id, interruption_context, shard, grade):
     try:
         # Merge inputs with body taking precedence
         effective_query = (body.query if body and body.query is not None else query) or ""
@@ -86,22 +297,54 @@ def chat(
             body.interruption_context if body and body.interruption_context is not None else interruption_context or ""
         )
 
+        request_log.annotate(
+            query=effective_query,
+            thread_id=effective_thread_id,
+            interruption_context=effective_interruption,
+            requested_shard=(body.shard if body and body.shard else shard),
+            grade=(body.grade if body and body.grade else grade),
+        )
         if not effective_query.strip():
+            request_log.annotate(outcome="empty")
             return {"response": "Please provide a question to ask the AI Teacher."}
 
-        if effective_interruption:
-            full_query = (
-                f"Before we paused, we were discussing: '{effective_interruption}'. "
-                f"A student asked: '{effective_query}'. "
-                f"Please answer the question clearly and then smoothly continue the lesson from there."
+        # Pick the textbook: explicit shard, else this session's, else grade filter + centroid match.
+        with request_log.stage("shard"):
+            selected_shard = corpus.registry.route(
+                effective_query,
+                thread_id=effective_thread_id,
+                shard_id=(body.shard if body and body.shard else shard),
+                grade=(body.grade if body and body.grade else grade),
             )
-        else:
-            full_query = effective_query
-
-        response = ask_agent(full_query, thread_id=effective_thread_id) #
-        return {"response": response}
+        request_log.annotate(shard=selected_shard.id)
+        with corpus.use_shard(selected_shard), media_manifest.collect_tool_outputs() as tool_outputs:
+            result = answer_chat(effective_query, effective_thread_id, effective_interruption)
+            request_log.annotate(outcome="ok", response_chars=len(result.get("response") or ""))
+            return with_media_manifest(result, tool_outputs)
+    except RunCancelled:
+        # A newer request on the same thread (e.g. an interruption) replaced this one.
+        request_log.annotate(outcome="superseded")
+        return {"response": "", "superseded": True}
+    except AdmissionRejected as rejected:
+        # Explicit, early back-pressure instead of a late provider rate-limit error.
+        request_log.annotate(outcome="queued", queue_position=rejected.queue_position)
+        return JSONResponse(
+            status_code=200,
+            headers={"Retry-After": str(rejected.retry_after)},
+            content={
+                "response": (
+                    "Lots of students are learning with me right now! "
+                    f"You're number {rejected.queue_position} in line. "
+                    f"Please try again in about {rejected.retry_after} seconds."
+                ),
+                "queued": True,
+                "queue_position": rejected.queue_position,
+                "retry_after": rejected.retry_after,
+            },
+        )
     except Exception as exc:  # noqa: BLE001 - surface a friendly message to UI
         # Keep status 200 so the UI shows the message instead of a generic fallback
+        request_log.annotate(outcome="error", error=str(exc)[:500])
         return {"response": f"Sorry, something went wrong handling your request: {exc}"}
 
 
@@ -110,13 +353,27 @@ async def transcribe_audio(file: UploadFile = File(...)):
     """
     Transcribe uploaded audio using OpenAI Whisper (if OPENAI_API_KEY is set).
     Accepts multipart/form-data with field name 'file'. Returns JSON: { text: str }.
+    Each call is recorded in the request log (see request_log.py); the audio itself is not kept.
     """
+    with request_log.request("/transcribe"):
+        result = await _transcribe(file)
+        request_log.annotate(
+            outcome="error" if result.get("error") else "ok",
+            text_chars=len(result.get("text") or ""),
+            **request_log.response_size(result),
+        )
+        return result
+
+
+async def _transcribe(file: UploadFile):
     try:
         suffix = os.path.splitext(file.filename or "audio.webm")[1] or ".webm"
         with NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            contents = await file.read()
+            with request_log.stage("upload"):
+                contents = await file.read()
             tmp.write(contents)
             tmp_path = tmp.name
+        request_log.annotate(audio_bytes=len(contents), audio_suffix=suffix)
 
         try:
             # Prefer local faster-whisper if enabled
@@ -127,6 +384,7 @@ async def transcribe_audio(file: UploadFile = File(...)):
                 device = os.environ.get("LOCAL_WHISPER_DEVICE", "cpu")
                 compute_type = os.environ.get("LOCAL_WHISPER_COMPUTE", "int8")
                 print(f"[TRANSCRIBE] Using local faster-whisper model={model_name} device={device} compute={compute_type}")
+                request_log.annotate(engine="faster_whisper")
                 model = WhisperModel(model_name, device=device, compute_type=compute_type)
                 segments, info = model.transcribe(
                     tmp_path,
@@ -144,6 +402,7 @@ async def transcribe_audio(file: UploadFile = File(...)):
             # Otherwise try OpenAI Whisper API if key present
             api_key = os.environ.get("OPENAI_API_KEY")
             if api_key and OpenAI is not None:
+                request_log.annotate(engine="openai")
                 client = OpenAI(api_key=api_key)
                 model_name = os.environ.get("OPENAI_TRANSCRIBE_MODEL", "whisper-1")
                 with open(tmp_path, "rb") as audio_f:
@@ -209,6 +468,7 @@ async def transcribe_audio(file: UploadFile = File(...)):
             except Exception:
                 pass
 
+            request_log.annotate(engine="google")
             rec = sr.Recognizer()
             lang = os.environ.get("GOOGLE_SPEECH_LANG", "en-US")
             with sr.AudioFile(wav_tmp) as source:
@@ -263,4 +523,54 @@ async def transcribe_audio(file: UploadFile = File(...)):
     except HTTPException:
         raise
     except Exception as exc:
-        return {"text": "", "error": f"Transcription failed: {exc}"}
\ No newline at end of file
+        return {"text": "", "error": f"Transcription failed: {exc}"}
+
+class TtsRequest(BaseModel):
+    text: str
+    voice: Optional[str] = None
+    # "wav": one continuous WAV streamed sentence by sentence (playable by <audio>)
+    # "ndjson": one JSON line per sentence with its text and base64 WAV
+    format: Optional[str] = "wav"
+    rate: Optional[float] = 1.0
+
+
+def _tts_response(text: str, voice: Optional[str], fmt: Optional[str], rate: Optional[float]):
+    if not tts.is_available():
+        raise HTTPException(status_code=503, detail="No offline TTS engine is installed on the server (piper-tts or espeak-ng)")
+    if not text or not text.strip():
+        raise HTTPException(status_code=400, detail="text is required")
+    if len(text) > tts.TTS_MAX_CHARS:
+        raise HTTPException(status_code=413, detail=f"text exceeds {tts.TTS_MAX_CHARS} characters")
+    fmt = fmt or "wav"
+    if fmt not in ("wav", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'wav' or 'ndjson'")
+    rate = min(2.0, max(0.5, rate or 1.0))
+    try:
+        voice = tts.resolve_voice(voice)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    sentences = tts.split_sentences(text)
+    if not sentences:
+        raise HTTPException(status_code=400, detail="text has nothing to speak")
+    cached = sum(tts.is_cached(sentence, voice, rate) for sentence in sentences)
+    print(f"[DEBUG] /tts: sentences={len(sentences)} cached={cached} voice={voice} format={fmt}")
+    headers = {
+        "X-TTS-Sentences": str(len(sentences)),
+        "X-TTS-Cached": str(cached),
+        "Cache-Control": "no-store",
+    }
+    if fmt == "ndjson":
+        return StreamingResponse(tts.stream_ndjson(sentences, voice, rate), media_type="application/x-ndjson", headers=headers)
+    return StreamingResponse(tts.stream_wav(sentences, voice, rate), media_type="audio/wav", headers=headers)
+
+
+@app.post("/tts")
+def synthesize_speech(req: TtsRequest = Body(...)):
+    return _tts_response(req.text, req.voice, req.format, req.rate)
+
+
+@app.get("/tts")
+def synthesize_speech_get(text: str, voice: Optional[str] = None, format: Optional[str] = "wav", rate: Optional[float] = 1.0):
+    """GET variant so the frontend can point an <audio src> straight at a lesson."""
+    return _tts_response(text, voice, format, rate)
@@ -1,7 +1,39 @@
 import { Message } from '../types';
 
+export interface ManifestMedia {
+  type: 'image' | 'video';
+  url: string;
+  order: number;
+  name?: string;
+  title?: string;
+  description?: string;
+  bytes?: number;
+  width?: number;
+  height?: number;
+  video_id?: string;
+  embed_url?: string;
+  duration?: number;
+}
+
+export interface MediaManifest {
+  segments: Array<{ type: 'text'; text: string } | { type: 'image' | 'video'; media: number }>;
+  media: ManifestMedia[];
+}
+
 interface ApiResponse {
   response: string;
+  manifest?: MediaManifest;
+  superseded?: boolean;
+  queued?: boolean;
+  retry_after?: number;
+}
+
+// 'superseded': a newer request on this session replaced the turn; there is nothing to show.
+// 'queued': the server is at capacity; text asks the student to try again, it is not a lesson.
+export interface TeacherReply {
+  text: string;
+  status: 'ok' | 'queued' | 'superseded';
+  manifest?: MediaManifest;
 }
 
 // Generate a persistent session ID for conversation memory
@@ -11,11 +43,23 @@ const sessionId = `classroom_session_${Date.now()}`;
 const DEFAULT_BACKEND_URL = 'http://localhost:8000';
 export const backendBaseUrl = (import.meta as any).env?.VITE_BACKEND_URL || DEFAULT_BACKEND_URL;
 
+// Start downloading every lesson figure in parallel while the first segment is narrated,
+// so the media sequencer finds them in the browser cache.
+const preloadManifestMedia = (manifest: MediaManifest) => {
+  manifest.media
+    .filter((item) => item.type === 'image')
+    .forEach((item) => {
+      const img = new Image();
+      img.decoding = 'async';
+      img.src = `${backendBaseUrl}${item.url}`;
+    });
+};
+
 export const getAiTeacherResponse = async (
   query: string,
   messages: Message[],
   interruptionContext?: string
-): Promise<string> => {
+): Promise<TeacherReply> => {
   try {
     const url = `${backendBaseUrl}/chat`;
 
@@ -45,17 +89,30 @@ export const getAiTeacherResponse = async (
       console.error('[apiService] JSON parse error:', e);
     }
 
+    if (response.ok && data && data.superseded) {
+      console.log('[apiService] Turn superseded by a newer request, dropping it');
+      return { text: '', status: 'superseded' };
+    }
+
+    if (response.ok && data && data.queued && typeof data.response === 'string') {
+      console.log('[apiService] Server busy, retry after', data.retry_after, 's');
+      return { text: data.response, status: 'queued' };
+    }
+
     if (response.ok && data && typeof data.response === 'string') {
+      if (data.manifest) {
+        preloadManifestMedia(data.manifest);
+      }
       console.log('[apiService] Success, response length:', data.response.length);
       console.log('[apiService] First 500 chars:', data.response.substring(0, 500));
-      return data.response;
+      return { text: data.response, status: 'ok', manifest: data.manifest };
     }
 
     const serverMsg = data && typeof (data as any).response === 'string' ? (data as any).response : text;
     throw new Error(`Backend error ${response.status}: ${serverMsg || 'No details'}`);
   } catch (error) {
     console.error("Error calling AI Teacher backend:", error);
-    return "Oh dear, it seems my circuits are a bit scrambled. Could you try asking again?";
+    return { text: "Oh dear, it seems my circuits are a bit scrambled. Could you try asking again?", status: 'ok' };
   }
 };
 
@@ -0,0 +1,147 @@
+"""
+Single-flight request coalescing.
+
+When many students open the same lesson at once, identical tool calls and
+lesson generations arrive concurrently. `SingleFlight.do(key, fn)` runs `fn`
+once per key at a time: the first caller (the leader) executes it and every
+concurrent caller with the same key waits for, and receives, the leader's
+result, or the leader's exception.
+
+Waiters give up after `timeout` seconds with SingleFlightTimeout. Calls that
+have been running longer than `max_age` are no longer joined, so one stuck
+leader cannot capture all later traffic for its key.
+
+`TTLCache` keeps finished results for a while, so a call that was already made
+(or prefetched) is not repeated at all.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_WAIT_TIMEOUT = float(os.environ.get("AIRA_SINGLEFLIGHT_TIMEOUT", "120"))
+DEFAULT_MAX_AGE = float(os.environ.get("AIRA_SINGLEFLIGHT_MAX_AGE", "300"))
+
+
+class SingleFlightTimeout(TimeoutError):
+    pass
+
+
+def normalize_topic(text: str) -> str:
+    """Case-, punctuation- and whitespace-insensitive key for a topic or query."""
+    text = re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "started", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.started = time.monotonic()
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str, max_age: float = DEFAULT_MAX_AGE):
+        self.name = name
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key, fn, timeout: float = DEFAULT_WAIT_TIMEOUT):
+        """Run fn() once for all concurrent callers sharing `key` and return its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and time.monotonic() - call.started > self.max_age:
+                # Leave the stale call to finish on its own; start a fresh one.
+                call = None
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:  # noqa: BLE001 - propagated to every waiter
+                call.error = e
+            finally:
+                with self._lock:
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                call.done.set()
+            if call.waiters:
+                print(f"[DEBUG] singleflight[{self.name}]: {key!r} shared with {call.waiters} waiter(s)")
+        elif not call.done.wait(timeout):
+            raise SingleFlightTimeout(f"timed out after {timeout}s waiting for in-flight {self.name} {key!r}")
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class TTLCache:
+    """Thread-safe LRU of recent results; entries expire after `ttl` seconds."""
+
+    def __init__(self, name: str, ttl: float, max_entries: int):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value) -> None:
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_call(self, key, fn):
+        """Cached value for key, else fn() (cached on success)."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = fn()
+            self.put(key, value)
+        return value
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            values = [value for _, value in self._entries.values()]
+        return sum(len(v) if isinstance(v, (str, bytes)) else sys.getsizeof(v) for v in values)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,53 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# The backend modules live at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Background(threading.Thread):
+    """Runs fn(*args) in a daemon thread, keeping its return value or exception."""
+
+    def __init__(self, fn, *args):
+        super().__init__(daemon=True)
+        self.fn = fn
+        self.args = args
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.fn(*self.args)
+        except BaseException as e:  # noqa: BLE001 - inspected by the test
+            self.error = e
+
+
+@pytest.fixture
+def wait_until():
+    """Poll predicate() until it holds; fails the test after `timeout` seconds."""
+    def wait(predicate, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            assert time.monotonic() < deadline, "condition not reached"
+            time.sleep(0.005)
+    return wait
+
+
+@pytest.fixture
+def spawn():
+    """Start fn(*args) in a Background thread; all of them are joined at teardown."""
+    threads = []
+
+    def start(fn, *args):
+        thread = Background(fn, *args)
+        threads.append(thread)
+        thread.start()
+        return thread
+
+    yield start
+    for thread in threads:
+        thread.join(5)
@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from admission import (KIND_LESSON, KIND_SHORT, KIND_TURN, AdmissionController, AdmissionRejected,
+                       kind_for)
+from cancellation import RunCancelled
+
+
+def _controller(**overrides):
+    settings = {"rpm": 6000, "tpm": 10_000_000, "max_concurrent": 1, "max_wait": 60, "max_queue": 100}
+    settings.update(overrides)
+    return AdmissionController(**settings)
+
+
+def _queue_in_order(controller, spawn, wait_until, requests, admitted):
+    """Queue (thread_id, kind) requests one after another; each records itself when admitted."""
+    def run(thread_id, kind):
+        ticket = controller.acquire(thread_id, kind)
+        admitted.append((thread_id, kind))
+        controller.release(ticket)
+
+    threads = []
+    for thread_id, kind in requests:
+        waiting = controller.stats()["waiting"]
+        threads.append(spawn(run, thread_id, kind))
+        wait_until(lambda: controller.stats()["waiting"] == waiting + 1)
+    return threads
+
+
+def test_short_answers_overtake_queued_lessons(spawn, wait_until):
+    controller = _controller()
+    running = controller.acquire("busy", KIND_LESSON)
+    admitted = []
+    threads = _queue_in_order(controller, spawn, wait_until,
+                              [("a", KIND_LESSON), ("b", KIND_TURN), ("c", KIND_SHORT)], admitted)
+    controller.release(running)
+    for thread in threads:
+        thread.join(5)
+
+    assert admitted == [("c", KIND_SHORT), ("b", KIND_TURN), ("a", KIND_LESSON)]
+    assert controller.stats()["running"] == 0
+
+
+def test_threads_of_one_priority_are_served_round_robin(spawn, wait_until):
+    controller = _controller()
+    running = controller.acquire("busy", KIND_TURN)
+    admitted = []
+    threads = _queue_in_order(controller, spawn, wait_until,
+                              [(thread_id, KIND_TURN) for thread_id in ["chatty", "chatty", "chatty", "quiet"]],
+                              admitted)
+    controller.release(running)
+    for thread in threads:
+        thread.join(5)
+
+    assert [thread_id for thread_id, _ in admitted].index("quiet") == 1
+
+
+def test_rejects_with_queue_position_and_retry_after_when_the_wait_is_too_long():
+    controller = _controller(max_wait=1)
+    running = controller.acquire("busy", KIND_LESSON)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("late", KIND_TURN)
+    # One run ahead at the default 10 s average run time.
+    assert rejected.value.queue_position == 1
+    assert rejected.value.retry_after == 10
+    assert rejected.value.reason == "busy"
+    assert controller.stats()["waiting"] == 0
+    controller.release(running)
+
+
+def test_rejects_when_the_queue_is_full(spawn, wait_until):
+    controller = _controller(max_queue=1)
+    running = controller.acquire("busy", KIND_LESSON)
+    admitted = []
+    (waiter,) = _queue_in_order(controller, spawn, wait_until, [("queued", KIND_TURN)], admitted)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("late", KIND_SHORT)
+    assert rejected.value.reason == "queue full"
+    assert rejected.value.queue_position == 2
+    controller.release(running)
+    waiter.join(5)
+    assert admitted == [("queued", KIND_TURN)]
+
+
+def test_rate_budget_delays_admission_beyond_max_concurrent():
+    # 60 requests/minute refills one request per second; a lesson needs 4.
+    controller = _controller(rpm=60, max_concurrent=8, max_wait=2)
+    for _ in range(15):
+        controller.release(controller.acquire("early", KIND_LESSON))
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("late", KIND_LESSON)
+    assert rejected.value.retry_after >= 3
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    controller = _controller()
+    running = controller.acquire("busy", KIND_LESSON)
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(RunCancelled):
+        controller.acquire("interrupted", KIND_TURN, cancel_event)
+    assert controller.stats()["waiting"] == 0
+    controller.release(running)
+
+
+def test_kind_for():
+    assert kind_for("casual") == KIND_SHORT
+    assert kind_for("in_syllabus") == KIND_TURN
+    assert kind_for("casual", interruption=True) == "interruption"
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cancellation import RunCancelled, ThreadRunRegistry, raise_if_cancelled, run_cancellable
+
+
+def _start_lesson(spawn, runs, thread_id, events):
+    """A run on thread_id whose agent call would take 30 s unless cancelled."""
+    started = threading.Event()
+
+    async def slow_agent_call():
+        started.set()
+        try:
+            await asyncio.sleep(30)
+        finally:
+            events.append("lesson unwound")
+
+    def run():
+        try:
+            with runs.exclusive(thread_id) as handle:
+                run_cancellable(slow_agent_call, handle)
+        except RunCancelled:
+            events.append("lesson cancelled")
+
+    thread = spawn(run)
+    assert started.wait(5)
+    return thread
+
+
+def test_exclusive_cancels_the_earlier_run_on_the_same_thread(spawn):
+    runs = ThreadRunRegistry()
+    events = []
+    lesson = _start_lesson(spawn, runs, "student-1", events)
+
+    started = time.monotonic()
+    with runs.exclusive("student-1") as handle:
+        events.append("interruption running")
+        assert not handle.cancelled
+    lesson.join(5)
+
+    assert time.monotonic() - started < 5
+    # The earlier run has fully unwound before the interruption holds the thread.
+    assert events == ["lesson unwound", "lesson cancelled", "interruption running"]
+
+
+def test_runs_on_other_threads_are_not_cancelled(spawn):
+    runs = ThreadRunRegistry()
+    events = []
+    lesson = _start_lesson(spawn, runs, "student-1", events)
+    with runs.exclusive("student-2"):
+        events.append("other student running")
+    assert events == ["other student running"]
+
+    with runs.exclusive("student-1"):
+        pass
+    lesson.join(5)
+    assert events[1:] == ["lesson unwound", "lesson cancelled"]
+
+
+def test_run_queued_behind_the_thread_is_cancelled_before_it_starts(spawn, wait_until):
+    runs = ThreadRunRegistry()
+    release = threading.Event()
+
+    def holder():
+        with runs.exclusive("student-1"):
+            release.wait(5)
+
+    def queued():
+        with runs.exclusive("student-1"):
+            return "queued ran"
+
+    first = spawn(holder)
+    wait_until(lambda: "student-1" in runs._slots and runs._slots["student-1"].lock.locked())
+    second = spawn(queued)
+    wait_until(lambda: runs._slots["student-1"].users == 2)
+    with runs.claim("student-1"):
+        release.set()
+        first.join(5)
+        second.join(5)
+    assert isinstance(second.error, RunCancelled) and second.result is None
+    assert runs._slots == {}
+
+
+def test_sync_tools_see_the_cancel_event():
+    runs = ThreadRunRegistry()
+
+    with runs.claim("student-1") as handle:
+        def tool(cancel):
+            if cancel:
+                handle.cancel_event.set()  # superseded while the tool runs
+            raise_if_cancelled()
+            return "figure"
+
+        async def agent_call(cancel):
+            return await asyncio.to_thread(tool, cancel)
+
+        assert run_cancellable(lambda: agent_call(False), handle) == "figure"
+        with pytest.raises(RunCancelled):
+            run_cancellable(lambda: agent_call(True), handle)
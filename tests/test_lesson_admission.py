@@ -0,0 +1,63 @@
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+import agent
+from admission import AdmissionRejected
+
+
+@pytest.fixture
+def lessons(monkeypatch):
+    """ask_lesson with a stand-in agent; records admissions, generations and recorded turns."""
+    state = {"admitted": [], "generated": 0, "recorded": [], "reject": set(), "shared_gate": None}
+
+    @contextmanager
+    def fake_admit(thread_id, kind, cancel_event=None):
+        if thread_id.startswith("lesson:") and state["shared_gate"] is not None:
+            state["shared_gate"].wait(5)
+        if thread_id in state["reject"] or (thread_id.startswith("lesson:") and "lesson:*" in state["reject"]):
+            raise AdmissionRejected(12, 3)
+        state["admitted"].append(thread_id)
+        yield None
+
+    def fake_generate(title):
+        state["generated"] += 1
+        return f"lesson on {title}"
+
+    monkeypatch.setattr(agent, "agent", object())
+    monkeypatch.setattr(agent, "admit", fake_admit)
+    monkeypatch.setattr(agent, "generate_lesson", fake_generate)
+    monkeypatch.setattr(agent, "record_turn", lambda title, lesson, thread_id: state["recorded"].append(thread_id))
+    return state
+
+
+def test_shared_generation_is_not_billed_to_the_first_student(lessons):
+    assert agent.ask_lesson("Acids", thread_id="student-1") == "lesson on Acids"
+    assert lessons["admitted"] == ["lesson:default:acids"]
+    assert lessons["recorded"] == ["student-1"]
+
+
+def test_shared_rejection_falls_back_to_the_callers_own_admission(lessons):
+    lessons["reject"] = {"lesson:*"}
+    assert agent.ask_lesson("Acids", thread_id="student-1") == "lesson on Acids"
+    assert lessons["admitted"] == ["student-1"]
+
+
+def test_waiters_never_receive_another_callers_rejection(lessons, spawn, wait_until):
+    lessons["reject"] = {"lesson:*", "student-1"}
+    lessons["shared_gate"] = gate = threading.Event()
+    first = spawn(agent.ask_lesson, "Acids", "student-1")
+    wait_until(lambda: agent.lesson_flight.in_flight() == 1)
+    second = spawn(agent.ask_lesson, "Acids", "student-2")
+    wait_until(lambda: agent.lesson_flight._calls[("default", "acids")].waiters == 1)
+    gate.set()
+    first.join(5)
+    second.join(5)
+
+    # student-1's own admission is rejected; student-2, who only waited on the shared
+    # generation, is admitted on its own thread and gets the lesson.
+    assert isinstance(first.error, AdmissionRejected)
+    assert second.error is None and second.result == "lesson on Acids"
+    assert lessons["recorded"] == ["student-2"]
+    assert lessons["generated"] == 1
@@ -0,0 +1,142 @@
+import asyncio
+import socket
+import threading
+
+import httpx
+import pytest
+import uvicorn
+
+import llm_gateway
+import llm_standin
+from llm_gateway import AsyncGatewayTransport, Endpoint, Gateway, GatewayTransport
+
+BODY = {"model": "standin", "messages": [{"role": "user", "content": "Explain photosynthesis."}]}
+
+
+@pytest.fixture
+def standin():
+    """Start llm_standin apps on ephemeral ports; returns a factory giving each one's /v1 base URL."""
+    servers = []
+
+    def start(**options):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        server = uvicorn.Server(uvicorn.Config(llm_standin.create_app(**options), log_level="warning"))
+        thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+        thread.start()
+        servers.append((server, thread))
+        while not server.started:
+            assert thread.is_alive(), "stand-in failed to start"
+            threading.Event().wait(0.01)
+        return f"http://127.0.0.1:{sock.getsockname()[1]}/v1"
+
+    yield start
+    for server, thread in servers:
+        server.should_exit = True
+        thread.join(5)
+
+
+@pytest.fixture(autouse=True)
+def fast_policy(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(llm_gateway, "LLM_RETRIES", 2)
+    monkeypatch.setattr(llm_gateway, "HEDGE_INITIAL_DELAY", 0.1)
+
+
+def _served(base_url):
+    return httpx.get(base_url[:-len("/v1")] + "/stats").json()
+
+
+def _gateway(primary_url, secondary_url=None):
+    return Gateway(Endpoint("primary", primary_url),
+                   Endpoint("secondary", secondary_url) if secondary_url else None)
+
+
+async def _post_async(gateway, primary_url, count=1):
+    async with httpx.AsyncClient(transport=AsyncGatewayTransport(gateway, httpx.AsyncHTTPTransport())) as client:
+        return [await client.post(f"{primary_url}/chat/completions", json=BODY) for _ in range(count)]
+
+
+def test_5xx_is_retried_until_the_retry_budget_is_spent(standin):
+    primary = standin(latency=0.01, error_rate=1.0, error_status=503)
+    gateway = _gateway(primary)
+    with httpx.Client(transport=GatewayTransport(gateway, httpx.HTTPTransport())) as client:
+        response = client.post(f"{primary}/chat/completions", json=BODY)
+
+    assert response.status_code == 503
+    assert {k: gateway.stats[k] for k in ("requests", "attempts", "retries", "errors")} == {
+        "requests": 1, "attempts": 3, "retries": 2, "errors": 1}
+    assert _served(primary)["requests"] == 3
+
+
+def test_transient_error_recovers_on_retry(standin, monkeypatch):
+    primary = standin(latency=0.01, error_rate=1.0, error_status=503)
+    gateway = _gateway(primary)
+    outcomes = iter([0.0, 1.0])  # the first call fails, the retry succeeds
+    monkeypatch.setattr(llm_standin.random, "random", lambda: next(outcomes, 1.0))
+    with httpx.Client(transport=GatewayTransport(gateway, httpx.HTTPTransport())) as client:
+        response = client.post(f"{primary}/chat/completions", json=BODY)
+
+    assert response.status_code == 200
+    assert gateway.stats["retries"] == 1 and gateway.stats["errors"] == 0
+
+
+def test_retry_goes_to_the_secondary(standin, monkeypatch):
+    monkeypatch.setattr(llm_gateway, "HEDGE_ENABLED", False)
+    primary = standin(name="primary", latency=0.01, error_rate=1.0)
+    secondary = standin(name="secondary", latency=0.01)
+    gateway = _gateway(primary, secondary)
+    (response,) = asyncio.run(_post_async(gateway, primary))
+
+    assert response.status_code == 200
+    assert "(secondary stand-in)" in response.json()["choices"][0]["message"]["content"]
+    assert gateway.stats["retries"] == 1
+    assert _served(primary)["requests"] == 1 and _served(secondary)["requests"] == 1
+
+
+def test_failing_primary_fails_over_for_new_calls(standin, monkeypatch):
+    monkeypatch.setattr(llm_gateway, "HEDGE_ENABLED", False)
+    monkeypatch.setattr(llm_gateway, "FAILOVER_AFTER", 2)
+    primary = standin(name="primary", latency=0.01, error_rate=1.0)
+    secondary = standin(name="secondary", latency=0.01)
+    gateway = _gateway(primary, secondary)
+    responses = asyncio.run(_post_async(gateway, primary, count=4))
+
+    assert [r.status_code for r in responses] == [200] * 4
+    assert gateway.stats["failovers"] == 1
+    # Two failures trip the failover; later calls start on the secondary and never retry.
+    assert _served(primary)["requests"] == 2
+    assert gateway.stats["retries"] == 2
+
+
+def test_slow_primary_is_hedged_within_the_budget(standin, monkeypatch):
+    monkeypatch.setattr(llm_gateway, "HEDGE_BUDGET", 0.1)
+    primary = standin(name="primary", latency=0.01, slow_rate=1.0, slow_latency=0.6)
+    secondary = standin(name="secondary", latency=0.01)
+    gateway = _gateway(primary, secondary)
+    responses = asyncio.run(_post_async(gateway, primary, count=5))
+
+    assert [r.status_code for r in responses] == [200] * 5
+    # One hedge for the first call; 0.1 hedges per call allows no second one within 5 calls.
+    assert gateway.stats["hedges"] == 1 and gateway.stats["hedge_wins"] == 1
+    assert "(secondary stand-in)" in responses[0].json()["choices"][0]["message"]["content"]
+    # The cancelled primary attempt counts as a censored sample of about the hedge delay.
+    (samples,) = gateway._latencies.values()
+    assert len(samples) == 5
+    assert 0.1 <= min(samples) < 0.5
+
+
+def test_cancelled_call_records_no_latency(standin, monkeypatch):
+    monkeypatch.setattr(llm_gateway, "HEDGE_ENABLED", False)
+    primary = standin(latency=0.01, slow_rate=1.0, slow_latency=1.0)
+    gateway = _gateway(primary)
+
+    async def interrupted():
+        task = asyncio.ensure_future(_post_async(gateway, primary))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(interrupted())
+    assert gateway._latencies == {}
@@ -0,0 +1,100 @@
+import struct
+from types import SimpleNamespace
+
+import pytest
+
+import media_manifest
+from media_manifest import _image_dimensions, build_manifest, preload_links
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+
+def _png(width, height):
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", len(ihdr)) + b"IHDR" + ihdr + b"\0\0\0\0"
+
+
+def _segment(marker, payload):
+    return b"\xff" + bytes([marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def _jpeg(width, height):
+    return (b"\xff\xd8"
+            + _segment(0xE0, b"JFIF\0\x01\x01\0\0\x01\0\x01\0\0")  # APP0
+            + _segment(0xC4, b"\0" * 17)  # DHT shares the SOF marker range but carries no size
+            + _segment(0xC0, struct.pack(">BHHB", 8, height, width, 3) + b"\0" * 9)  # SOF0
+            + b"\xff\xd9")
+
+
+@pytest.mark.parametrize("name, data, expected", [
+    ("figure.png", _png(640, 480), {"width": 640, "height": 480}),
+    ("figure.jpg", _jpeg(800, 600), {"width": 800, "height": 600}),
+    ("notes.png", b"not an image at all", {}),
+    ("truncated.jpg", b"\xff\xd8" + _segment(0xE0, b"JFIF\0"), {}),
+])
+def test_image_dimensions_from_headers(tmp_path, name, data, expected):
+    path = tmp_path / name
+    path.write_bytes(data)
+    assert _image_dimensions(str(path)) == expected
+
+
+@pytest.fixture
+def shard(tmp_path, monkeypatch):
+    """A shard whose images/ holds Figure_1.2.png and whose figure data describes it."""
+    images = tmp_path / "images"
+    images.mkdir()
+    (images / "Figure_1.2.png").write_bytes(_png(320, 200))
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    (shared / "Figure_9.1.jpg").write_bytes(_jpeg(100, 50))
+    current = SimpleNamespace(id="science-10", images_dir=str(images))
+    monkeypatch.setattr(media_manifest, "current_shard", lambda: current)
+    monkeypatch.setattr(media_manifest, "get_image_dirs", lambda: [str(images), str(shared)])
+    monkeypatch.setattr(media_manifest.agent_tools, "get_figures_data",
+                        lambda: [{"figure": "Figure 1.2", "description": "Magnesium burning in air"}])
+    monkeypatch.setattr(media_manifest.agent_tools, "get_video_catalog",
+                        lambda: ([{"id": VIDEO_ID, "title": "Combustion", "duration": 185}], None))
+    return current
+
+
+def test_manifest_keeps_answer_order_and_resolves_media(shard):
+    text = (f"Magnesium burns brightly (see: images/Figure_1.2.png).\n"
+            f"Watch it here (YouTube: https://youtu.be/{VIDEO_ID}) and compare (see: Figure_9.1.jpg). "
+            f"Again (see: /etc/Figure_1.2.png) but not (see: missing.png). Done.")
+    manifest = build_manifest(text)
+
+    assert manifest["segments"] == [
+        {"type": "text", "text": "Magnesium burns brightly"},
+        {"type": "image", "media": 0},
+        {"type": "text", "text": ".\nWatch it here"},
+        {"type": "video", "media": 1},
+        {"type": "text", "text": "and compare"},
+        {"type": "image", "media": 2},
+        {"type": "text", "text": ". Again"},
+        {"type": "image", "media": 0},
+        {"type": "text", "text": "but not"},
+        {"type": "text", "text": ". Done."},
+    ]
+    figure, video, shared = manifest["media"]
+    assert figure == {"type": "image", "url": "/images/science-10/Figure_1.2.png", "name": "Figure 1.2",
+                      "description": "Magnesium burning in air", "bytes": len(_png(320, 200)),
+                      "content_type": "image/png", "width": 320, "height": 200, "order": 0}
+    assert video["embed_url"] == f"https://www.youtube.com/embed/{VIDEO_ID}"
+    assert (video["title"], video["duration"]) == ("Combustion", 185)
+    assert (shared["url"], shared["width"], shared["height"]) == ("/images/Figure_9.1.jpg", 100, 50)
+
+
+def test_tool_output_descriptions_win_over_figure_data(shard):
+    tool_output = "Figure 1.2 — Ribbon held in tongs (see: /srv/images/Figure_1.2.png)"
+    manifest = build_manifest("Look (see: Figure_1.2.png)", [tool_output])
+    assert manifest["media"][0]["description"] == "Ribbon held in tongs"
+
+
+def test_preload_links(shard, monkeypatch):
+    manifest = build_manifest(f"(see: Figure_1.2.png) (see: Figure_9.1.jpg) (YouTube: https://youtu.be/{VIDEO_ID})")
+    assert preload_links(manifest) == (
+        '</images/science-10/Figure_1.2.png>; rel=preload; as=image; type="image/png", '
+        '</images/Figure_9.1.jpg>; rel=preload; as=image; type="image/jpeg", '
+        "<https://www.youtube.com>; rel=preconnect")
+    monkeypatch.setattr(media_manifest, "MAX_PRELOAD_LINKS", 1)
+    assert preload_links(manifest).count("rel=preload") == 1
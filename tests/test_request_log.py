@@ -0,0 +1,105 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import request_log
+from request_log import BufferedWriter
+
+
+def _lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def _writer(path, **options):
+    settings = {"max_bytes": 1 << 20, "backups": 2, "flush_interval": 30.0, "batch_size": 1000, "max_pending": 100}
+    settings.update(options)
+    return BufferedWriter(str(path), **settings)
+
+
+def test_close_flushes_what_is_buffered(tmp_path):
+    writer = _writer(tmp_path / "requests.jsonl")
+    for n in range(3):
+        assert writer.submit({"n": n})
+    # Nothing is written until the 30 s flush window ends or the writer closes.
+    writer.close()
+    assert _lines(tmp_path / "requests.jsonl") == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert writer.stats["written"] == 3 and writer.stats["batches"] == 1
+
+
+def test_full_batch_is_written_without_waiting(tmp_path, wait_until):
+    writer = _writer(tmp_path / "requests.jsonl", batch_size=2)
+    writer.submit({"n": 0})
+    writer.submit({"n": 1})
+    wait_until(lambda: writer.stats["written"] == 2)
+    assert _lines(tmp_path / "requests.jsonl") == [{"n": 0}, {"n": 1}]
+    writer.close()
+
+
+def test_file_is_rotated_past_max_bytes(tmp_path, wait_until):
+    path = tmp_path / "requests.jsonl"
+    writer = _writer(path, max_bytes=40, backups=2, batch_size=1)
+    for n in range(4):
+        writer.submit({"n": n, "pad": "x" * 10})  # 27 bytes a line: every write after the first rotates
+        wait_until(lambda: writer.stats["written"] == n + 1)
+    writer.close()
+
+    assert writer.stats["rotations"] == 3
+    assert [_lines(p) for p in (path, f"{path}.1", f"{path}.2")] == [
+        [{"n": 3, "pad": "x" * 10}], [{"n": 2, "pad": "x" * 10}], [{"n": 1, "pad": "x" * 10}]]
+    assert not os.path.exists(f"{path}.3")
+
+
+def test_pid_in_the_path_names_the_writing_process(tmp_path):
+    writer = _writer(tmp_path / "logs" / "requests-{pid}.jsonl")
+    writer.submit({"n": 0})
+    writer.close()
+    assert writer.path == str(tmp_path / "logs" / f"requests-{os.getpid()}.jsonl")
+    assert _lines(writer.path) == [{"n": 0}]
+
+
+def test_records_beyond_the_buffer_are_dropped(tmp_path):
+    writer = _writer(tmp_path / "requests.jsonl", max_pending=2)
+    assert [writer.submit({"n": n}) for n in range(4)] == [True, True, False, False]
+    writer.close()
+    assert writer.stats["dropped"] == 2 and writer.stats["written"] == 2
+    assert not writer.submit({"n": 4})  # closed
+
+
+def test_request_collects_annotations_and_stages(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(request_log, "REQUEST_LOG_ENABLED", True)
+    monkeypatch.setattr(request_log.writer, "submit", submitted.append)
+
+    with request_log.request("/chat"):
+        request_log.annotate(query="q" * 5000, route="lesson")
+        for _ in range(2):
+            with request_log.stage("agent"):
+                pass
+    with pytest.raises(ValueError):
+        with request_log.request("/transcribe"):
+            raise ValueError("bad audio")
+    request_log.annotate(route="ignored")  # no current request
+
+    chat, transcribe = submitted
+    assert chat["endpoint"] == "/chat" and chat["route"] == "lesson"
+    assert len(chat["query"]) == request_log.MAX_TEXT_CHARS
+    assert list(chat["stages"]) == ["agent"] and chat["total_ms"] >= 0
+    assert transcribe["outcome"] == "exception" and transcribe["error"] == "ValueError: bad audio"
+
+
+def test_buffered_records_are_flushed_at_exit(tmp_path):
+    path = tmp_path / "requests.jsonl"
+    script = (
+        "import request_log\n"
+        "for n in range(3):\n"
+        "    with request_log.request('/chat'):\n"
+        "        request_log.annotate(n=n)\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, "AIRA_REQUEST_LOG": "1", "AIRA_REQUEST_LOG_PATH": str(path), "AIRA_REQUEST_LOG_FLUSH": "30"}
+    subprocess.run([sys.executable, "-c", script], cwd=root, env=env, check=True, timeout=30)
+    assert [record["n"] for record in _lines(path)] == [0, 1, 2]
@@ -0,0 +1,48 @@
+import pytest
+
+import router
+
+
+@pytest.mark.parametrize("query", [
+    "hi",
+    "Hello teacher!",
+    "thank you so much",
+    "ok",
+    "okay got it, thanks",
+    "good morning everyone",
+    "bye, see you",
+])
+def test_greetings_and_thanks_are_casual(query):
+    assert router.is_casual(query)
+
+
+@pytest.mark.parametrize("query", [
+    "hi photosynthesis",
+    "thanks, why?",
+    "ok explain",
+    "hello, what is an acid",
+    "thanks but how does rusting happen",
+])
+def test_greeting_with_a_real_word_is_not_casual(query):
+    assert not router.is_casual(query)
+
+
+def test_question_without_greeting_is_not_casual():
+    assert not router.is_casual("what is photosynthesis")
+
+
+@pytest.mark.parametrize("query", ["hi photosynthesis", "thanks, why?", "ok explain"])
+def test_route_query_sends_greeting_plus_question_to_the_full_agent(monkeypatch, query):
+    monkeypatch.setattr(router, "ROUTER_ENABLED", True)
+    monkeypatch.setattr(router, "_exact_title_match", lambda norm_query: None)
+    monkeypatch.setattr(router, "score_query", lambda q: {"syllabus_score": 0.9, "retrieval_score": 0.9})
+    decision = router.route_query(query)
+    assert decision["route"] == router.ROUTE_IN_SYLLABUS
+    assert decision["reason"] == "similar to syllabus"
+
+
+def test_route_query_keeps_plain_greetings_on_the_light_path(monkeypatch):
+    monkeypatch.setattr(router, "ROUTER_ENABLED", True)
+    monkeypatch.setattr(router, "score_query", lambda q: pytest.fail("casual turns must not be scored"))
+    decision = router.route_query("thanks so much teacher")
+    assert decision["route"] == router.ROUTE_CASUAL
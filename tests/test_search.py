@@ -0,0 +1,57 @@
+import pytest
+
+import agent_tools
+import utils
+
+METADATA = [
+    {"chapter": "1", "title": "1.2 TYPES OF CHEMICAL REACTIONS"},
+    {"chapter": "1", "title": "1.2.1 Combination Reaction"},
+    {"chapter": "2", "title": "2.1 Understanding the Chemical Properties of Acids and Bases"},
+    {"chapter": "2", "title": "2.1.1 Acids and Bases in the Laboratory"},
+]
+KB_TEXTS = [f"whole subchapter {row}" for row in range(len(METADATA))]
+PASSAGE = {"title_key": "2.1 Understanding the Chemical Properties of Acids and Bases", "chapter": "2",
+           "score": 0.8, "content": "Acids turn blue litmus red."}
+
+
+@pytest.fixture
+def kb(monkeypatch):
+    monkeypatch.setattr(utils, "get_metadata", lambda: METADATA)
+    monkeypatch.setattr(utils, "get_kb_texts", lambda: KB_TEXTS)
+    monkeypatch.setattr(utils, "PASSAGE_BUDGET_CHARS", 1800)
+    passage_queries = []
+
+    def search_passages(query, budget_chars=utils.PASSAGE_BUDGET_CHARS, max_candidates=20):
+        passage_queries.append(query)
+        return [PASSAGE]
+
+    monkeypatch.setattr(utils, "search_passages", search_passages)
+    return passage_queries
+
+
+@pytest.mark.parametrize("query", [
+    "1.2.1 Combination Reaction",
+    "combination reaction",
+    "  Combination reaction. ",
+])
+def test_full_title_is_an_exact_match(kb, query):
+    assert utils.search(query, mode="exact") == [
+        {"title_key": "1.2.1 Combination Reaction", "chapter": "1", "score": 0.0, "content": "whole subchapter 1"}
+    ]
+
+
+@pytest.mark.parametrize("query", ["acid", "reaction", "chemical", "1.2", "combination reaction in daily life"])
+def test_words_from_titles_are_not_exact_matches(kb, query):
+    assert utils.search(query, mode="exact") == []
+
+
+def test_lesson_title_returns_the_whole_subchapter(kb):
+    assert agent_tools.knowledgebase_lookup("Acids and Bases in the Laboratory") == "whole subchapter 3"
+    assert kb == []
+
+
+def test_one_word_doubt_goes_to_passage_mode(kb):
+    output = agent_tools.knowledgebase_lookup("acid")
+    assert kb == ["acid"]
+    assert output == f"[{PASSAGE['title_key']}]\n{PASSAGE['content']}"
+    assert "whole subchapter" not in output
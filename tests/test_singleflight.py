@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight, SingleFlightTimeout, TTLCache, normalize_topic
+
+
+def _waiters(flight, key):
+    with flight._lock:
+        call = flight._calls.get(key)
+        return call.waiters if call is not None else 0
+
+
+def test_concurrent_callers_share_one_execution(spawn, wait_until):
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "lesson"
+
+    leader = spawn(flight.do, "photosynthesis", fn)
+    wait_until(lambda: flight.in_flight() == 1)
+    waiters = [spawn(flight.do, "photosynthesis", fn) for _ in range(3)]
+    wait_until(lambda: _waiters(flight, "photosynthesis") == 3)
+    release.set()
+    for thread in [leader] + waiters:
+        thread.join(5)
+
+    assert calls == [1]
+    assert [(t.result, t.error) for t in [leader] + waiters] == [("lesson", None)] * 4
+    assert flight.in_flight() == 0
+
+
+def test_waiter_receives_the_leaders_exception(spawn, wait_until):
+    flight = SingleFlight("test")
+    release = threading.Event()
+    failure = ValueError("provider down")
+
+    def fn():
+        release.wait(5)
+        raise failure
+
+    leader = spawn(flight.do, "acids", fn)
+    wait_until(lambda: flight.in_flight() == 1)
+    waiter = spawn(flight.do, "acids", lambda: "never called")
+    wait_until(lambda: _waiters(flight, "acids") == 1)
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+
+    assert leader.error is failure and waiter.error is failure
+    # The failed call is not kept: the next caller runs fn again.
+    assert flight.do("acids", lambda: "retried") == "retried"
+
+
+def test_waiter_times_out_on_a_slow_leader(spawn, wait_until):
+    flight = SingleFlight("test")
+    release = threading.Event()
+    spawn(flight.do, "rusting", lambda: release.wait(5))
+    wait_until(lambda: flight.in_flight() == 1)
+    with pytest.raises(SingleFlightTimeout):
+        flight.do("rusting", lambda: "never called", timeout=0.05)
+    release.set()
+
+
+def test_stale_call_is_not_joined(spawn, wait_until):
+    flight = SingleFlight("test", max_age=0)
+    release = threading.Event()
+    spawn(flight.do, "magnets", lambda: release.wait(5))
+    wait_until(lambda: flight.in_flight() == 1)
+    time.sleep(0.01)
+    assert flight.do("magnets", lambda: "fresh") == "fresh"
+    release.set()
+
+
+def test_ttl_cache_expires_and_evicts():
+    cache = TTLCache("test", ttl=0.05, max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.put("c", 3)
+    assert "a" not in cache and cache.get("c") == 3
+    time.sleep(0.06)
+    assert cache.get("c") is None
+    assert cache.get_or_call("c", lambda: 4) == 4
+
+
+def test_normalize_topic():
+    assert normalize_topic("  What is  Photosynthesis?! ") == "what is photosynthesis"
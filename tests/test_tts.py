@@ -0,0 +1,34 @@
+import pytest
+
+import tts
+from tts import split_sentences
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Acids are sour. Bases are bitter! Are salts neutral?",
+     ["Acids are sour.", "Bases are bitter!", "Are salts neutral?"]),
+    ("Water boils at 100.0 degrees. Pi is about 3.14 here.",
+     ["Water boils at 100.0 degrees.", "Pi is about 3.14 here."]),
+    ("Dr. Rao heats the tube. Metals, e.g. zinc, react with acids, i.e. they give off hydrogen.",
+     ["Dr. Rao heats the tube.", "Metals, e.g. zinc, react with acids, i.e. they give off hydrogen."]),
+    ("C. V. Raman studied light scattering. See Fig. 1.2 for the setup.",
+     ["C. V. Raman studied light scattering.", "See Fig. 1.2 for the setup."]),
+    ("First line without a stop\nSecond line", ["First line without a stop", "Second line"]),
+    ("Mg burns (see: images/Figure_1.2.png). **Watch** (YouTube: https://youtu.be/dQw4w9WgXcQ) . . .",
+     ["Mg burns .", "Watch ."]),
+])
+def test_split_sentences(text, expected):
+    assert split_sentences(text) == expected
+
+
+def test_abbreviation_at_a_line_end_does_not_join_lines():
+    assert split_sentences("Reactants, products etc.\nNext topic.") == ["Reactants, products etc.", "Next topic."]
+
+
+def test_long_sentence_is_cut_at_a_comma():
+    text = "Heat the mixture, " * 30 + "then let it cool."
+    sentences = split_sentences(text)
+    assert len(sentences) > 1
+    assert all(len(s) <= tts.TTS_MAX_SENTENCE_CHARS for s in sentences)
+    assert sentences[0].endswith(",")
+    assert " ".join(sentences) == text.strip()
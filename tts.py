@@ -0,0 +1,315 @@
+"""
+Server-side text-to-speech with a sentence-level cache.
+
+Lesson text is cleaned for speech (markdown, figure and video markers, URLs
+removed), split into sentences and synthesized by a local offline engine in a
+worker pool. Audio is streamed in sentence order, so playback can start as soon
+as the first sentence is ready. Every sentence's WAV is cached on disk under
+sha256(engine, voice, rate, sentence), so repeated or pre-generated lessons
+(`pregenerate_lessons.py --tts`) play back with no synthesis cost, and
+concurrent requests for the same sentence share one synthesis.
+
+Engines (AIRA_TTS_ENGINE, default "auto"):
+  piper   neural voices from `pip install piper-tts`; voices are <name>.onnx
+          models (with their .onnx.json config) in AIRA_TTS_VOICES_DIR
+  espeak  the espeak-ng (or espeak) command-line synthesizer
+"auto" picks piper when the package and default voice are present, else espeak.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+from singleflight import SingleFlight
+from utils import PROJECT_ROOT, lazy_resource
+
+try:
+    from piper import PiperVoice  # type: ignore
+except Exception:
+    PiperVoice = None  # type: ignore
+try:
+    from piper import SynthesisConfig  # type: ignore  # piper-tts >= 1.3
+except Exception:
+    SynthesisConfig = None  # type: ignore
+
+TTS_ENGINE = os.environ.get("AIRA_TTS_ENGINE", "auto")
+TTS_VOICES_DIR = os.environ.get("AIRA_TTS_VOICES_DIR", os.path.join(PROJECT_ROOT, "voices"))
+TTS_DEFAULT_VOICE = os.environ.get("AIRA_TTS_VOICE", "")
+TTS_CACHE_DIR = os.environ.get("AIRA_TTS_CACHE_DIR", os.path.join(PROJECT_ROOT, "tts_cache"))
+TTS_WORKERS = int(os.environ.get("AIRA_TTS_WORKERS", "2"))
+TTS_LOOKAHEAD = int(os.environ.get("AIRA_TTS_LOOKAHEAD", "4"))  # sentences queued ahead per stream
+TTS_MAX_CHARS = int(os.environ.get("AIRA_TTS_MAX_CHARS", "20000"))
+TTS_MAX_SENTENCE_CHARS = 300
+TTS_PAUSE_MS = 150  # silence between sentences in the WAV stream
+
+_VOICE_NAME = re.compile(r"^[\w.+-]{1,64}$")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# A period after these (or after an initial, as in "C. V. Raman") does not end a sentence.
+_ABBREVIATION_END = re.compile(r"\b(?:Dr|Mr|Mrs|Ms|Prof|St|Fig|Figs|Eq|approx|etc|vs|viz|e\.g|i\.e|[A-Z])\.$")
+_SPEECH_CLEANUPS = [
+    (re.compile(r"\[LESSON COMPLETE\]", re.I), " "),
+    (re.compile(r"\((?:see|YouTube):[^)]*\)", re.I), " "),
+    (re.compile(r"https?://\S+"), " "),
+    (re.compile(r"!?\[([^\]]*)\]\([^)]*\)"), r"\1"),  # markdown links/images -> their text
+    (re.compile(r"^\s{0,3}(?:#{1,6}|>|[-*+]|\d+[.)])\s+", re.M), ""),  # headings, quotes, list markers
+    (re.compile(r"[*_`~|]+"), " "),
+    (re.compile(r"[ \t]+"), " "),
+]
+
+
+def clean_for_speech(text: str) -> str:
+    for pattern, replacement in _SPEECH_CLEANUPS:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+def _sentence_parts(text: str) -> list:
+    """Lines of text split after . ! or ?, except after abbreviations and initials."""
+    parts = []
+    for line in re.split(r"\n+", text):
+        pieces = _SENTENCE_END.split(line)
+        parts.append(pieces[0])
+        for piece in pieces[1:]:
+            if _ABBREVIATION_END.search(parts[-1]):
+                parts[-1] += " " + piece
+            else:
+                parts.append(piece)
+    return parts
+
+
+def split_sentences(text: str) -> list:
+    """Speakable sentences of a lesson, long ones split at commas or spaces."""
+    sentences = []
+    for part in _sentence_parts(clean_for_speech(text)):
+        part = part.strip()
+        while len(part) > TTS_MAX_SENTENCE_CHARS:
+            cut = part.rfind(", ", 0, TTS_MAX_SENTENCE_CHARS)
+            if cut < TTS_MAX_SENTENCE_CHARS // 2:  # no comma late enough: cut at the last space
+                cut = part.rfind(" ", 0, TTS_MAX_SENTENCE_CHARS)
+            cut = cut if cut > 0 else TTS_MAX_SENTENCE_CHARS
+            sentences.append(part[:cut + 1].strip())
+            part = part[cut + 1:].strip()
+        if re.search(r"\w", part):
+            sentences.append(part)
+    return sentences
+
+
+def _normalize_wav(data: bytes) -> bytes:
+    """Rewrite a WAV with correct sizes (streaming engines write placeholder lengths)."""
+    with wave.open(io.BytesIO(data), "rb") as src:
+        params = src.getparams()
+        frames = src.readframes(src.getnframes())
+    out = io.BytesIO()
+    with wave.open(out, "wb") as dst:
+        dst.setnchannels(params.nchannels)
+        dst.setsampwidth(params.sampwidth)
+        dst.setframerate(params.framerate)
+        dst.writeframes(frames)
+    return out.getvalue()
+
+
+class PiperEngine:
+    name = "piper"
+
+    def __init__(self, voices_dir, default_voice):
+        self.voices_dir = voices_dir
+        self.default_voice = default_voice
+        self._local = threading.local()  # one loaded voice per worker thread
+
+    def voice_path(self, voice):
+        return os.path.join(self.voices_dir, f"{voice}.onnx")
+
+    def available(self):
+        return PiperVoice is not None and bool(self.default_voice) and os.path.exists(self.voice_path(self.default_voice))
+
+    def has_voice(self, voice):
+        return os.path.exists(self.voice_path(voice))
+
+    def _voice(self, voice):
+        voices = getattr(self._local, "voices", None)
+        if voices is None:
+            voices = self._local.voices = {}
+        if voice not in voices:
+            voices[voice] = PiperVoice.load(self.voice_path(voice))
+        return voices[voice]
+
+    def synthesize(self, sentence, voice, rate):
+        piper_voice = self._voice(voice)
+        out = io.BytesIO()
+        with wave.open(out, "wb") as wav_file:
+            if hasattr(piper_voice, "synthesize_wav"):  # piper-tts >= 1.3
+                piper_voice.synthesize_wav(sentence, wav_file, syn_config=SynthesisConfig(length_scale=1.0 / rate))
+            else:
+                piper_voice.synthesize(sentence, wav_file, length_scale=1.0 / rate)
+        return out.getvalue()
+
+
+class EspeakEngine:
+    name = "espeak"
+
+    def __init__(self, default_voice):
+        self.binary = shutil.which("espeak-ng") or shutil.which("espeak")
+        self.default_voice = default_voice or "en-us"
+
+    def available(self):
+        return self.binary is not None
+
+    def has_voice(self, voice):
+        return True  # espeak falls back to its default voice for unknown names
+
+    def synthesize(self, sentence, voice, rate):
+        result = subprocess.run(
+            [self.binary, "-v", voice, "-s", str(int(175 * rate)), "--stdout", sentence],
+            check=True, capture_output=True, timeout=60,
+        )
+        return _normalize_wav(result.stdout)
+
+
+@lazy_resource
+def get_engine():
+    """The configured engine, or None when no offline engine is installed."""
+    candidates = {
+        "piper": lambda: PiperEngine(TTS_VOICES_DIR, TTS_DEFAULT_VOICE),
+        "espeak": lambda: EspeakEngine(TTS_DEFAULT_VOICE),
+    }
+    names = ["piper", "espeak"] if TTS_ENGINE == "auto" else [TTS_ENGINE]
+    for name in names:
+        if name not in candidates:
+            print(f"[WARN] tts: unknown engine '{name}'")
+            continue
+        engine = candidates[name]()
+        if engine.available():
+            print(f"[DEBUG] tts: using {engine.name} engine, default voice '{engine.default_voice}'")
+            return engine
+    print("[WARN] tts: no offline TTS engine available (install piper-tts with a voice, or espeak-ng)")
+    return None
+
+
+@lazy_resource
+def get_pool():
+    return ThreadPoolExecutor(max_workers=max(1, TTS_WORKERS), thread_name_prefix="aira-tts")
+
+
+tts_flight = SingleFlight("tts")
+
+
+def is_available() -> bool:
+    return get_engine() is not None
+
+
+def resolve_voice(voice=None) -> str:
+    """Validate a client-supplied voice name (never a path) against the engine."""
+    engine = get_engine()
+    voice = voice or engine.default_voice
+    if not _VOICE_NAME.match(voice) or not engine.has_voice(voice):
+        raise ValueError(f"Unknown TTS voice '{voice}'")
+    return voice
+
+
+def cache_key(sentence, voice, rate=1.0) -> str:
+    engine = get_engine()
+    text = re.sub(r"\s+", " ", sentence).strip()
+    return hashlib.sha256(f"{engine.name}|{voice}|{rate:.2f}|{text}".encode("utf-8")).hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(TTS_CACHE_DIR, key[:2], f"{key}.wav")
+
+
+def is_cached(sentence, voice, rate=1.0) -> bool:
+    return os.path.exists(_cache_path(cache_key(sentence, voice, rate)))
+
+
+def synthesize_sentence(sentence, voice, rate=1.0) -> bytes:
+    """WAV bytes for one sentence, from the cache or synthesized (and cached) once."""
+    key = cache_key(sentence, voice, rate)
+    path = _cache_path(key)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    def synthesize():
+        data = get_engine().synthesize(sentence, voice, rate)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return data
+
+    return tts_flight.do(key, synthesize)
+
+
+def iter_sentence_audio(sentences, voice, rate=1.0):
+    """
+    Yield (index, sentence, wav_bytes) in order while keeping up to TTS_LOOKAHEAD
+    sentences synthesizing in the shared pool. Closing the generator (client
+    disconnect) cancels the sentences that have not started yet.
+    """
+    pool = get_pool()
+    futures = {}
+    try:
+        for index, sentence in enumerate(sentences):
+            for ahead in range(index, min(len(sentences), index + TTS_LOOKAHEAD)):
+                if ahead not in futures:
+                    futures[ahead] = pool.submit(synthesize_sentence, sentences[ahead], voice, rate)
+            yield index, sentence, futures.pop(index).result()
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+
+def wav_stream_header(sample_rate, channels=1, sample_width=2) -> bytes:
+    """WAV header with open-ended sizes, so PCM can follow as it is synthesized."""
+    byte_rate = sample_rate * channels * sample_width
+    return b"".join([
+        b"RIFF", (0xFFFFFFFF).to_bytes(4, "little"), b"WAVE",
+        b"fmt ", (16).to_bytes(4, "little"), (1).to_bytes(2, "little"), channels.to_bytes(2, "little"),
+        sample_rate.to_bytes(4, "little"), byte_rate.to_bytes(4, "little"),
+        (channels * sample_width).to_bytes(2, "little"), (sample_width * 8).to_bytes(2, "little"),
+        b"data", (0xFFFFFFFF).to_bytes(4, "little"),
+    ])
+
+
+def stream_wav(sentences, voice, rate=1.0):
+    """One continuous WAV: header after the first sentence, then each sentence's PCM."""
+    params = None
+    for _, _, data in iter_sentence_audio(sentences, voice, rate):
+        with wave.open(io.BytesIO(data), "rb") as wav_file:
+            frames = wav_file.readframes(wav_file.getnframes())
+            sentence_params = (wav_file.getframerate(), wav_file.getnchannels(), wav_file.getsampwidth())
+        if params is None:
+            params = sentence_params
+            yield wav_stream_header(*params)
+        elif sentence_params != params:
+            print(f"[WARN] tts: skipping sentence with mismatched audio format {sentence_params}")
+            continue
+        yield frames + b"\x00" * (params[0] * params[1] * params[2] * TTS_PAUSE_MS // 1000)
+
+
+def stream_ndjson(sentences, voice, rate=1.0):
+    """One JSON line per sentence with its text and base64 WAV, for sentence-synchronized playback."""
+    for index, sentence, data in iter_sentence_audio(sentences, voice, rate):
+        yield json.dumps({
+            "index": index,
+            "text": sentence,
+            "audio": base64.b64encode(data).decode("ascii"),
+        }) + "\n"
+
+
+def warm_cache(text, voice=None, rate=1.0) -> int:
+    """Synthesize every sentence of `text` into the cache; returns the number of sentences."""
+    voice = resolve_voice(voice)
+    sentences = split_sentences(text)
+    for _ in iter_sentence_audio(sentences, voice, rate):
+        pass
+    return len(sentences)
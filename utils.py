@@ -1,10 +1,15 @@
 import os
+import re
 import json
-import faiss
-import torch
-import yt_dlp
-import numpy as np
-from sentence_transformers import SentenceTransformer, util
+import threading
+import functools
+
+import encoders
+from corpus import current_shard, shard_resource
+
+# Heavy dependencies (torch, sentence-transformers, faiss, yt-dlp) are imported
+# inside the loaders below so that `import utils` stays cheap and the server can
+# bind its port before models and indexes are in memory.
 
 # Enable debugging prints if needed
 debug_mode = True
@@ -13,58 +18,349 @@ def debug_print(message, level=1):
         prefix = "  " * level
         print(f"{prefix}🔹 {message}")
 
-# CONSTANTS: File paths and folders (adjust if your files are in other locations)
-IMAGE_DIR = "images"
-FIGURES_JSON = "output.json"
-KNOWLEDGEBASE_JSON = "knowledgebase.json"
-METADATA_JSON = "metadata.json"
-FAISS_TEXT_INDEX = "textbook_faiss.index"
-FAISS_FIGURES_INDEX = "subchapter_faiss.index"
-METADATA_FIGURES_JSON = "subchapter_metadata.json"
-
-# Load Knowledge Base and metadata JSON files
-with open(KNOWLEDGEBASE_JSON, "r", encoding="utf-8") as f:
-    kb_data = json.load(f)
-with open(METADATA_JSON, "r", encoding="utf-8") as f:
-    metadata = json.load(f)
+# CONSTANTS: File paths and folders, resolved relative to this file so the
+# module works regardless of the current working directory. Textbook files
+# (knowledge base, FAISS indexes, figures) belong to a corpus shard; see corpus.py.
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+IMAGE_DIR = os.path.join(PROJECT_ROOT, "images")
+
+# Precomputed, mmap-able assets written by build_assets.py into each shard's
+# assets directory. In multi-worker mode (AIRA_MMAP=1) FAISS indexes and these
+# files are memory-mapped, so every worker shares one physical copy through the
+# page cache.
+MMAP_MODE = os.environ.get("AIRA_MMAP", "0") == "1"
+KB_ROWS_ASSET = "kb_rows.json"
+KB_TEXT_ASSET = "kb_text.bin"
+KB_OFFSETS_ASSET = "kb_offsets.npy"
+KB_EMBEDDINGS_ASSET = "kb_embeddings.npy"
+KB_PASSAGES_ASSET = "kb_passages.json"
+KB_PASSAGES_INDEX_ASSET = "kb_passages.index"
+
+# Passage chunking: subchapters are split into overlapping, sentence-aligned
+# passages of about PASSAGE_CHARS characters. Passage search returns the best
+# passages up to PASSAGE_BUDGET_CHARS instead of whole subchapters.
+PASSAGE_CHARS = int(os.environ.get("AIRA_PASSAGE_CHARS", "600"))
+PASSAGE_OVERLAP_CHARS = int(os.environ.get("AIRA_PASSAGE_OVERLAP", "150"))
+PASSAGE_BUDGET_CHARS = int(os.environ.get("AIRA_PASSAGE_BUDGET", "1800"))
+
+
+def lazy_resource(loader):
+    """
+    Turn a zero-argument loader into a thread-safe getter that runs it once.
+    The getter exposes `is_loaded()` so readiness checks never trigger a load.
+    """
+    lock = threading.Lock()
+    state = {}
+
+    @functools.wraps(loader)
+    def getter():
+        if "value" not in state:
+            with lock:
+                if "value" not in state:
+                    state["value"] = loader()
+        return state["value"]
+
+    getter.is_loaded = lambda: "value" in state
+    return getter
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
 
 # Normalize titles helper for consistent searching
 def normalize_title(title):
     return title.strip().lower()
 
+
+# Key for whole-title lookups: case, section numbering and punctuation are ignored,
+# so "combination reaction" names "1.2.1 Combination Reaction".
+def title_key(title):
+    text = re.sub(r"^[\d.\s]+", "", normalize_title(title))
+    return re.sub(r"[^\w]+", " ", text).strip()
+
+
+@shard_resource
+def get_kb_data(shard):
+    return _read_json(shard.file("knowledgebase"))
+
+
+@shard_resource
+def get_metadata(shard):
+    """
+    Row metadata for the textbook FAISS index: one {"chapter", "title"} entry per vector.
+    Falls back to knowledge-base order (the order the index was built in) when
+    metadata.json is not a list of rows.
+    """
+    rows_path = shard.asset(KB_ROWS_ASSET)
+    if MMAP_MODE and os.path.exists(rows_path):
+        return _read_json(rows_path)
+    try:
+        data = _read_json(shard.file("metadata"))
+    except (OSError, ValueError):
+        data = None
+    if isinstance(data, list) and data and isinstance(data[0], dict) and "title" in data[0]:
+        return data
+    return [
+        {"chapter": chapter, "title": title}
+        for chapter, topics in get_kb_data(shard).items()
+        for title in topics
+    ]
+
+
 # Build a dict for quick content retrieval, keys are (chapter, normalized_title)
-normalized_kb = {}
-for chapter, topics in kb_data.items():
-    for title, content in topics.items():
-        norm_key = (chapter, normalize_title(title))
-        normalized_kb[norm_key] = content
+@shard_resource
+def get_normalized_kb(shard):
+    normalized_kb = {}
+    for chapter, topics in get_kb_data(shard).items():
+        for title, content in topics.items():
+            norm_key = (chapter, normalize_title(title))
+            normalized_kb[norm_key] = content
+    return normalized_kb
+
+
+def load_mmap_array(path):
+    """np.load a .npy asset, memory-mapped in multi-worker mode. Returns None if the file is missing."""
+    import numpy as np
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r" if MMAP_MODE else None)
+
+
+class KbText:
+    """
+    Knowledge-base contents addressed by FAISS row number, backed by one
+    memory-mapped UTF-8 blob plus an offsets array (see build_assets.py).
+    """
+
+    def __init__(self, blob_path, offsets_path):
+        import numpy as np
+        self._blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if os.path.getsize(blob_path) else b""
+        self._offsets = np.load(offsets_path, mmap_mode="r")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row):
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        return bytes(self._blob[start:end]).decode("utf-8")
+
+
+@shard_resource
+def get_kb_texts(shard):
+    """Subchapter content for each row of get_metadata() (empty string when missing)."""
+    blob_path, offsets_path = shard.asset(KB_TEXT_ASSET), shard.asset(KB_OFFSETS_ASSET)
+    if MMAP_MODE and os.path.exists(blob_path) and os.path.exists(offsets_path):
+        return KbText(blob_path, offsets_path)
+    normalized_kb = get_normalized_kb(shard)
+    return [
+        normalized_kb.get((item["chapter"], normalize_title(item["title"])), "")
+        for item in get_metadata(shard)
+    ]
+
+
+@shard_resource
+def get_kb_embeddings(shard):
+    """
+    L2-normalized content embeddings, one per row of get_metadata(), or None if
+    build_assets.py has not been run (search then embeds hits on the fly).
+    """
+    path = shard.asset(KB_EMBEDDINGS_ASSET)
+    embeddings = load_mmap_array(path)
+    if embeddings is not None and len(embeddings) != len(get_metadata(shard)):
+        print(f"[WARN] {path} has {len(embeddings)} rows, expected {len(get_metadata(shard))}; ignoring it")
+        return None
+    return embeddings
+
+
+# MiniLM encoder for embeddings and semantic search (torch or ONNX int8, see
+# encoders.py). Text and figure search share one instance.
+@lazy_resource
+def get_model():
+    return encoders.load_encoder()
+
 
-# Set device for model (CUDA if available)
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+def read_faiss_index(path):
+    """Read a FAISS index, memory-mapped and read-only in multi-worker mode."""
+    import faiss
+    if MMAP_MODE:
+        # IO_FLAG_MMAP still copies the codes of IndexFlat* into anonymous memory;
+        # IO_FLAG_MMAP_IFC (faiss >= 1.8) maps them in place from the page cache.
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            print(f"[WARN] Could not memory-map {path} ({e}); loading it into memory")
+    return faiss.read_index(path)
 
-# Load SentenceTransformer model for embeddings and semantic search
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-model.to(device)
 
-# Load FAISS index for textbook content
-faiss_index = faiss.read_index(FAISS_TEXT_INDEX)
+# FAISS index for textbook content
+@shard_resource
+def get_faiss_index(shard):
+    return read_faiss_index(shard.file("text_index"))
 
-# Main search function implementing hybrid exact + semantic search
-def search(query, top_k=5, similarity_threshold=0.98, mode="hybrid"):
-    norm_query = normalize_title(query)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def chunk_text(text, max_chars=PASSAGE_CHARS, overlap_chars=PASSAGE_OVERLAP_CHARS):
+    """
+    Split text into overlapping passages and return their (start, end) character spans.
+    Passages end on sentence boundaries where possible; consecutive passages share
+    up to `overlap_chars` of trailing sentences so no fact is cut in half.
+    """
+    # Sentence spans, with over-long sentences hard-split at whitespace.
+    sentences = []
+    start = 0
+    for boundary in list(_SENTENCE_END.finditer(text)) + [None]:
+        end = boundary.start() if boundary else len(text)
+        while end - start > max_chars:
+            cut = text.rfind(" ", start + 1, start + max_chars)
+            cut = cut if cut > start else start + max_chars
+            sentences.append((start, cut))
+            start = cut + 1 if text[cut:cut + 1] == " " else cut
+        if end > start:
+            sentences.append((start, end))
+        start = boundary.end() if boundary else len(text)
+
+    spans = []
+    i = 0
+    while i < len(sentences):
+        j = i
+        while j + 1 < len(sentences) and sentences[j + 1][1] - sentences[i][0] <= max_chars:
+            j += 1
+        spans.append((sentences[i][0], sentences[j][1]))
+        if j + 1 >= len(sentences):
+            break
+        # Start the next passage with the trailing sentences that fit in the overlap.
+        k = j + 1
+        while k - 1 > i and sentences[j][1] - sentences[k - 1][0] <= overlap_chars:
+            k -= 1
+        i = k
+    return spans
+
+
+def iter_passages(shard=None):
+    """Yield {"row", "start", "end"} for every passage of every knowledge-base row."""
+    for row, text in enumerate(get_kb_texts(shard)):
+        for start, end in chunk_text(text):
+            yield {"row": row, "start": start, "end": end}
+
+
+@shard_resource
+def get_passages(shard):
+    """
+    Passage spans into get_kb_texts() rows. Uses kb_passages.json from
+    build_assets.py when it matches the current chunking settings, else chunks now.
+    """
+    path = shard.asset(KB_PASSAGES_ASSET)
+    if os.path.exists(path):
+        data = _read_json(path)
+        if (data.get("max_chars"), data.get("overlap_chars"), data.get("rows")) == (
+            PASSAGE_CHARS, PASSAGE_OVERLAP_CHARS, len(get_metadata(shard))
+        ):
+            return data["passages"]
+        print(f"[WARN] {path} was built with different chunking settings; re-chunking")
+    return list(iter_passages(shard))
+
+
+def passage_text(passage, shard=None):
+    return get_kb_texts(shard)[passage["row"]][passage["start"]:passage["end"]]
+
+
+@shard_resource
+def get_passage_index(shard):
+    """
+    Inner-product FAISS index over normalized passage embeddings (row i = get_passages()[i]).
+    Built in memory when build_assets.py has not produced a matching kb_passages.index.
+    """
+    passages = get_passages(shard)
+    index = _prebuilt_passage_index(shard, passages)
+    if index is not None:
+        return index
+    import faiss
+    embeddings = get_model().encode(
+        [passage_text(p, shard) for p in passages], convert_to_numpy=True, normalize_embeddings=True
+    ).astype("float32")
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(embeddings)
+    return index
+
+
+def _prebuilt_passage_index(shard, passages):
+    """kb_passages.index from build_assets.py if it matches `passages`, else None."""
+    path = shard.asset(KB_PASSAGES_INDEX_ASSET)
+    if not os.path.exists(path):
+        print(f"[WARN] {path} not found; embedding {len(passages)} passages in memory (run build_assets.py)")
+        return None
+    index = read_faiss_index(path)
+    if index.ntotal != len(passages):
+        print(f"[WARN] {path} has {index.ntotal} vectors, expected {len(passages)}; rebuilding in memory")
+        return None
+    return index
+
+
+def search_passages(query, budget_chars=PASSAGE_BUDGET_CHARS, max_candidates=20):
+    """
+    Best-matching passages for a query, highest similarity first, until their
+    combined length reaches `budget_chars`. Passages that mostly overlap one
+    already selected (neighbours in the same subchapter) are skipped.
+    """
+    metadata = get_metadata()
+    passages = get_passages()
+    index = get_passage_index()
+    query_embedding = get_model().encode([query], convert_to_numpy=True, normalize_embeddings=True).astype("float32")
+    scores, indices = index.search(query_embedding, min(max_candidates, index.ntotal))
+    results = []
+    used = 0
+    for score, idx in zip(scores[0], indices[0]):
+        if idx < 0:
+            continue
+        passage = passages[idx]
+        length = passage["end"] - passage["start"]
+        if length <= 0 or any(
+            prev["row"] == passage["row"]
+            and min(prev["end"], passage["end"]) - max(prev["start"], passage["start"]) > length // 2
+            for prev in results
+        ):
+            continue
+        if results and used + length > budget_chars:
+            break
+        item = metadata[passage["row"]]
+        results.append({
+            "title_key": item["title"],
+            "chapter": item["chapter"],
+            "score": float(score),
+            "content": passage_text(passage),
+            "row": passage["row"],
+            "start": passage["start"],
+            "end": passage["end"],
+        })
+        used += length
+    return results
+
+
+# Main search function implementing hybrid exact + semantic search.
+# "Exact" means the query is a whole subchapter title (see title_key); a word that
+# merely appears in titles ("acid", "metal") is not, and falls through to semantic.
+# mode="passage" returns budgeted passages instead of whole subchapters.
+def search(query, top_k=5, similarity_threshold=0.98, mode="hybrid", budget_chars=PASSAGE_BUDGET_CHARS):
+    query_key = title_key(query)
+    metadata = get_metadata()
+    kb_texts = get_kb_texts()
     results = []
     seen_embeddings = []
     seen_titles = set()
 
     # Exact match search helper
     def get_exact_matches():
-        for item in metadata:
+        for row, item in enumerate(metadata):
             title = item["title"]
             chapter = item["chapter"]
-            norm_title = normalize_title(title)
-            if norm_query in norm_title:
-                norm_key = (chapter, norm_title)
-                content = normalized_kb.get(norm_key)
+            if query_key and title_key(title) == query_key:
+                norm_key = (chapter, normalize_title(title))
+                content = kb_texts[row]
                 if content:
                     seen_titles.add(norm_key)
                     return [{
@@ -77,22 +373,30 @@ def search(query, top_k=5, similarity_threshold=0.98, mode="hybrid"):
 
     # Semantic match search helper
     def get_semantic_matches():
+        model = get_model()
+        kb_embeddings = get_kb_embeddings()
         query_embedding = model.encode([query], convert_to_numpy=True)
-        distances, indices = faiss_index.search(query_embedding, top_k)
+        distances, indices = get_faiss_index().search(query_embedding, top_k)
         semantic_results = []
         for i in range(len(indices[0])):
             idx = indices[0][i]
+            if idx < 0:
+                continue
             raw_title = metadata[idx]["title"]
             chapter = metadata[idx]["chapter"]
             norm_key = (chapter, normalize_title(raw_title))
-            content = normalized_kb.get(norm_key)
+            content = kb_texts[idx]
             if content and norm_key not in seen_titles:
-                content_embedding = model.encode(content, convert_to_tensor=True)
-                is_duplicate = False
-                for prev_emb in seen_embeddings:
-                    if util.cos_sim(content_embedding, prev_emb).item() >= similarity_threshold:
-                        is_duplicate = True
-                        break
+                # Precomputed (normalized) embeddings turn the near-duplicate check
+                # into a dot product instead of re-encoding every hit.
+                if kb_embeddings is not None:
+                    content_embedding = kb_embeddings[idx]
+                else:
+                    content_embedding = model.encode(content, convert_to_numpy=True, normalize_embeddings=True)
+                is_duplicate = any(
+                    float(content_embedding @ prev_emb) >= similarity_threshold
+                    for prev_emb in seen_embeddings
+                )
                 if not is_duplicate:
                     seen_embeddings.append(content_embedding)
                     seen_titles.add(norm_key)
@@ -104,7 +408,9 @@ def search(query, top_k=5, similarity_threshold=0.98, mode="hybrid"):
                     })
         return semantic_results
 
-    if mode == "exact":
+    if mode == "passage":
+        results = search_passages(query, budget_chars=budget_chars)
+    elif mode == "exact":
         results = get_exact_matches()
     elif mode == "semantic":
         results = get_semantic_matches()
@@ -114,37 +420,90 @@ def search(query, top_k=5, similarity_threshold=0.98, mode="hybrid"):
             results = get_semantic_matches()
     return results
 
-# Load figures data and metadata for image retrieval
-with open(FIGURES_JSON, "r", encoding="utf-8") as f:
-    figures_data = json.load(f)
+# Figures data and metadata for image retrieval
+@shard_resource
+def get_figures_data(shard):
+    return _read_json(shard.file("figures"))
+
+
+# Separate FAISS index for figures/subchapter search
+@shard_resource
+def get_fig_faiss_index(shard):
+    return read_faiss_index(shard.file("figure_index"))
+
+
+@shard_resource
+def get_metadata_figures(shard):
+    return _read_json(shard.file("figure_metadata"))
 
-# Separate model and FAISS index for figures/subchapter search
-image_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2").to(device)
-fig_faiss_index = faiss.read_index(FAISS_FIGURES_INDEX)
 
-with open(METADATA_FIGURES_JSON, "r", encoding="utf-8") as f:
-    metadata_figures = json.load(f)
+def warmup():
+    """
+    Load every model, index and JSON file of the current shard up front (used by
+    the server's startup warmup). Other shards load on first use.
+    """
+    get_metadata()
+    get_kb_texts()
+    get_kb_embeddings()
+    get_model()
+    get_faiss_index()
+    get_passage_index()
+    get_figures_data()
+    get_fig_faiss_index()
+    get_metadata_figures()
+
+
+def preload_assets():
+    """
+    The file-backed part of `warmup()`: JSON, .npy and FAISS files of the current
+    shard, memory-mapped with AIRA_MMAP=1. Never loads or runs the encoder, so a
+    pre-fork master can call it and share the mapped pages with its workers; the
+    passage index is skipped when it would have to be embedded (no or stale
+    build_assets.py output).
+    """
+    get_metadata()
+    get_kb_texts()
+    get_kb_embeddings()
+    get_faiss_index()
+    get_fig_faiss_index()
+    get_figures_data()
+    get_metadata_figures()
+    if _prebuilt_passage_index(current_shard(), get_passages()) is not None:
+        get_passage_index()
+
+
+def is_ready():
+    """True once `warmup()` (or first use) has loaded the model and the current shard's indexes."""
+    return get_model.is_loaded() and get_faiss_index.is_loaded() and get_fig_faiss_index.is_loaded()
+
 
 # Search exact figure subchapter helper
 def search_exact_subchapter(query, top_k=1):
-    query_embedding = image_model.encode([query], convert_to_numpy=True).astype('float32').reshape(1, -1)
-    _, indices = fig_faiss_index.search(query_embedding, top_k)
+    query_embedding = get_model().encode([query], convert_to_numpy=True).astype('float32').reshape(1, -1)
+    _, indices = get_fig_faiss_index().search(query_embedding, top_k)
     best_index = str(indices[0][0])
-    return metadata_figures.get(best_index, None)
+    return get_metadata_figures().get(best_index, None)
 
 # Retrieve local image path for a figure, trying common extensions and patterns
+def get_image_dirs(shard=None):
+    """Image folders searched for a shard's figures: its own images/, then the shared one."""
+    shard = shard or current_shard()
+    return [shard.images_dir] if shard.images_dir == IMAGE_DIR else [shard.images_dir, IMAGE_DIR]
+
+
 def get_image_path(figure_ref):
     base_name = figure_ref.replace(" ", "_")
     attempts = [f"{base_name}.png", f"{base_name}.jpg", f"figure_{base_name}.png"]
-    for attempt in attempts:
-        test_path = os.path.join(IMAGE_DIR, attempt)
-        if os.path.exists(test_path):
-            return test_path
+    for image_dir in get_image_dirs():
+        for attempt in attempts:
+            test_path = os.path.join(image_dir, attempt)
+            if os.path.exists(test_path):
+                return test_path
     return None
 
 # Fetch only figures metadata + path for a given subchapter name
 def fetch_figures_only(subchapter_name):
-    figures = [fig for fig in figures_data if fig["subchapter"] == subchapter_name]
+    figures = [fig for fig in get_figures_data() if fig["subchapter"] == subchapter_name]
     if not figures:
         return "No relevant figures found."
     figure_blocks = []
@@ -182,6 +541,7 @@ def retrieve_and_expand_figures(query):
 
 # Fetch animated explainer videos from YouTube via yt-dlp
 def fetch_animated_videos(topic, num_videos=1):
+    import yt_dlp
     search_query = f"ytsearch{num_videos}:{topic} animation explained in english"
     ydl_opts = {
         "quiet": True,